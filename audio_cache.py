@@ -0,0 +1,232 @@
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from reaper import run_claimed
+
+_VIDEO_ID = re.compile(r'^[A-Za-z0-9_-]{6,64}$')
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AudioCache:
+    """On-disk LRU cache of Ogg Opus audio keyed by video ID.
+
+    Storing a track downloads it a second time next to playback, so only tracks played
+    ``min_plays`` times since start-up are stored. Files are written to a temporary name,
+    hashed and renamed into place once complete; a hit checks the file's size and
+    modification time against the index, and a file that changed is hashed again.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_track_seconds: int = 900, max_concurrent_stores: int = 2,
+                 min_plays: int = 2, max_counted: int = 10_000):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_track_seconds = max_track_seconds
+        self.min_plays = min_plays
+        self.max_counted = max_counted
+        # Called as on_stored(video_id, path, duration) once a track is in the cache
+        self.on_stored: Optional[Callable[[str, str, int], None]] = None
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.stores = 0
+        self.store_failures = 0
+        self.evictions = 0
+        self.corrupt = 0
+        self._storing = set()
+        self._plays: OrderedDict = OrderedDict()  # video ID -> misses counted, least recent first
+        self.pids = set()  # ffmpeg processes writing to the cache right now
+        self._tasks = set()
+        self._store_slots = asyncio.Semaphore(max_concurrent_stores)
+
+        self._db = sqlite3.connect(os.path.join(directory, 'index.sqlite3'))
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS audio (
+                video_id TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                mtime_ns INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        if 'mtime_ns' not in {row[1] for row in self._db.execute('PRAGMA table_info(audio)')}:
+            # Entries from before hits were checked by modification time get hashed on their next hit
+            self._db.execute('ALTER TABLE audio ADD COLUMN mtime_ns INTEGER NOT NULL DEFAULT 0')
+        self._db.execute('CREATE INDEX IF NOT EXISTS audio_last_used ON audio (last_used)')
+        self._db.commit()
+        self.total_bytes = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM audio').fetchone()[0]
+        self._remove_stray_files()
+
+    def _remove_stray_files(self):
+        # Leftovers from interrupted writes, or files that lost their index entry
+        known = {row[0] for row in self._db.execute('SELECT video_id FROM audio')}
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp') or (name.endswith('.opus') and name[:-5] not in known):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def path_for(self, video_id: str) -> str:
+        return os.path.join(self.directory, f"{video_id}.opus")
+
+    def __contains__(self, video_id: Optional[str]) -> bool:
+        if not video_id:
+            return False
+        return self._db.execute('SELECT 1 FROM audio WHERE video_id = ?', (video_id,)).fetchone() is not None
+
+    async def get(self, video_id: Optional[str]) -> Optional[str]:
+        """Path of a verified cached file for ``video_id``, or None on a miss"""
+        row = None
+        if video_id:
+            row = self._db.execute('SELECT size, sha256, mtime_ns FROM audio WHERE video_id = ?', (video_id,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        size, sha256, mtime_ns = row
+        path = self.path_for(video_id)
+        try:
+            stat = os.stat(path)
+            valid = stat.st_size == size
+            if valid and stat.st_mtime_ns != mtime_ns:
+                # Touched since it was written; only the contents can tell whether it's intact
+                digest = await asyncio.get_running_loop().run_in_executor(None, _file_digest, path)
+                valid = digest == sha256
+                if valid:
+                    self._db.execute('UPDATE audio SET mtime_ns = ? WHERE video_id = ?', (stat.st_mtime_ns, video_id))
+        except OSError:
+            valid = False
+        if not valid:
+            print(f"Audio cache entry for {video_id} failed its integrity check, dropping it")
+            self.corrupt += 1
+            self.misses += 1
+            self._delete(video_id)
+            return None
+
+        self._db.execute('UPDATE audio SET last_used = ? WHERE video_id = ?', (time.time(), video_id))
+        self._db.commit()
+        self.hits += 1
+        self.bytes_saved += size
+        return path
+
+    def storing(self, video_id: Optional[str]) -> bool:
+        return video_id in self._storing
+
+    def schedule_store(self, video_id: Optional[str], url: str, codec: Optional[str], duration: Optional[int]) -> bool:
+        """Count a play streamed from ``url``; cache its audio in the background once the
+        track has been played often enough. Returns whether a store was started"""
+        if not video_id or not _VIDEO_ID.match(video_id) or video_id in self._storing or video_id in self:
+            return False
+        # Live streams have no duration
+        if not duration or duration > self.max_track_seconds:
+            return False
+        plays = self._plays.pop(video_id, 0) + 1
+        if plays < self.min_plays:
+            self._plays[video_id] = plays
+            if len(self._plays) > self.max_counted:
+                self._plays.popitem(last=False)
+            return False
+        self._storing.add(video_id)
+        task = asyncio.get_running_loop().create_task(self._store(video_id, url, codec, duration))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _store(self, video_id: str, url: str, codec: Optional[str], duration: int):
+        path = self.path_for(video_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            # Opus sources are remuxed as-is; anything else is encoded once here
+            encode = ['-c:a', 'copy'] if codec == 'opus' else ['-c:a', 'libopus', '-b:a', '128k']
+            returncode, stderr = await run_claimed([
+                'ffmpeg', '-nostdin', '-loglevel', 'error',
+                '-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5',
+                '-i', url, '-vn', *encode, '-f', 'ogg', '-y', tmp_path,
+            ], self.pids, self._store_slots)
+            if returncode != 0:
+                raise Exception(stderr.strip() or f"ffmpeg exited with {returncode}")
+
+            loop = asyncio.get_running_loop()
+            sha256 = await loop.run_in_executor(None, _file_digest, tmp_path)
+            os.replace(tmp_path, path)
+            stat = os.stat(path)
+
+            now = time.time()
+            self._db.execute(
+                'INSERT OR REPLACE INTO audio (video_id, size, sha256, created_at, last_used, mtime_ns) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (video_id, stat.st_size, sha256, now, now, stat.st_mtime_ns)
+            )
+            self._db.commit()
+            self.total_bytes += stat.st_size
+            self.stores += 1
+            self._evict()
+            if self.on_stored is not None and video_id in self:
+                self.on_stored(video_id, path, duration)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error caching audio for {video_id}: {str(e)}")
+            self.store_failures += 1
+        finally:
+            self._storing.discard(video_id)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _delete(self, video_id: str):
+        row = self._db.execute('SELECT size FROM audio WHERE video_id = ?', (video_id,)).fetchone()
+        if row:
+            self._db.execute('DELETE FROM audio WHERE video_id = ?', (video_id,))
+            self._db.commit()
+            self.total_bytes -= row[0]
+        try:
+            os.remove(self.path_for(video_id))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes:
+            row = self._db.execute('SELECT video_id FROM audio ORDER BY last_used ASC LIMIT 1').fetchone()
+            if row is None:
+                break
+            self._delete(row[0])
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': self._db.execute('SELECT COUNT(*) FROM audio').fetchone()[0],
+            'bytes': self.total_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'bytes_saved': self.bytes_saved,
+            'stores': self.stores,
+            'store_failures': self.store_failures,
+            'evictions': self.evictions,
+            'corrupt': self.corrupt,
+            'storing': len(self._storing),
+        }
+
+    def close(self):
+        # Stores still running are cancelled; their ffmpeg is killed and the partial file removed
+        for task in list(self._tasks):
+            task.cancel()
+        self._db.close()
@@ -0,0 +1,453 @@
+"""Audio worker processes.
+
+The control process (the bot) keeps the gateway and voice connections, while a pool
+of worker processes runs ffmpeg and turns each guild's stream into 20 ms Opus
+packets. The control side only hands those packets to discord.py's voice player, so
+a worker busy with heavy streams, or one that crashes, only affects its own guilds.
+
+Protocol, as tuples over a multiprocessing pipe:
+
+    control -> worker
+        ('play', guild_id, generation, location, start, before_options, options, copy)
+        ('seek', guild_id, generation, position)
+        ('pause', guild_id) / ('resume', guild_id)
+        ('ack', guild_id, generation, frames)     frames consumed, returns send credit
+        ('stop', guild_id)
+        ('status', request_id)
+        ('shutdown',)
+
+    worker -> control
+        ('frames', guild_id, generation, [packet, ...])
+        ('end', guild_id, generation, error or None)
+        ('status', request_id, {guild_id: {...}})
+
+Workers only send a bounded window of packets ahead of what the voice player has
+consumed, so buffering stays small and pausing needs no extra bookkeeping.
+"""
+import asyncio
+import itertools
+import multiprocessing
+import queue
+import shlex
+import signal
+import subprocess
+import threading
+from typing import Dict, List, Optional
+
+import discord
+from discord.oggparse import OggStream
+
+FRAME_SECONDS = 0.02
+# Packets a worker may send ahead of the voice player (3 seconds)
+WINDOW = 150
+BATCH = 10
+ACK_EVERY = 25
+# How long the voice player waits for a packet before sending silence instead
+READ_TIMEOUT = 0.5
+# How long a new (or moved) stream may take to produce its first packet
+STARTUP_TIMEOUT = 30.0
+OPUS_SILENCE = b'\xf8\xff\xfe'
+
+
+def ffmpeg_command(location: str, start: float, before_options: Optional[str], options: Optional[str], copy: bool) -> List[str]:
+    # Mirrors discord.FFmpegOpusAudio, plus an input seek
+    args = ['ffmpeg']
+    if before_options:
+        args.extend(shlex.split(before_options))
+    if start:
+        args.extend(('-ss', f'{start:.2f}'))
+    args.extend(('-i', location, '-map_metadata', '-1', '-f', 'opus', '-c:a', 'copy' if copy else 'libopus',
+                 '-ar', '48000', '-ac', '2', '-b:a', '128k', '-loglevel', 'warning'))
+    if options:
+        args.extend(shlex.split(options))
+    args.append('pipe:1')
+    return args
+
+
+# Worker process side
+
+class _Session(threading.Thread):
+    def __init__(self, send, guild_id: int, generation: int, location: str, start: float,
+                 before_options: Optional[str], options: Optional[str], copy: bool):
+        super().__init__(daemon=True, name=f'audio-{guild_id}')
+        self.send = send
+        self.guild_id = guild_id
+        self.generation = generation
+        self.args = (location, before_options, options, copy)
+        self.start_position = start
+        self.sent = 0
+        self.credit = WINDOW
+        self.paused = False
+        self.stopped = False
+        self.process: Optional[subprocess.Popen] = None
+        self.condition = threading.Condition()
+
+    @property
+    def position(self) -> float:
+        return self.start_position + self.sent * FRAME_SECONDS
+
+    def run(self):
+        location, before_options, options, copy = self.args
+        error = None
+        try:
+            self.process = subprocess.Popen(
+                ffmpeg_command(location, self.start_position, before_options, options, copy),
+                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE
+            )
+            batch = []
+            for packet in OggStream(self.process.stdout).iter_packets():
+                if self.stopped:
+                    return
+                batch.append(packet)
+                if len(batch) >= BATCH or len(batch) >= self._available():
+                    self._flush(batch)
+                    batch = []
+            if batch:
+                self._flush(batch)
+            if self.process.wait() not in (0, None) and not self.stopped and not self.sent:
+                error = f"ffmpeg exited with {self.process.returncode}"
+        except Exception as e:
+            error = str(e)
+        finally:
+            self._kill()
+            if not self.stopped:
+                self.send(('end', self.guild_id, self.generation, error))
+
+    def _available(self) -> int:
+        with self.condition:
+            return 0 if self.paused else self.credit
+
+    def _flush(self, batch: list):
+        with self.condition:
+            while not self.stopped and (self.paused or self.credit < len(batch)):
+                self.condition.wait(0.5)
+            if self.stopped:
+                return
+            self.credit -= len(batch)
+        self.sent += len(batch)
+        self.send(('frames', self.guild_id, self.generation, batch))
+
+    def ack(self, frames: int):
+        with self.condition:
+            self.credit += frames
+            self.condition.notify()
+
+    def set_paused(self, paused: bool):
+        with self.condition:
+            self.paused = paused
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self._kill()
+
+    def _kill(self):
+        if self.process and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+
+def worker_main(conn):
+    # Ctrl+C is handled by the control process, which shuts workers down itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    send_lock = threading.Lock()
+    sessions: Dict[int, _Session] = {}
+
+    def send(message):
+        with send_lock:
+            try:
+                conn.send(message)
+            except (BrokenPipeError, OSError):
+                pass
+
+    def start(guild_id, generation, location, start, before_options, options, copy):
+        old = sessions.pop(guild_id, None)
+        if old:
+            old.stop()
+        session = _Session(send, guild_id, generation, location, start, before_options, options, copy)
+        sessions[guild_id] = session
+        session.start()
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        op = message[0]
+        if op == 'play':
+            start(*message[1:])
+        elif op == 'seek':
+            _, guild_id, generation, position = message
+            session = sessions.get(guild_id)
+            if session:
+                location, before_options, options, copy = session.args
+                start(guild_id, generation, location, position, before_options, options, copy)
+        elif op == 'ack':
+            _, guild_id, generation, frames = message
+            session = sessions.get(guild_id)
+            if session and session.generation == generation:
+                session.ack(frames)
+        elif op in ('pause', 'resume'):
+            session = sessions.get(message[1])
+            if session:
+                session.set_paused(op == 'pause')
+        elif op == 'stop':
+            session = sessions.pop(message[1], None)
+            if session:
+                session.stop()
+        elif op == 'status':
+            for guild_id in [g for g, s in sessions.items() if not s.is_alive() and s.ident]:
+                del sessions[guild_id]
+            send(('status', message[1], {
+                guild_id: {'generation': s.generation, 'position': s.position, 'paused': s.paused}
+                for guild_id, s in sessions.items()
+            }))
+        elif op == 'shutdown':
+            break
+
+    for session in sessions.values():
+        session.stop()
+
+
+# Control process side
+
+class WorkerAudioSource(discord.AudioSource):
+    """Opus packets produced for one guild by an audio worker"""
+
+    def __init__(self, pool: 'AudioWorkerPool', guild_id: int, location: str, *, start: float = 0.0,
+                 before_options: Optional[str] = None, options: Optional[str] = None, copy: bool = False):
+        self.pool = pool
+        self.guild_id = guild_id
+        self.location = location
+        self.before_options = before_options
+        self.options = options
+        self.copy = copy
+        self.start_position = start
+        self.generation = 0
+        self.frames_read = 0
+        self.worker: Optional['AudioWorker'] = None
+        self._packets: queue.Queue = queue.Queue()
+        self._unacked = 0
+        self._error: Optional[str] = None
+        self._finished = False
+
+    def is_opus(self) -> bool:
+        return True
+
+    @property
+    def position(self) -> float:
+        return self.start_position + self.frames_read * FRAME_SECONDS
+
+    def read(self) -> bytes:
+        if self._finished:
+            return b''
+        try:
+            packet = self._packets.get(timeout=READ_TIMEOUT if self.frames_read else STARTUP_TIMEOUT)
+        except queue.Empty:
+            if not self.frames_read:
+                raise Exception("Audio worker did not start the stream")
+            # Worker is behind; keep the voice connection fed
+            return OPUS_SILENCE
+        if packet is None:
+            self._finished = True
+            if self._error:
+                raise Exception(self._error)
+            return b''
+        self.frames_read += 1
+        self._unacked += 1
+        if self._unacked >= ACK_EVERY:
+            self.pool.send(self.worker, ('ack', self.guild_id, self.generation, self._unacked))
+            self._unacked = 0
+        return packet
+
+    def _restart(self, start: float):
+        # Drop anything buffered from the previous stream
+        self.generation += 1
+        self.start_position = start
+        self.frames_read = 0
+        self._unacked = 0
+        while True:
+            try:
+                self._packets.get_nowait()
+            except queue.Empty:
+                break
+
+    def deliver(self, generation: int, packets: list):
+        if generation == self.generation:
+            for packet in packets:
+                self._packets.put(packet)
+
+    def finish(self, generation: int, error: Optional[str]):
+        if generation == self.generation:
+            self._error = error
+            self._packets.put(None)
+
+    def seek(self, position: float):
+        self._restart(position)
+        self.pool.send(self.worker, ('seek', self.guild_id, self.generation, position))
+
+    def pause(self):
+        self.pool.send(self.worker, ('pause', self.guild_id))
+
+    def resume(self):
+        self.pool.send(self.worker, ('resume', self.guild_id))
+
+    def cleanup(self):
+        self.pool.release(self)
+
+
+class AudioWorker:
+    def __init__(self, pool: 'AudioWorkerPool', index: int):
+        self.pool = pool
+        self.index = index
+        self.restarts = -1
+        self.sources: Dict[int, WorkerAudioSource] = {}
+        self.process = None
+        self.conn = None
+        self.send_lock = threading.Lock()
+        self.start()
+
+    def start(self):
+        context = multiprocessing.get_context('spawn')
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=worker_main, args=(child_conn,), daemon=True, name=f'audio-worker-{self.index}')
+        self.process.start()
+        child_conn.close()
+        self.restarts += 1
+        threading.Thread(target=self._read_loop, args=(self.conn,), daemon=True, name=f'audio-worker-{self.index}-reader').start()
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def _read_loop(self, conn):
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                break
+            op = message[0]
+            if op == 'frames':
+                source = self.sources.get(message[1])
+                if source:
+                    source.deliver(message[2], message[3])
+            elif op == 'end':
+                source = self.sources.get(message[1])
+                if source:
+                    source.finish(message[2], message[3])
+            elif op == 'status':
+                self.pool._status_reply(message[1], self, message[2])
+        if conn is self.conn and not self.pool.closed:
+            self.pool._worker_died(self)
+
+
+class AudioWorkerPool:
+    """Places guilds on the least-loaded audio worker and restarts workers that die"""
+
+    def __init__(self, workers: int):
+        self.closed = False
+        self.crashes = 0
+        self._lock = threading.Lock()
+        self._status_requests = itertools.count()
+        self._status_waiters: Dict[int, tuple] = {}
+        self.workers = [AudioWorker(self, index) for index in range(workers)]
+
+    def send(self, worker: Optional[AudioWorker], message: tuple):
+        if worker is None:
+            return
+        with worker.send_lock:
+            try:
+                worker.conn.send(message)
+            except (BrokenPipeError, OSError):
+                # The reader thread notices the dead worker and moves its guilds
+                pass
+
+    def _least_loaded(self) -> AudioWorker:
+        return min(self.workers, key=lambda worker: (not worker.alive, len(worker.sources)))
+
+    def play(self, guild_id: int, location: str, *, start: float = 0.0, before_options: Optional[str] = None,
+             options: Optional[str] = None, copy: bool = False) -> WorkerAudioSource:
+        source = WorkerAudioSource(self, guild_id, location, start=start, before_options=before_options, options=options, copy=copy)
+        self.place(source)
+        return source
+
+    def place(self, source: WorkerAudioSource):
+        with self._lock:
+            for worker in self.workers:
+                previous = worker.sources.get(source.guild_id)
+                if previous is not None and previous is not source:
+                    # A guild only ever has one stream
+                    del worker.sources[source.guild_id]
+                    self.send(worker, ('stop', source.guild_id))
+            worker = self._least_loaded()
+            worker.sources[source.guild_id] = source
+            source.worker = worker
+        self.send(worker, ('play', source.guild_id, source.generation, source.location, source.start_position,
+                           source.before_options, source.options, source.copy))
+
+    def release(self, source: WorkerAudioSource):
+        with self._lock:
+            worker = source.worker
+            if worker and worker.sources.get(source.guild_id) is source:
+                del worker.sources[source.guild_id]
+            else:
+                worker = None
+        self.send(worker, ('stop', source.guild_id))
+
+    def _worker_died(self, worker: AudioWorker):
+        print(f"Audio worker {worker.index} died, restarting it and moving {len(worker.sources)} guilds")
+        self.crashes += 1
+        with self._lock:
+            orphans = list(worker.sources.values())
+            worker.sources.clear()
+            worker.start()
+        for source in orphans:
+            # Resume where the listener was rather than restarting the song
+            source._restart(source.position)
+            self.place(source)
+
+    async def status(self, timeout: float = 2.0) -> List[dict]:
+        loop = asyncio.get_running_loop()
+        futures = []
+        for worker in self.workers:
+            request_id = next(self._status_requests)
+            future = loop.create_future()
+            self._status_waiters[request_id] = (loop, future)
+            futures.append((worker, request_id, future))
+            self.send(worker, ('status', request_id))
+
+        results = []
+        for worker, request_id, future in futures:
+            try:
+                sessions = await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                sessions = None
+            finally:
+                self._status_waiters.pop(request_id, None)
+            results.append({
+                'index': worker.index,
+                'pid': worker.process.pid if worker.process else None,
+                'alive': worker.alive and sessions is not None,
+                'guilds': len(worker.sources),
+                'restarts': worker.restarts,
+                'sessions': sessions or {},
+            })
+        return results
+
+    def _status_reply(self, request_id: int, worker: AudioWorker, sessions: dict):
+        waiter = self._status_waiters.get(request_id)
+        if waiter:
+            loop, future = waiter
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(sessions))
+
+    def close(self):
+        self.closed = True
+        for worker in self.workers:
+            self.send(worker, ('shutdown',))
+        for worker in self.workers:
+            if worker.process:
+                worker.process.join(timeout=5)
+                if worker.process.is_alive():
+                    worker.process.kill()
@@ -0,0 +1,135 @@
+"""Steady-state memory over many join/leave cycles, with the idle manager reclaiming guilds.
+
+Each cycle brings a batch of new guilds in: each one plays a search result, or for some
+a long Spotify playlist that is still resolving, and then either goes quiet or all its
+listeners leave the channel. The idle manager should
+disconnect every one of them and drop their state, so memory after each cycle stays
+flat instead of growing with the number of guilds ever seen. Uses the fakes from
+bench_load.py; timeouts are shrunk to around a second.
+
+Usage: python benchmarks/bench_idle.py [--cycles N] [--guilds N] [--no-reclaim] [--budget-growth-kb KB]
+"""
+import argparse
+import asyncio
+import contextlib
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_load import FakeContext, FakeGuild, install_fakes, wait_until  # noqa: E402
+
+
+async def run_cycle(bot_module, guilds: dict, first_id: int, args):
+    batch = [FakeGuild(first_id + index) for index in range(args.guilds)]
+    guilds.update((guild.id, guild) for guild in batch)
+    play = bot_module.bot.get_command('play').callback
+
+    async def visit(index: int, guild: FakeGuild):
+        ctx = FakeContext(guild)
+        if index % 4 == 1:
+            # Leaving has to cancel the resolver, or it keeps the guild busy and queues into it
+            resolving = asyncio.ensure_future(play(ctx, query=f"https://open.spotify.com/playlist/{guild.id}x200"))
+        else:
+            resolving = None
+            await play(ctx, query=f"song {guild.id}")
+        await wait_until(lambda: guild.voice_client and guild.voice_client.first_audio_at, 10)
+        if index % 2:
+            # Everyone leaves the channel while the song plays
+            guild.voice_channel.members.clear()
+        if resolving:
+            await resolving
+
+    await asyncio.gather(*(visit(index, guild) for index, guild in enumerate(batch)))
+    reclaimed = args.no_reclaim or await wait_until(
+        lambda: not any(guild.id in bot_module.guild_states for guild in batch), 30
+    )
+    for guild in batch:
+        guilds.pop(guild.id, None)
+    return reclaimed
+
+
+async def main_async(args) -> int:
+    import bot as bot_module
+
+    install_fakes(bot_module)
+    guilds = {}
+    bot_module.bot.get_guild = guilds.get
+    bot_module.bot.loop = asyncio.get_running_loop()
+    await bot_module.bot.setup_hook()
+
+    tracemalloc.start()
+    samples = []
+    stuck = 0
+    started = time.perf_counter()
+    # The bot's log lines would otherwise pile up in memory as part of the measurement
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+        for cycle in range(args.cycles):
+            if not await run_cycle(bot_module, guilds, 10000 + cycle * args.guilds, args):
+                stuck += 1
+            gc.collect()
+            samples.append((
+                tracemalloc.get_traced_memory()[0], len(bot_module.guild_states), len(asyncio.all_tasks())
+            ))
+    elapsed = time.perf_counter() - started
+    tracemalloc.stop()
+    bot_module.extraction_engine.shutdown()
+
+    print(f"{args.cycles} cycles of {args.guilds} guilds joining and leaving, {elapsed:.1f}s "
+          f"({'idle manager off' if args.no_reclaim else 'idle manager on'})")
+    print(f"{'cycle':>6} {'traced KiB':>11} {'guild states':>13} {'tasks':>6}")
+    for cycle, (memory, states, tasks) in enumerate(samples, 1):
+        if cycle == 1 or cycle % max(args.cycles // 10, 1) == 0:
+            print(f"{cycle:>6} {memory / 1024:>11.0f} {states:>13} {tasks:>6}")
+    # Growth per cycle over the second half, once caches and pools have warmed up
+    half = samples[len(samples) // 2:]
+    growth = (half[-1][0] - half[0][0]) / max(len(half) - 1, 1) / 1024
+    print(f"growth per cycle after warm-up: {growth:.1f} KiB | idle disconnects: "
+          f"{ {labels[0]: child.value for labels, child in bot_module.idle_disconnects.children()} } | "
+          f"states evicted: {bot_module.guild_states_evicted.value} | tasks cancelled: {bot_module.idle_tasks_cancelled.value}")
+
+    if stuck:
+        print(f"BUDGET EXCEEDED: guild state never reclaimed in {stuck} cycles")
+        return 1
+    if args.budget_growth_kb and growth > args.budget_growth_kb:
+        print(f"BUDGET EXCEEDED: growth per cycle {growth:.1f} KiB > {args.budget_growth_kb} KiB")
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cycles', type=int, default=20)
+    parser.add_argument('--guilds', type=int, default=20)
+    parser.add_argument('--no-reclaim', action='store_true', help='turn the idle manager off, for comparison')
+    parser.add_argument('--verbose', action='store_true', help="show the bot's own log output")
+    parser.add_argument('--budget-growth-kb', type=float, default=0.0)
+    args = parser.parse_args()
+
+    os.environ.update({
+        'DATA_DIR': tempfile.mkdtemp(prefix='bench-idle-'),
+        'EXTRACT_WORKERS': '0',
+        'AUDIO_WORKERS': '0',
+        'AUDIO_CACHE_MAX_BYTES': '0',
+        'METRICS_PORT': '0',
+        'SPOTIFY_CLIENT_ID': 'offline',
+        'SPOTIFY_CLIENT_SECRET': 'offline',
+        # Small enough that the shared extraction cache is full after the first few cycles
+        'EXTRACT_CACHE_SIZE': '100',
+        # Every guild plays new tracks, which the library is meant to keep
+        'LIBRARY_MAX_TRACKS': '0',
+        'PLAYER_UPDATE_DEBOUNCE': '0.05',
+        'IDLE_CHECK_INTERVAL': '0.05',
+        'IDLE_DISCONNECT_SECONDS': '0' if args.no_reclaim else '1',
+        'EMPTY_CHANNEL_SECONDS': '0' if args.no_reclaim else '0.5',
+        'GUILD_STATE_TTL': '0' if args.no_reclaim else '1',
+    })
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == '__main__':
+    main()
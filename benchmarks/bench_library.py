@@ -0,0 +1,149 @@
+"""Track library lookups at 100k tracks: latency, how often a repeat request skips YouTube, and
+what recording plays costs the event loop.
+
+Titles are synthetic "Artist - Song (Official Video)" strings over a Zipf-distributed
+vocabulary, so common words are common, as in real titles. Queries are titles that were
+played, with the artist left off or a typo added, plus queries for songs never played.
+Each query is timed a few times and its fastest run kept, so the percentiles show what
+lookups cost rather than how often the machine was busy elsewhere. The budget applies to
+match(), which stands between !play and a YouTube search.
+
+Usage: python benchmarks/bench_library.py [--tracks N] [--queries N] [--budget-match-p99-ms MS]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from library import TrackLibrary, normalize, search_key  # noqa: E402
+
+SUFFIXES = ('', '', '', ' (Official Video)', ' (Official Audio)', ' [Lyrics]', ' (Live)', ' (Remix)', ' (Acoustic)')
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def make_words(rng: random.Random, count: int) -> List[str]:
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = set()
+    while len(words) < count:
+        words.add(''.join(rng.choice(letters) for _ in range(rng.randint(2, 9))))
+    return sorted(words)
+
+
+def make_tracks(rng: random.Random, count: int):
+    words = make_words(rng, 8000)
+    # Word frequency has nothing to do with spelling
+    rng.shuffle(words)
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    artists = [' '.join(rng.choices(words, weights, k=rng.randint(1, 2))).title() for _ in range(count // 8)]
+    tracks = []
+    for i in range(count):
+        artist = rng.choice(artists)
+        song = ' '.join(rng.choices(words, weights, k=rng.randint(2, 5))).title()
+        tracks.append((f"{i:011d}", artist, song, f"{artist} - {song}{rng.choice(SUFFIXES)}", 120 + i % 300))
+    return tracks
+
+
+def typo(rng: random.Random, text: str) -> str:
+    i = rng.randrange(len(text))
+    return text[:i] + rng.choice('aeiourst') + text[i + 1:]
+
+
+def timed(function, queries: List[str], repeat: int):
+    latencies, results = [], []
+    for query in queries:
+        fastest = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = function(query)
+            fastest = min(fastest, time.perf_counter() - started)
+        results.append(result)
+        latencies.append(fastest)
+    return latencies, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tracks', type=int, default=100_000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--budget-match-p99-ms', type=float, default=0.0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    tracks = make_tracks(rng, args.tracks)
+    with tempfile.TemporaryDirectory(prefix='bench-library-') as directory:
+        library = TrackLibrary(os.path.join(directory, 'library.sqlite3'), max_tracks=args.tracks)
+
+        async def fill():
+            # Every track played once, recorded as the bot would and flushed in one batch
+            started = time.perf_counter()
+            for video_id, artist, _, title, duration in tracks:
+                library.record(video_id, title, artist, duration)
+            recorded = time.perf_counter() - started
+            started = time.perf_counter()
+            await library.flush()
+            return recorded, time.perf_counter() - started
+
+        recorded, flushed = asyncio.run(fill())
+
+        # Reload from disk, as on start-up, then again to see what the index holds
+        started = time.perf_counter()
+        library._read()
+        loaded = time.perf_counter() - started
+        tracemalloc.start()
+        index = library._read()
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        library._index = index
+        library.close()
+
+    played = rng.sample(tracks, args.queries)
+    cases = {
+        'full title': [title for _, _, _, title, _ in played],
+        'song only': [song for _, _, song, _, _ in played],
+        'with a typo': [typo(rng, f"{artist} {song}") for _, artist, song, _, _ in played],
+        'never played': [f"{artist} {song}" for _, artist, song, _, _ in make_tracks(random.Random(args.seed + 1), args.queries)],
+    }
+    expected = {
+        name: [video_id for video_id, *_ in played] if name != 'never played' else [None] * args.queries
+        for name in cases
+    }
+
+    print(f"{len(index)} tracks | recorded in {recorded * 1000:.0f} ms ({recorded / args.tracks * 1e6:.1f} us each) | "
+          f"written in one batch in {flushed * 1000:.0f} ms | loaded in {loaded:.2f}s, {memory / 2**20:.0f} MiB")
+    print(f"{'query':<14} {'match p50/p99 (ms)':>19} {'skips YouTube':>14} {'wrong':>6} {'search p99 (ms)':>16} {'search top-1':>13}")
+    worst = 0.0
+    for name, queries in cases.items():
+        match_latencies, matches = timed(library.match, queries, args.repeat)
+        search_latencies, searches = timed(library.search, queries, args.repeat)
+        skipped = sum(match is not None for match in matches)
+        # A query that is exactly another played track's title names that track, not a wrong one
+        wrong = sum(
+            match is not None and match.video_id != video_id and search_key(match.title, match.artist) != normalize(query)
+            for match, video_id, query in zip(matches, expected[name], queries)
+        )
+        top = sum(bool(hits) and hits[0].video_id == video_id for hits, video_id in zip(searches, expected[name]))
+        worst = max(worst, percentile(match_latencies, 0.99))
+        print(f"{name:<14} {percentile(match_latencies, 0.5) * 1000:>8.3f} / {percentile(match_latencies, 0.99) * 1000:<8.3f} "
+              f"{skipped / len(queries):>14.0%} {wrong:>6} {percentile(search_latencies, 0.99) * 1000:>16.3f} "
+              f"{top / len(queries) if name != 'never played' else 0:>13.0%}")
+
+    if args.budget_match_p99_ms and worst * 1000 > args.budget_match_p99_ms:
+        print(f"BUDGET EXCEEDED: match p99 {worst * 1000:.3f} ms > {args.budget_match_p99_ms} ms")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""CPU cost per voice stream of the PCM and Opus playback paths.
+
+Each path plays the same Opus/WebM clip the way discord.py's audio player consumes
+it (including the in-process Opus encode the PCM path needs), as fast as possible.
+CPU time of this process plus its ffmpeg children is reported per minute of audio.
+The one-off loudness measurement a track gets on its first normalized play is timed
+the same way. Requires ffmpeg with libopus on PATH, or it says so and measures nothing;
+without libopus for discord.py the PCM path is skipped and the others still run.
+
+Usage: python benchmarks/bench_playback.py [clip seconds] [concurrent streams]
+"""
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import discord
+from discord.opus import Encoder, OpusNotLoaded
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from loudness import gain_for, measure_command, parse_ebur128  # noqa: E402
+
+VOLUME = 0.5
+
+
+def cpu_seconds() -> float:
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+def missing_ffmpeg():
+    """Why ffmpeg can't make the clip or the Opus streams here, or None"""
+    if shutil.which('ffmpeg') is None:
+        return 'ffmpeg is not on PATH'
+    encoders = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'], capture_output=True, text=True).stdout
+    if 'libopus' not in encoders:
+        return 'ffmpeg was built without the libopus encoder'
+    return None
+
+
+def opus_loaded() -> bool:
+    # The PCM path encodes in-process, as discord.py's player does
+    try:
+        Encoder()
+    except OpusNotLoaded:
+        return False
+    return True
+
+
+def make_clip(directory: str, seconds: int) -> str:
+    path = os.path.join(directory, 'clip.webm')
+    subprocess.run(
+        ['ffmpeg', '-nostdin', '-loglevel', 'error', '-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}',
+         '-ac', '2', '-ar', '48000', '-c:a', 'libopus', '-b:a', '128k', '-y', path],
+        check=True
+    )
+    return path
+
+
+def pcm_source(path):
+    return discord.PCMVolumeTransformer(discord.FFmpegPCMAudio(path, options='-vn'), VOLUME)
+
+
+def opus_copy_source(path):
+    return discord.FFmpegOpusAudio(path, codec='opus', options='-vn')
+
+
+def opus_transcode_source(path):
+    return discord.FFmpegOpusAudio(path, options=f'-vn -filter:a volume={VOLUME}')
+
+
+def measure_loudness(path: str):
+    started = cpu_seconds()
+    result = subprocess.run(measure_command(path, local=True), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+    return parse_ebur128(result.stderr.decode(errors='replace')), cpu_seconds() - started
+
+
+def run_path(factory, path: str, streams: int) -> float:
+    encoder = Encoder() if opus_loaded() else None
+    sources = [factory(path) for _ in range(streams)]
+    started = cpu_seconds()
+    active = list(sources)
+    while active:
+        for source in list(active):
+            data = source.read()
+            if not data:
+                source.cleanup()
+                active.remove(source)
+            elif not source.is_opus():
+                # discord.py's AudioPlayer encodes PCM frames on its own thread
+                encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+    return cpu_seconds() - started
+
+
+def main():
+    seconds = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    streams = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    missing = missing_ffmpeg()
+    if missing:
+        print(f"SKIPPED: {missing}; no playback path can be measured here")
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        clip = make_clip(directory, seconds)
+        print(f"{streams} streams of a {seconds}s clip, CPU seconds per stream per minute of audio")
+        loudness, measure_cpu = measure_loudness(clip)
+        gain = gain_for(loudness)
+
+        def opus_normalized_source(path):
+            # Same pipeline as the plain transcode, the gain just folded into the volume
+            return discord.FFmpegOpusAudio(path, options=f'-vn -filter:a volume={round(VOLUME * gain, 4)}')
+
+        results = {}
+        for name, factory in (
+            ('pcm (volume + encode in Python)', pcm_source),
+            ('opus stream copy', opus_copy_source),
+            ('opus transcode with ffmpeg volume', opus_transcode_source),
+            ('opus transcode, normalized volume', opus_normalized_source),
+        ):
+            if factory is pcm_source and not opus_loaded():
+                print(f"{name:<36} SKIPPED: discord.py could not load libopus")
+                continue
+            cpu = run_path(factory, clip, streams)
+            results[name] = cpu / streams / (seconds / 60)
+            print(f"{name:<36} {results[name]:.3f}")
+        print(f"{'loudness measurement (once per track)':<36} {measure_cpu / (seconds / 60):.3f} "
+              f"({loudness.integrated:.1f} LUFS, peak {loudness.true_peak:.1f} dBTP -> gain {gain:.2f})")
+        baseline = results.get('pcm (volume + encode in Python)')
+        if baseline is None:
+            return
+        for name, value in results.items():
+            print(f"{name:<36} {baseline / value if value else float('inf'):.1f}x streams per core vs pcm")
+
+
+if __name__ == '__main__':
+    main()
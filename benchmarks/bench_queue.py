@@ -0,0 +1,95 @@
+"""Micro-benchmark of SongQueue against the plain list it replaced.
+
+SongQueue pays a method call and the on_change hook on every change, so the list is
+ahead on single operations in the middle; what the queue buys is O(1) popping of the
+next song and a queue total that needs no scan.
+
+Usage: python benchmarks/bench_queue.py [entries]
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from song_queue import SongQueue  # noqa: E402
+
+
+class FakeSong:
+    __slots__ = ('title', 'duration')
+
+    def __init__(self, i: int):
+        self.title = f"Song {i}"
+        self.duration = 180 + i % 120
+
+
+def run(entries: int, rounds: int = 1000):
+    songs = [FakeSong(i) for i in range(entries)]
+    rng = random.Random(0)
+    positions = [rng.randrange(entries // 2) for _ in range(rounds)]
+
+    def bench(name: str, setup, op):
+        results = {}
+        for kind, factory in (('list', list), ('SongQueue', SongQueue)):
+            container = factory(songs)
+            setup_state = setup(container)
+            elapsed = timeit.timeit(lambda: op(kind, container, setup_state), number=rounds)
+            results[kind] = elapsed / rounds * 1e6
+        speedup = results['list'] / results['SongQueue'] if results['SongQueue'] else float('inf')
+        print(f"{name:<22} list {results['list']:>9.2f} us   SongQueue {results['SongQueue']:>9.2f} us   x{speedup:.1f}")
+
+    def pop_front(kind, container, _):
+        song = container.pop(0) if kind == 'list' else container.popleft()
+        container.append(song)
+
+    def append(kind, container, _):
+        container.append(songs[0])
+
+    def index(kind, container, state):
+        container[positions[state['i'] % rounds]]
+        state['i'] += 1
+
+    def remove_insert(kind, container, state):
+        position = positions[state['i'] % rounds]
+        state['i'] += 1
+        if kind == 'list':
+            container.insert(position, container.pop(position))
+        else:
+            container.insert(position, container.remove(position))
+
+    def move(kind, container, state):
+        source = positions[state['i'] % rounds]
+        destination = positions[(state['i'] + 1) % rounds]
+        state['i'] += 1
+        if kind == 'list':
+            container.insert(destination, container.pop(source))
+        else:
+            container.move(source, destination)
+
+    def total_duration(kind, container, _):
+        if kind == 'list':
+            sum(song.duration for song in container)
+        else:
+            container.total_duration
+
+    print(f"{entries} entries, {rounds} rounds, time per operation")
+    bench('pop front + append', lambda c: None, pop_front)
+    bench('append', lambda c: None, append)
+    bench('index', lambda c: {'i': 0}, index)
+    bench('remove + insert', lambda c: {'i': 0}, remove_insert)
+    bench('move', lambda c: {'i': 0}, move)
+    bench('total duration', lambda c: None, total_duration)
+
+    # Jump-to drops a prefix; time a single jump halfway into a fresh queue
+    for kind, factory in (('list', list), ('SongQueue', SongQueue)):
+        container = factory(songs)
+        if kind == 'list':
+            elapsed = timeit.timeit(lambda: container.__delitem__(slice(0, entries // 2)), number=1)
+        else:
+            elapsed = timeit.timeit(lambda: container.skip_to(entries // 2), number=1)
+        print(f"{'jump to middle':<22} {kind} {elapsed * 1e6:.2f} us")
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
@@ -0,0 +1,174 @@
+"""Queues across restarts: nothing lost, nothing duplicated, and how long loading takes.
+
+Two checks. The queue journal is opened, written to, compacted and closed over and over
+with random queue operations, as consecutive bot processes would; after every restart
+it has to load exactly the state a plain replay of those operations gives. Then the bot
+itself is restarted a few times in fresh interpreters over one saved queue, with one
+guild rejoining its channel and one whose channel is gone, and each restart has to bring
+back the same songs, with the plays of the previous run flushed to the library on shutdown.
+Uses the fakes from bench_load.py.
+
+Usage: python benchmarks/bench_restart.py [--restarts N] [--records N] [--guilds N]
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from queue_journal import QueueJournal, apply_record  # noqa: E402
+
+CHILD = r'''
+import asyncio, json, os, sys
+sys.path.insert(0, sys.argv[1])
+sys.path.insert(0, os.path.join(sys.argv[1], 'benchmarks'))
+import bot
+import discord
+from bench_load import FakeGuild, FakeVoiceChannel, install_fakes
+
+# resume_guild only rejoins voice channels; this interpreter has no real ones
+discord.VoiceChannel = FakeVoiceChannel
+
+def record(title):
+    return {'url': f"https://www.youtube.com/watch?v={ord(title):011d}", 'title': title, 'thumbnail': '',
+            'duration': 200, 'source_type': 'youtube', 'requester_id': 1, 'requester_name': 'user-1'}
+
+async def main():
+    install_fakes(bot)
+    guilds = {guild_id: FakeGuild(guild_id) for guild_id in (1, 2)}
+    bot.bot.get_guild = guilds.get
+    bot.bot.loop = asyncio.get_running_loop()
+    await bot.bot.setup_hook()
+    # Plays of earlier runs only reach the library on their shutdown flush
+    while not bot.track_library.loaded:
+        await asyncio.sleep(0.01)
+    library = bot.track_library.stats()['tracks']
+    if sys.argv[2] == 'save':
+        for guild_id, guild in guilds.items():
+            bot.journal(guild_id, 'extend', [record('B'), record('C')])
+            bot.journal(guild_id, 'current', record('A'), 0.0)
+            # Guild 1 rejoins its channel; guild 2's channel is gone
+            bot.journal(guild_id, 'channel', guild.voice_channel.id if guild_id == 1 else 999, guild.text_channel.id)
+    else:
+        await bot.restore_guilds()
+        await asyncio.sleep(0.3)
+    queues = {}
+    for guild_id, guild_state in bot.guild_states.items():
+        playing = guild_state.current_song or guild_state.loading_song
+        queues[guild_id] = [song.title for song in ([playing] if playing else []) + list(guild_state.song_queue)]
+    await bot.close_storage()
+    print(json.dumps({'queues': queues, 'library': library}))
+
+asyncio.run(main())
+'''
+
+
+def plain(states: Dict[int, dict]) -> Dict[int, dict]:
+    return {guild_id: dict(state, queue=list(state['queue'])) for guild_id, state in states.items()}
+
+
+def random_record(rng: random.Random, states: Dict[int, dict], guilds: int, serial: int) -> dict:
+    guild_id = rng.randrange(guilds)
+    queue = states[guild_id]['queue'] if guild_id in states else ()
+    song = {'title': f"song {serial}"}
+    choices = [('append', [song]), ('extend', [[song, {'title': f"song {serial}b"}]]),
+               ('current', [song, rng.uniform(0, 100)]), ('position', [rng.uniform(0, 100)]),
+               ('channel', [guild_id * 10 + 2, guild_id * 10 + 1])]
+    if queue:
+        choices += [('popleft', []), ('remove', [rng.randrange(len(queue))]), ('insert', [rng.randrange(len(queue)), song]),
+                    ('move', [rng.randrange(len(queue)), rng.randrange(len(queue))]), ('shuffle', [rng.randrange(2**32)])]
+    if rng.random() < 0.01:
+        choices = [('forget', []), ('clear', [])]
+    op, args = rng.choice(choices)
+    return {'g': guild_id, 'op': op, 'args': args}
+
+
+def check_journal(args) -> list:
+    """Restart the journal repeatedly, compacting on some runs; returns what went wrong"""
+    rng = random.Random(args.seed)
+    directory = tempfile.mkdtemp(prefix='bench-restart-')
+    expected: Dict[int, dict] = {}
+    failures = []
+    serial = 0
+    load_seconds = 0.0
+    for restart in range(args.restarts):
+        # Compacting every third of a run folds segments in and deletes them mid-run
+        journal = QueueJournal(directory, compact_every=args.records // 3 if restart % 2 else 10**9)
+        started = time.perf_counter()
+        loaded = journal.load()
+        load_seconds = time.perf_counter() - started
+        if plain(loaded) != plain(expected):
+            lost = {g for g in set(expected) | set(loaded) if plain(loaded).get(g) != plain(expected).get(g)}
+            failures.append(f"restart {restart}: journal loaded the wrong state for {len(lost)} guilds")
+            expected = loaded
+        for _ in range(args.records):
+            serial += 1
+            record = random_record(rng, expected, args.guilds, serial)
+            journal.record(record['g'], record['op'], *record['args'])
+            apply_record(expected, json.loads(json.dumps(record)))
+        if restart % 3 == 2:
+            # A compaction still running at exit, as restore_guilds starts one
+            journal.compact()
+        journal.close()
+    print(f"journal: {args.restarts} restarts of {args.records} records over {args.guilds} guilds | "
+          f"last load {load_seconds * 1000:.1f} ms")
+    return failures
+
+
+def check_restore(args) -> list:
+    env = dict(
+        os.environ,
+        DATA_DIR=tempfile.mkdtemp(prefix='bench-restart-bot-'),
+        METRICS_PORT='0',
+        EXTRACT_WORKERS='0',
+        AUDIO_WORKERS='0',
+        AUDIO_CACHE_MAX_BYTES='0',
+        # Longer than a run, so only the shutdown flush writes plays out
+        LIBRARY_FLUSH_INTERVAL='3600',
+    )
+
+    def run(mode: str) -> dict:
+        output = subprocess.run(
+            [sys.executable, '-c', CHILD, ROOT, mode], env=env, check=True, capture_output=True, text=True
+        ).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+    run('save')
+    failures = []
+    expected = ['A', 'B', 'C']
+    for restart in range(1, 4):
+        result = run('restore')
+        queues = {int(guild_id): queue for guild_id, queue in result['queues'].items()}
+        print(f"bot restart {restart}: rejoined {queues.get(1)} | channel gone {queues.get(2)} | "
+              f"library {result['library']} tracks")
+        for guild_id, queue in sorted(queues.items()):
+            if queue != expected:
+                failures.append(f"bot restart {restart}: guild {guild_id} came back with {queue}, not {expected}")
+        if restart > 1 and not result['library']:
+            failures.append(f"bot restart {restart}: the song played before the last shutdown is not in the library")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--restarts', type=int, default=12)
+    parser.add_argument('--records', type=int, default=3000)
+    parser.add_argument('--guilds', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    failures = check_journal(args) + check_restore(args)
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
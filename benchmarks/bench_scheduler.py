@@ -0,0 +1,122 @@
+"""Now-playing extraction latency while one guild floods the pool with playlist pages.
+
+Compares the extraction scheduler against first-come first-served access to the same
+number of workers (what submitting straight to the executor amounts to). Extractions
+are simulated with a fixed sleep. Then checks that jobs guilds share are all dropped
+once every guild waiting on them has left, and exits non-zero if any are left queued.
+
+Usage: python benchmarks/bench_scheduler.py [--workers N] [--bulk N] [--guilds N] [--latency S]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from scheduler import BULK, NOW_PLAYING, PREFETCH, ExtractionScheduler  # noqa: E402
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+async def scenario(args, submit) -> dict:
+    rng = random.Random(args.seed)
+    latencies = {'now_playing': [], 'prefetch': [], 'bulk': []}
+
+    async def job(guild_id: int, priority: int, name: str):
+        started = time.perf_counter()
+        await submit(guild_id, priority)
+        latencies[name].append(time.perf_counter() - started)
+
+    async def listener(guild_id: int):
+        # A guild playing songs: resolve the next one, prefetch the one after, listen a while
+        await asyncio.sleep(rng.uniform(0, args.latency * 4))
+        for _ in range(args.songs):
+            await job(guild_id, NOW_PLAYING, 'now_playing')
+            await job(guild_id, PREFETCH, 'prefetch')
+            await asyncio.sleep(args.latency * rng.uniform(1, 3))
+
+    started = time.perf_counter()
+    # Guild 0 queues a huge playlist, one page per job, as fast as it can submit them
+    bulk = [asyncio.ensure_future(job(0, BULK, 'bulk')) for _ in range(args.bulk)]
+    await asyncio.gather(*(listener(guild_id) for guild_id in range(1, args.guilds + 1)))
+    await asyncio.gather(*bulk)
+    latencies['elapsed'] = time.perf_counter() - started
+    return latencies
+
+
+async def shared_leave(args) -> int:
+    """Guilds join one guild's queued jobs and then all leave, in random order; returns the jobs still queued"""
+    rng = random.Random(args.seed)
+    scheduler = ExtractionScheduler(max_concurrent=args.workers, per_guild=args.per_guild)
+    busy = asyncio.Event()
+
+    async def extraction():
+        await busy.wait()
+
+    # Occupy every worker so the rest stays queued
+    running = [scheduler.submit(-1 - worker, NOW_PLAYING, extraction) for worker in range(args.workers)]
+    jobs = [scheduler.submit(0, BULK, extraction) for _ in range(args.bulk)]
+    guilds = list(range(args.guilds + 1))
+    for guild_id in guilds[1:]:
+        for job in rng.sample(jobs, len(jobs) // 4):
+            scheduler.share(job, guild_id, rng.choice((PREFETCH, BULK)))
+    rng.shuffle(guilds)
+    for guild_id in guilds:
+        scheduler.cancel_guild(guild_id)
+    left = sum(scheduler.queued().values())
+    busy.set()
+    await asyncio.gather(*(job.future for job in running))
+    return left
+
+
+async def main_async(args):
+    async def extraction():
+        await asyncio.sleep(args.latency)
+
+    workers = asyncio.Semaphore(args.workers)
+
+    async def fifo(guild_id: int, priority: int):
+        async with workers:
+            await extraction()
+
+    scheduler = ExtractionScheduler(max_concurrent=args.workers, per_guild=args.per_guild)
+
+    async def scheduled(guild_id: int, priority: int):
+        await scheduler.run(guild_id, priority, extraction)
+
+    print(f"{args.workers} workers, {args.latency * 1000:.0f} ms per extraction, {args.bulk} bulk jobs from one guild, "
+          f"{args.guilds} guilds playing")
+    print(f"{'':<12} {'now_playing p50/p99 (s)':>24} {'prefetch p99':>13} {'bulk done (s)':>14}")
+    for name, submit in (('fifo', fifo), ('scheduler', scheduled)):
+        result = await scenario(args, submit)
+        now = result['now_playing']
+        print(f"{name:<12} {percentile(now, 0.5):>11.3f} / {percentile(now, 0.99):<10.3f} "
+              f"{percentile(result['prefetch'], 0.99):>13.3f} {result['elapsed']:>14.2f}")
+
+    left = await shared_leave(args)
+    print(f"shared jobs still queued after every guild left: {left} of {args.bulk}")
+    return left
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--per-guild', type=int, default=2)
+    parser.add_argument('--bulk', type=int, default=200)
+    parser.add_argument('--guilds', type=int, default=10)
+    parser.add_argument('--songs', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--seed', type=int, default=0)
+    if asyncio.run(main_async(parser.parse_args())):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
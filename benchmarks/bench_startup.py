@@ -0,0 +1,89 @@
+"""Cold-start cost of the bot process, measured in fresh interpreters.
+
+Each run imports bot.py and runs setup_hook (everything before the gateway connects
+that the bot controls), then the background warm-up of the extraction workers and
+the Spotify client. The connection to Discord itself is not included; the running
+bot reports that as startup_seconds{phase="ready"}.
+
+Usage: python benchmarks/bench_startup.py [--runs N] [--budget-import-ms MS] [--budget-setup-ms MS]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CHILD = r'''
+import asyncio, json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import bot
+imported = time.perf_counter()
+
+async def main():
+    bot.bot.loop = asyncio.get_running_loop()
+    await bot.bot.setup_hook()
+    ready = time.perf_counter()
+    heavy = [name for name in ('yt_dlp', 'spotipy') if name in sys.modules]
+    await bot.warm_up()
+    warmed = time.perf_counter()
+    bot.extraction_engine.shutdown()
+    return ready, warmed, heavy
+
+ready, warmed, heavy = asyncio.run(main())
+print(json.dumps({
+    'import': imported - started,
+    'setup': ready - imported,
+    'warm_up': warmed - ready,
+    'modules': len(sys.modules),
+    'heavy_at_ready': heavy,
+}))
+'''
+
+
+def run_once(env: dict) -> dict:
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD, ROOT], env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-import-ms', type=float, default=0.0)
+    parser.add_argument('--budget-setup-ms', type=float, default=0.0)
+    args = parser.parse_args()
+
+    env = dict(
+        os.environ,
+        DATA_DIR=tempfile.mkdtemp(prefix='bench-startup-'),
+        QUEUE_JOURNAL='0',
+        METRICS_PORT='0',
+        AUDIO_WORKERS='0',
+    )
+    runs = [run_once(env) for _ in range(args.runs)]
+    print(f"{args.runs} cold starts, median (min-max) in ms")
+    for phase in ('import', 'setup', 'warm_up'):
+        values = [run[phase] * 1000 for run in runs]
+        print(f"{phase:<10} {statistics.median(values):>8.1f} ({min(values):.1f}-{max(values):.1f})")
+    print(f"modules loaded: {runs[0]['modules']} | imported before warm-up: {', '.join(runs[0]['heavy_at_ready']) or 'neither yt_dlp nor spotipy'}")
+
+    failures = []
+    import_ms = statistics.median(run['import'] for run in runs) * 1000
+    setup_ms = statistics.median(run['setup'] for run in runs) * 1000
+    if args.budget_import_ms and import_ms > args.budget_import_ms:
+        failures.append(f"import {import_ms:.0f} ms > {args.budget_import_ms:.0f} ms")
+    if args.budget_setup_ms and setup_ms > args.budget_setup_ms:
+        failures.append(f"setup {setup_ms:.0f} ms > {args.budget_setup_ms:.0f} ms")
+    for failure in failures:
+        print(f"BUDGET EXCEEDED: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
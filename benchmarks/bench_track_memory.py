@@ -0,0 +1,186 @@
+"""Resident bytes per queued track: the slotted Song against the layout it replaced.
+
+The old Song kept a per-instance dict and a reference to the requesting discord.Member,
+and once resolved its YTDLSource kept the whole yt-dlp result: every format, thumbnail
+and caption track. Both are built from the same playlist entries and requesters;
+strings are counted in both, the ffmpeg process behind a source in neither.
+
+Usage: python benchmarks/bench_track_memory.py [--tracks N] [--resolved N]
+"""
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bot import Song  # noqa: E402
+
+
+class LegacySong:
+    """Song as it was: a plain object holding the Member and, once resolved, its source"""
+
+    def __init__(self, url, title, thumbnail, duration, requester, source_type='youtube'):
+        self.url = url
+        self.title = title
+        self.thumbnail = thumbnail
+        self.duration = duration
+        self.requester = requester
+        self.source = None
+        self.source_type = source_type
+
+
+class LegacySource:
+    """The part of the old YTDLSource that outlived extraction: the full result and fields copied from it"""
+
+    def __init__(self, data: dict):
+        self.data = data
+        self.title = data.get('title')
+        self.url = data.get('webpage_url', '')
+        self.thumbnail = data.get('thumbnail', '')
+        self.duration = Song.parse_duration(int(data.get('duration', 0)))
+
+
+class FakeMember:
+    """Stands in for discord.Member; shared by every song the member queued, as in the bot"""
+
+    def __init__(self, member_id: int):
+        self.id = member_id
+        self.display_name = f"listener-{member_id}"
+        self.roles = list(range(5))
+        self.activities = ()
+
+
+def entry(i: int) -> dict:
+    video_id = f"{i:011d}"
+    return {
+        'url': f"https://www.youtube.com/watch?v={video_id}",
+        'title': f"Artist {i % 500} - Some Song Title Number {i}",
+        'thumbnail': f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg",
+        'duration': 180 + i % 120,
+    }
+
+
+def full_info(i: int) -> dict:
+    """Shaped like yt-dlp's result for one YouTube video, trimmed: 20 formats, 40 thumbnails,
+    captions in 30 languages, a 100-point heatmap, the description and tags"""
+    video_id = f"{i:011d}"
+    stream = f"https://rr3---sn-abc.googlevideo.com/videoplayback?expire=1700000000&id={video_id}&itag="
+    headers = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) Firefox/120.0', 'Accept': '*/*',
+               'Accept-Language': 'en-us,en;q=0.5', 'Sec-Fetch-Mode': 'navigate'}
+    formats = [{
+        'format_id': str(itag), 'format_note': 'medium', 'ext': 'webm' if itag % 2 else 'mp4',
+        'protocol': 'https', 'acodec': 'opus' if itag < 260 else 'none', 'vcodec': 'none' if itag < 260 else 'vp9',
+        'url': f"{stream}{itag}&" + 'x' * 900, 'width': None if itag < 260 else 1280, 'height': None if itag < 260 else 720,
+        'fps': None if itag < 260 else 30, 'abr': 130.5, 'tbr': 140.2, 'asr': 48000, 'audio_channels': 2,
+        'filesize': 3_500_000 + itag, 'quality': 3.0, 'has_drm': False, 'source_preference': -1,
+        'language': 'en', 'language_preference': -1, 'preference': None, 'dynamic_range': 'SDR',
+        'container': 'webm_dash', 'downloader_options': {'http_chunk_size': 10485760},
+        'http_headers': dict(headers), 'resolution': 'audio only' if itag < 260 else '1280x720',
+        'audio_ext': 'webm', 'video_ext': 'none', 'format': f"{itag} - audio only (medium)",
+    } for itag in range(249, 269)]
+    return {
+        'id': video_id, 'title': f"Artist {i % 500} - Some Song Title Number {i}",
+        'formats': formats,
+        'thumbnails': [{'url': f"https://i.ytimg.com/vi/{video_id}/{n}.jpg", 'preference': -n, 'id': str(n),
+                        'height': 90 + n, 'width': 120 + n, 'resolution': f"{120 + n}x{90 + n}"} for n in range(40)],
+        'thumbnail': f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg",
+        'description': f"Official video for Some Song Title Number {i}. " + 'Lyrics and credits. ' * 60,
+        'channel_id': 'UC' + 'x' * 22, 'channel_url': f"https://www.youtube.com/channel/UC{'x' * 22}",
+        'duration': 180 + i % 120, 'view_count': 1_000_000 + i, 'age_limit': 0,
+        'webpage_url': f"https://www.youtube.com/watch?v={video_id}",
+        'categories': ['Music'], 'tags': [f"tag {n} for song {i}" for n in range(20)],
+        'playable_in_embed': True, 'live_status': 'not_live',
+        'automatic_captions': {
+            language: [{'ext': ext, 'url': f"https://www.youtube.com/api/timedtext?v={video_id}&lang={language}&fmt={ext}&"
+                        + 'x' * 300, 'name': language} for ext in ('json3', 'srv1', 'srv2', 'srv3', 'ttml', 'vtt')]
+            for language in (f"l{n}" for n in range(30))
+        },
+        'subtitles': {}, 'comment_count': 1000, 'chapters': None,
+        'heatmap': [{'start_time': n * 1.8, 'end_time': n * 1.8 + 1.8, 'value': n / 100} for n in range(100)],
+        'like_count': 10_000, 'channel': f"Artist {i % 500}", 'channel_follower_count': 100_000,
+        'upload_date': '20230101', 'availability': 'public', 'original_url': f"https://www.youtube.com/watch?v={video_id}",
+        'webpage_url_basename': 'watch', 'webpage_url_domain': 'youtube.com', 'extractor': 'youtube',
+        'extractor_key': 'Youtube', 'display_id': video_id, 'fulltitle': f"Artist {i % 500} - Some Song Title Number {i}",
+        'duration_string': '3:00', 'is_live': False, 'was_live': False, 'epoch': 1700000000,
+        'requested_formats': None, 'format_id': '251', 'url': formats[2]['url'], 'ext': 'webm', 'acodec': 'opus',
+        'vcodec': 'none', 'abr': 130.5, 'asr': 48000, 'http_headers': dict(headers), 'protocol': 'https',
+    }
+
+
+def stream_info(i: int) -> dict:
+    # What compact_info leaves of a single-video extraction
+    video_id = f"{i:011d}"
+    return {
+        'id': video_id, 'title': f"Artist {i % 500} - Some Song Title Number {i}",
+        'url': f"https://rr3---sn-abc.googlevideo.com/videoplayback?expire=1700000000&id={video_id}&itag=251&" + 'x' * 900,
+        'webpage_url': f"https://www.youtube.com/watch?v={video_id}",
+        'thumbnail': f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg", 'duration': 180 + i % 120,
+        'acodec': 'opus', 'ext': 'webm', 'abr': 130.5, 'asr': 48000, 'format_id': '251',
+    }
+
+
+def measure(build, count: int) -> float:
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    songs = build(count)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    del songs
+    return used / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tracks', type=int, default=50000)
+    # Full extraction results run to 100+ KB each, so resolved tracks are averaged over fewer
+    parser.add_argument('--resolved', type=int, default=1000)
+    args = parser.parse_args()
+
+    members = [FakeMember(1000 + i) for i in range(20)]
+
+    def build_legacy(count: int, resolved: bool):
+        songs = []
+        for i in range(count):
+            e = entry(i)
+            song = LegacySong(e['url'], e['title'], e['thumbnail'], e['duration'], members[i % len(members)])
+            if resolved:
+                song.source = LegacySource(full_info(i))
+            songs.append(song)
+        return songs
+
+    def build_current(count: int, resolved: bool):
+        songs = []
+        for i in range(count):
+            e = entry(i)
+            member = members[i % len(members)]
+            song = Song(e['url'], e['title'], e['thumbnail'], e['duration'], member.id, member.display_name)
+            if resolved:
+                info = stream_info(i)
+                song.stream_url, song.stream_codec = info['url'], info['acodec']
+            songs.append(song)
+        return songs
+
+    tracemalloc.start()
+    results = {
+        (name, resolved): measure(lambda count: build(count, resolved), args.resolved if resolved else args.tracks)
+        for name, build in (('before', build_legacy), ('after', build_current))
+        for resolved in (False, True)
+    }
+    tracemalloc.stop()
+
+    print(f"bytes per track, {args.tracks} queued and {args.resolved} resolved tracks")
+    print(f"{'':<8} {'queued':>8} {'resolved':>9}")
+    for name in ('before', 'after'):
+        print(f"{name:<8} {results[name, False]:>8.0f} {results[name, True]:>9.0f}")
+    saved = results['before', False] - results['after', False]
+    print(f"queued tracks are {saved / results['before', False]:.0%} smaller: "
+          f"{saved * 500 / 1024:.0f} KiB less per 500-song queue")
+    saved = results['before', True] - results['after', True]
+    print(f"resolved tracks are {saved / results['before', True]:.0%} smaller: "
+          f"{saved / 1024:.0f} KiB less for each one holding a stream")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,31 @@
-import random
-import spotipy
+import time
+
+# Taken before the heavy imports so time-to-ready covers them
+PROCESS_STARTED = time.perf_counter()
+
 import re
 import os
-import yt_dlp
+import signal
 import asyncio
 import discord
+from aiohttp import web
 from discord.ext import commands
 from discord.ui import Button, View
-from spotipy.oauth2 import SpotifyClientCredentials
-from typing import Optional, Dict, List
-
-
+from typing import AsyncIterator, Optional, Dict, List, Tuple
+from urllib.parse import urlparse, parse_qs
+from audio_cache import AudioCache
+from audio_worker import FRAME_SECONDS, AudioWorkerPool, WorkerAudioSource
+from extractor import ExtractionCache, ExtractionEngine, extract_seconds, video_id_from_url
+from library import LibraryTrack, TrackLibrary
+from loudness import LoudnessCache, gain_for
+from metrics import REGISTRY, Counter, Gauge, Histogram
+from queue_journal import QueueJournal
+from reaper import OrphanReaper
+from scheduler import BULK, NOW_PLAYING, PREFETCH, ExtractionScheduler, queue_wait_seconds
+from song_queue import SongQueue
+from track_cache import TrackResolutionCache
 from dotenv import load_dotenv
 
-load_dotenv()
-
 load_dotenv()  # Load .env file
 
 bot_token = os.getenv('BOT_TOKEN')
@@ -22,37 +33,172 @@ bot_token = os.getenv('BOT_TOKEN')
 intents = discord.Intents.default()
 intents.message_content = True
 
-bot = commands.Bot(command_prefix='!', intents=intents)
+def parse_shard_ids(value: str) -> Optional[List[int]]:
+    """Parse SHARD_IDS such as "0-3" or "0,2,4" into a list of shard IDs"""
+    shard_ids = []
+    for part in filter(None, (p.strip() for p in value.split(','))):
+        if '-' in part:
+            first, last = part.split('-', 1)
+            shard_ids.extend(range(int(first), int(last) + 1))
+        else:
+            shard_ids.append(int(part))
+    return shard_ids or None
+
+# SHARD_COUNT/SHARD_IDS pin this process to some of the bot's shards (see launcher.py).
+# Without them discord.py uses the recommended shard count and runs every shard here.
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0')) or None
+SHARD_IDS = parse_shard_ids(os.getenv('SHARD_IDS', ''))
+
+class MusicBot(commands.AutoShardedBot):
+    storage_closing: Optional[asyncio.Task] = None
+
+    async def close(self):
+        await super().close()
+        # Voice is disconnected by now, so nothing plays or queues while the stores close
+        if self.storage_closing is None:
+            self.storage_closing = asyncio.create_task(close_storage())
+        # Every caller waits for the one shutdown, and a cancelled caller doesn't cut it short
+        await asyncio.shield(self.storage_closing)
+
+    async def __aexit__(self, *exc_info):
+        # run() leaves through here; wait for a close() started by SIGTERM to finish with the stores
+        await self.close()
+
+bot = MusicBot(command_prefix='!', intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+
+# Maximum number of Spotify -> YouTube lookups in flight per request
+SPOTIFY_RESOLVE_CONCURRENCY = int(os.getenv('SPOTIFY_RESOLVE_CONCURRENCY', '5'))
+
+# How many upcoming songs get their stream URL resolved ahead of time
+PREFETCH_DEPTH = int(os.getenv('PREFETCH_DEPTH', '1'))
+# Stream URLs are re-extracted if they would expire within this many seconds after the song ends
+STREAM_URL_REFRESH_MARGIN = int(os.getenv('STREAM_URL_REFRESH_MARGIN', '60'))
+# Assumed lifetime of stream URLs that don't carry an expire parameter
+STREAM_URL_DEFAULT_TTL = int(os.getenv('STREAM_URL_DEFAULT_TTL', '1800'))
+
+# Player message updates are coalesced within this window (seconds); it grows under rate-limit pressure
+PLAYER_UPDATE_DEBOUNCE = float(os.getenv('PLAYER_UPDATE_DEBOUNCE', '1.0'))
+PLAYER_UPDATE_MAX_DEBOUNCE = float(os.getenv('PLAYER_UPDATE_MAX_DEBOUNCE', '15'))
+# A send/edit slower than this means discord.py waited on an exhausted rate-limit bucket
+PLAYER_SLOW_CALL = 1.0
+
+# Songs per page of !queue
+QUEUE_PAGE_SIZE = 10
+
+# Playlists are queued page by page; the first page is small so playback starts quickly
+PLAYLIST_PAGE_SIZE = int(os.getenv('PLAYLIST_PAGE_SIZE', '50'))
+PLAYLIST_MAX_PAGE_SIZE = int(os.getenv('PLAYLIST_MAX_PAGE_SIZE', '800'))
+# Each page lists the playlist again from the top, so loading stops after this many songs
+PLAYLIST_MAX_SONGS = int(os.getenv('PLAYLIST_MAX_SONGS', '5000'))
+
+# 'opus' sends Opus from ffmpeg (stream copy when possible); 'pcm' decodes and re-encodes in-process
+PLAYBACK_MODE = os.getenv('PLAYBACK_MODE', 'opus').lower()
+# Playback volume; in opus mode only 1.0 allows a pure stream copy
+PLAYBACK_VOLUME = float(os.getenv('PLAYBACK_VOLUME', '0.5'))
+
+# Processes that run ffmpeg for playback, leaving this one to the gateway and voice
+# connections; 0 runs ffmpeg from this process
+AUDIO_WORKERS = int(os.getenv('AUDIO_WORKERS', '0'))
+
+# Prometheus endpoint (/metrics); 0 disables it. Shard processes add their index to the port.
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+# How often event-loop lag and executor queueing are sampled (seconds)
+METRICS_SAMPLE_INTERVAL = float(os.getenv('METRICS_SAMPLE_INTERVAL', '1.0'))
+
+# Persistent data (caches) lives here
+DATA_DIR = os.getenv('DATA_DIR', 'data')
+# How often new Spotify resolutions and lookup times are written to disk (seconds)
+TRACK_CACHE_FLUSH_INTERVAL = float(os.getenv('TRACK_CACHE_FLUSH_INTERVAL', '10'))
+
+# Queues are journaled to disk and restored (rejoining voice) on start-up; 0 disables it
+QUEUE_JOURNAL = os.getenv('QUEUE_JOURNAL', '1') != '0'
+# How often the playback position of each guild is saved (seconds)
+QUEUE_POSITION_INTERVAL = float(os.getenv('QUEUE_POSITION_INTERVAL', '10'))
+# Voice channels rejoined at once while restoring
+RESTORE_CONCURRENCY = int(os.getenv('RESTORE_CONCURRENCY', '20'))
+
+# Leave voice after this long with nothing playing, or this long alone in the channel (seconds; 0 never)
+IDLE_DISCONNECT_SECONDS = float(os.getenv('IDLE_DISCONNECT_SECONDS', '300'))
+EMPTY_CHANNEL_SECONDS = float(os.getenv('EMPTY_CHANNEL_SECONDS', '60'))
+# Player state of guilds out of voice and unused for this long is dropped, queue included (0 keeps it)
+GUILD_STATE_TTL = float(os.getenv('GUILD_STATE_TTL', '1800'))
+# How often idle guilds and orphaned ffmpeg processes are looked for (seconds)
+IDLE_CHECK_INTERVAL = float(os.getenv('IDLE_CHECK_INTERVAL', '15'))
+
+# Tracks played here are remembered and searched before YouTube; 0 disables the library
+LIBRARY_MAX_TRACKS = int(os.getenv('LIBRARY_MAX_TRACKS', '100000'))
+# How often recorded plays are written to disk (seconds)
+LIBRARY_FLUSH_INTERVAL = float(os.getenv('LIBRARY_FLUSH_INTERVAL', '30'))
+# A !play search is answered from the library when the best hit scores this well (0-1)
+# and beats the next one by the margin
+LIBRARY_MATCH_SCORE = float(os.getenv('LIBRARY_MATCH_SCORE', '0.75'))
+LIBRARY_MATCH_MARGIN = float(os.getenv('LIBRARY_MATCH_MARGIN', '0.1'))
+# Results listed by !search
+SEARCH_RESULTS = int(os.getenv('SEARCH_RESULTS', '5'))
+
+# Loudness normalization for guilds that turn it on with !normalize: each track is measured
+# in the background on its first play, and later plays get a gain towards the target
+LOUDNESS_TARGET = float(os.getenv('LOUDNESS_TARGET', '-14'))  # LUFS
+LOUDNESS_MAX_TRUE_PEAK = float(os.getenv('LOUDNESS_MAX_TRUE_PEAK', '-1'))  # dBTP
+LOUDNESS_MAX_GAIN = float(os.getenv('LOUDNESS_MAX_GAIN', '12'))  # dB, up or down
+# Smaller corrections are skipped, so tracks near the target keep Opus stream copy at unity volume
+LOUDNESS_MIN_GAIN = float(os.getenv('LOUDNESS_MIN_GAIN', '1'))  # dB
+# Measurements running at once, each an ffmpeg decode of the track; 0 disables normalization
+LOUDNESS_WORKERS = int(os.getenv('LOUDNESS_WORKERS', '1'))
+# Longer tracks (mixes, streams) are never measured
+LOUDNESS_MAX_TRACK_SECONDS = int(os.getenv('LOUDNESS_MAX_TRACK_SECONDS', '1800'))
+
+# Local Opus cache of played tracks; 0 disables it
+AUDIO_CACHE_MAX_BYTES = int(os.getenv('AUDIO_CACHE_MAX_BYTES', '0'))
+AUDIO_CACHE_DIR = os.getenv('AUDIO_CACHE_DIR', os.path.join(DATA_DIR, 'audio'))
+# Longer tracks (mixes, streams) are never cached
+AUDIO_CACHE_MAX_TRACK_SECONDS = int(os.getenv('AUDIO_CACHE_MAX_TRACK_SECONDS', '900'))
+# Storing a track downloads it again alongside playback, so only tracks played this often are stored
+AUDIO_CACHE_MIN_PLAYS = int(os.getenv('AUDIO_CACHE_MIN_PLAYS', '2'))
 
 # Spotify API credentials
 SPOTIFY_CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
 SPOTIFY_CLIENT_SECRET = os.getenv('SPOTIFY_CLIENT_SECRET')
 
-# Initialize Spotify client
-spotify = spotipy.Spotify(client_credentials_manager=SpotifyClientCredentials(
-    client_id=SPOTIFY_CLIENT_ID,
-    client_secret=SPOTIFY_CLIENT_SECRET
-))
-
-ytdl_format_options = {
-    'cookies': 'cookies.txt',
-    'format': 'bestaudio/best',
-    'restrictfilenames': True,
-    'noplaylist': False,
-    'nocheckcertificate': True,
-    'ignoreerrors': True,
-    'logtostderr': False,
-    'quiet': True,
-    'no_warnings': True,
-    'default_search': 'ytsearch',
-    'source_address': '0.0.0.0',
-    'extract_flat': 'in_playlist',  # Changed from True to 'in_playlist'
-    'skip_download': True,
-    'playlistend': None,  # Remove any playlist limit
-    'ignoreerrors': True,
-    'no_warnings': True,
+# Size of the pooled HTTP connection pool shared by all Spotify API calls
+SPOTIFY_POOL_SIZE = int(os.getenv('SPOTIFY_POOL_SIZE', '10'))
 
-}
+# Only the track fields SpotifyTrackInfo reads
+SPOTIFY_PLAYLIST_FIELDS = 'next,items(track(id,name,duration_ms,external_ids(isrc),artists(name),album(images)))'
+
+def create_spotify_client():
+    # spotipy (and requests) are only imported once Spotify is first needed
+    import requests
+    import spotipy
+    from spotipy.cache_handler import MemoryCacheHandler
+    from spotipy.oauth2 import SpotifyClientCredentials
+
+    # One keep-alive session for both the token endpoint and the Web API; the
+    # client-credentials token is cached in memory until it expires
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=SPOTIFY_POOL_SIZE)
+    session.mount('https://', adapter)
+    return spotipy.Spotify(
+        client_credentials_manager=SpotifyClientCredentials(
+            client_id=SPOTIFY_CLIENT_ID,
+            client_secret=SPOTIFY_CLIENT_SECRET,
+            cache_handler=MemoryCacheHandler(),
+            requests_session=session
+        ),
+        requests_session=session,
+        requests_timeout=10
+    )
+
+# Created on first use (or by warm_up after on_ready)
+spotify = None
+
+def get_spotify():
+    """The shared Spotify client, or None when Spotify isn't configured"""
+    global spotify
+    if spotify is None and SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET:
+        spotify = create_spotify_client()
+    return spotify
 
 ffmpeg_options = {
     'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
@@ -60,60 +206,240 @@ ffmpeg_options = {
 }
 
 class GuildState:
-    def __init__(self):
-        self.song_queue = []  # Will store URLs and basic info
+    def __init__(self, guild_id: int = 0, shard_id: int = 0):
+        self.guild_id = guild_id
+        self.shard_id = shard_id
+        self.song_queue = SongQueue()  # Will store URLs and basic info
         self.current_song = None
         self.is_playing = False
         self.is_processing = False
+        self.loading_song = None  # Song currently being started by play_next
+        self.prefetch_task: Optional[asyncio.Task] = None
+        self.prefetched = []  # Songs the current prefetch window covers
+        self.track_ended_at: Optional[float] = None
+        self.ingest_tasks = set()  # Background playlist page loaders
+        self.player_message: Optional[discord.Message] = None
+        self.player_channel = None
+        self.player_task: Optional[asyncio.Task] = None
+        self.player_dirty = False
+        self.player_debounce = PLAYER_UPDATE_DEBOUNCE
+        self.saved_channels = None  # (voice, text) channel IDs last written to the journal
+        self.saved_position = 0.0
+        self.play_requested_at: Optional[float] = None  # When !play found nothing playing, for time to first audio
+        self.last_active = time.monotonic()  # Last command, button or track change
+        self.alone_since: Optional[float] = None  # When the voice channel was last seen without listeners
+        self.disconnecting = False
 
-ytdl = yt_dlp.YoutubeDL(ytdl_format_options)
+# yt-dlp runs in a pool of worker processes so it doesn't compete with the event loop and audio threads
+extraction_engine = ExtractionEngine(
+    workers=int(os.getenv('EXTRACT_WORKERS', '2')),
+    timeout=float(os.getenv('EXTRACT_TIMEOUT', '30')),
+    max_jobs_per_worker=int(os.getenv('EXTRACT_MAX_JOBS_PER_WORKER', '100'))
+)
+# Hands out extraction slots: the next song first, then prefetch, then bulk loading,
+# round-robin between guilds
+extraction_scheduler = ExtractionScheduler(
+    max_concurrent=int(os.getenv('EXTRACT_CONCURRENCY', '0')) or extraction_engine.capacity,
+    per_guild=int(os.getenv('EXTRACT_GUILD_CONCURRENCY', '2')),
+    reserved=int(os.getenv('EXTRACT_RESERVED_SLOTS', '1'))
+)
+# Shared across guilds: merges identical extractions in flight, keeps recent results
+# and remembers unavailable videos
+extraction_cache = ExtractionCache(
+    extraction_engine,
+    max_entries=int(os.getenv('EXTRACT_CACHE_SIZE', '2048')),
+    ttl=float(os.getenv('EXTRACT_CACHE_TTL', '600')),
+    negative_ttl=float(os.getenv('EXTRACT_NEGATIVE_TTL', '900')),
+    # A stream result is reusable while its URL would still outlast the whole song; one
+    # without a URL (a playlist-shaped result) isn't kept, so resolve_stream reports it each time
+    stream_ttl=lambda info: (
+        stream_url_expiry(info['url']) - time.time() - (info.get('duration') or 0) - STREAM_URL_REFRESH_MARGIN
+        if info.get('url') else 0
+    ),
+    scheduler=extraction_scheduler
+)
 guild_states: Dict[int, GuildState] = {}
 
+# The caches and the journal are opened in setup_hook, so spawned worker processes
+# (which re-import this module) never touch them
+audio_cache: Optional[AudioCache] = None
+track_cache: Optional[TrackResolutionCache] = None
+track_library: Optional[TrackLibrary] = None
+loudness_cache: Optional[LoudnessCache] = None
+queue_journal: Optional[QueueJournal] = None
+# Set once saved queues are back; commands and buttons wait for it so nothing queues into a guild first
+queues_restored: Optional[asyncio.Event] = None
+
+# Started in setup_hook when AUDIO_WORKERS is set
+audio_workers: Optional[AudioWorkerPool] = None
+
+# Player message counters; updates requested minus messages sent/edited is what debouncing saved
+player_stats = {'requested': 0, 'sent': 0, 'edited': 0, 'rate_limited': 0}
+
+def open_storage():
+    global audio_cache, track_cache, track_library, loudness_cache, queue_journal, queues_restored
+    if AUDIO_CACHE_MAX_BYTES > 0:
+        audio_cache = AudioCache(
+            AUDIO_CACHE_DIR,
+            max_bytes=AUDIO_CACHE_MAX_BYTES,
+            max_track_seconds=AUDIO_CACHE_MAX_TRACK_SECONDS,
+            min_plays=AUDIO_CACHE_MIN_PLAYS
+        )
+        audio_cache.on_stored = measure_stored
+    # Spotify track -> YouTube video resolutions, kept across restarts
+    track_cache = TrackResolutionCache(
+        os.path.join(DATA_DIR, 'track_cache.sqlite3'),
+        ttl=float(os.getenv('TRACK_CACHE_TTL', str(30 * 24 * 3600))),
+        max_entries=int(os.getenv('TRACK_CACHE_MAX_ENTRIES', '100000'))
+    )
+    # Every track played, for searches answered without YouTube
+    if LIBRARY_MAX_TRACKS > 0:
+        track_library = TrackLibrary(os.path.join(DATA_DIR, 'library.sqlite3'), max_tracks=LIBRARY_MAX_TRACKS)
+    # Track loudness measurements and the guilds that normalize with them
+    if LOUDNESS_WORKERS > 0:
+        loudness_cache = LoudnessCache(
+            os.path.join(DATA_DIR, 'loudness.sqlite3'),
+            max_track_seconds=LOUDNESS_MAX_TRACK_SECONDS,
+            max_concurrent=LOUDNESS_WORKERS
+        )
+    # Queue changes of the guilds in this process, replayed on the next start
+    queues_restored = asyncio.Event()
+    if QUEUE_JOURNAL:
+        queue_journal = QueueJournal(
+            os.path.join(DATA_DIR, 'queues'),
+            name=f"queues-{os.environ['SHARD_PROCESS_INDEX']}" if os.getenv('SHARD_PROCESS_INDEX') else 'queues'
+        )
+    else:
+        queues_restored.set()
+
+async def close_storage():
+    """Write out buffered plays and resolutions, then close the stores, the extraction pool and the audio workers"""
+    for name, store in (('track library', track_library), ('Spotify resolution cache', track_cache)):
+        if store is None:
+            continue
+        try:
+            await store.flush()
+        except Exception as e:
+            print(f"Error flushing the {name}: {str(e)}")
+    for store in (queue_journal, track_cache, audio_cache, loudness_cache, track_library):
+        # Some stores define __len__, so an empty one is falsy
+        if store is not None:
+            store.close()
+    extraction_engine.shutdown()
+    if audio_workers:
+        # Joins the worker processes, which can take a few seconds
+        await asyncio.get_running_loop().run_in_executor(None, audio_workers.close)
+
 class SpotifyTrackInfo:
     def __init__(self, track_data):
+        self.id = track_data.get('id')
+        self.isrc = track_data.get('external_ids', {}).get('isrc')
         self.title = track_data['name']
         self.artist = track_data['artists'][0]['name']
         self.duration = int(track_data['duration_ms'] / 1000)
         self.thumbnail = track_data['album']['images'][0]['url'] if track_data['album']['images'] else ''
         self.search_query = f"{self.title} {self.artist}"
 
-async def get_spotify_tracks(url: str) -> List[SpotifyTrackInfo]:
-    tracks = []
-    
+async def iter_spotify_tracks(url: str) -> AsyncIterator[List[SpotifyTrackInfo]]:
+    """Yield the tracks behind a Spotify URL one API page at a time, without blocking the event loop"""
+    loop = asyncio.get_event_loop()
+    # Usually already created by warm_up; otherwise this first call pays the import
+    client = await loop.run_in_executor(None, get_spotify)
+    if client is None:
+        return
+
+    def call(method, *args, **kwargs):
+        return loop.run_in_executor(None, lambda: method(*args, **kwargs))
+
+    match = re.search(r'open.spotify.com\/(track|album|playlist)\/([a-zA-Z0-9]+)', url)
+    if not match:
+        return
+    kind, spotify_id = match.groups()
+
     try:
-        if 'track' in url:
+        if kind == 'track':
             # Single track
-            track = spotify.track(url)
-            tracks.append(SpotifyTrackInfo(track))
+            track = await call(client.track, spotify_id)
+            yield [SpotifyTrackInfo(track)]
         
-        elif 'album' in url:
-            # Album
-            album = spotify.album(url)
-            for track in album['tracks']['items']:
-                track['album'] = album
-                tracks.append(SpotifyTrackInfo(track))
+        elif kind == 'album':
+            # Album; the first page of tracks comes with the album itself
+            album = await call(client.album, spotify_id)
+            page = album['tracks']
+            offset = 0
+            while True:
+                tracks = []
+                for track in page['items']:
+                    track['album'] = album
+                    tracks.append(SpotifyTrackInfo(track))
+                yield tracks
+                if not page.get('next'):
+                    break
+                offset += len(page['items'])
+                page = await call(client.album_tracks, spotify_id, limit=50, offset=offset)
         
-        elif 'playlist' in url:
+        elif kind == 'playlist':
             # Playlist
-            playlist = spotify.playlist(url)
-            for item in playlist['tracks']['items']:
-                if item['track']:  # Check if track exists (not None)
-                    tracks.append(SpotifyTrackInfo(item['track']))
-        
-        return tracks
+            offset = 0
+            while True:
+                page = await call(
+                    client.playlist_items, spotify_id,
+                    fields=SPOTIFY_PLAYLIST_FIELDS, limit=100, offset=offset, additional_types=('track',)
+                )
+                # Check if track exists (not None, e.g. removed or local files)
+                yield [SpotifyTrackInfo(item['track']) for item in page['items'] if item.get('track')]
+                if not page.get('next'):
+                    break
+                offset += len(page['items'])
     except Exception as e:
         print(f"Error processing Spotify URL: {e}")
-        return []
 
 class Song:
-    def __init__(self, url: str, title: str, thumbnail: str, duration: int, requester: discord.Member, source_type: str = 'youtube'):
+    """A queued track: only what the queue, the player message and the journal show or replay.
+
+    Queues can hold thousands of these, so there is no per-instance dict, the requester is
+    kept as an ID and display name rather than a Member, and of the extraction result only
+    the stream URL and codec are kept.
+    """
+
+    __slots__ = (
+        'url', 'title', 'thumbnail', 'duration', 'requester_id', 'requester_name', 'source_type', 'source',
+        'stream_url', 'stream_codec', 'stream_expires_at', 'resolve_task', 'resume_position',
+    )
+
+    def __init__(self, url: str, title: str, thumbnail: str, duration: int, requester_id: int, requester_name: str,
+                 source_type: str = 'youtube'):
         self.url = url
         self.title = title
         self.thumbnail = thumbnail
         self.duration = duration
-        self.requester = requester
+        self.requester_id = requester_id
+        self.requester_name = requester_name
         self.source = None
         self.source_type = source_type
+        self.stream_url: Optional[str] = None  # Filled in by prefetch or play_next
+        self.stream_codec: Optional[str] = None
+        self.stream_expires_at = 0.0
+        self.resolve_task: Optional[asyncio.Task] = None
+        self.resume_position = 0.0  # Where playback starts, for songs restored mid-track
+
+    @property
+    def requester_mention(self) -> str:
+        return f"<@{self.requester_id}>"
+
+    def has_fresh_stream(self) -> bool:
+        if not self.stream_url:
+            return False
+        # The URL must stay valid for the whole song, since ffmpeg reconnects with it
+        return self.stream_expires_at - time.time() > (self.duration or 0) + STREAM_URL_REFRESH_MARGIN
+
+    def drop_stream(self):
+        if self.resolve_task and not self.resolve_task.done():
+            self.resolve_task.cancel()
+        self.resolve_task = None
+        self.stream_url = None
+        self.stream_codec = None
+        self.stream_expires_at = 0.0
 
     @staticmethod
     def parse_duration(duration: int) -> str:
@@ -131,124 +457,383 @@ class Song:
         else:
             return f"{seconds} sec"
 
-async def process_spotify_track(track: SpotifyTrackInfo, requester: discord.Member) -> Optional[Song]:
+async def process_spotify_track(track: SpotifyTrackInfo, requester: discord.Member, guild_id: int = 0,
+                                priority: int = BULK) -> Optional[Song]:
     try:
+        cached = track_cache.get(track.id, track.isrc)
+        if cached:
+            return Song(
+                url=f"https://www.youtube.com/watch?v={cached.video_id}",
+                title=f"{track.title} - {track.artist}",
+                thumbnail=track.thumbnail,
+                duration=track.duration,
+                requester_id=requester.id,
+                requester_name=requester.display_name,
+                source_type='spotify'
+            )
+
         # Search for the track on YouTube
         search_query = f"ytsearch1:{track.search_query}"
-        info = await asyncio.get_event_loop().run_in_executor(None, lambda: ytdl.extract_info(search_query, download=False))
+        info = await extraction_cache.extract(search_query, 'flat', guild_id=guild_id, priority=priority)
         
         if info and 'entries' in info and info['entries']:
             entry = info['entries'][0]
+            track_cache.put(track.id, track.isrc, entry.get('id'), entry.get('title', ''), entry.get('duration') or 0)
             return Song(
                 url=entry.get('url', entry.get('webpage_url', '')),
                 title=f"{track.title} - {track.artist}",
                 thumbnail=track.thumbnail,
                 duration=track.duration,
-                requester=requester,
+                requester_id=requester.id,
+                requester_name=requester.display_name,
                 source_type='spotify'
             )
     except Exception as e:
         print(f"Error processing Spotify track: {e}")
     return None
 
-class YTDLSource(discord.PCMVolumeTransformer):
-    def __init__(self, source, *, data, volume=0.5):
+class ResolveProgress:
+    def __init__(self, total: int):
+        self.total = total
+        self.resolved = 0
+        self.failed = 0
+
+    @property
+    def pending(self) -> int:
+        return self.total - self.resolved - self.failed
+
+    def summary(self) -> str:
+        return f"Resolved {self.resolved}/{self.total} tracks | {self.failed} failed | {self.pending} pending"
+
+async def resolve_spotify_tracks(ctx, pages: AsyncIterator[List[SpotifyTrackInfo]], voice_client, single: bool = False) -> ResolveProgress:
+    """Resolve Spotify tracks concurrently as pages arrive, queueing them in their original order"""
+    guild_state = get_guild_state(ctx.guild.id)
+    progress = ResolveProgress(0)
+    semaphore = asyncio.Semaphore(SPOTIFY_RESOLVE_CONCURRENCY)
+    completed: asyncio.Queue = asyncio.Queue()
+    results: List[Optional[Song]] = []
+    done: List[bool] = []
+    tasks = []
+    next_index = 0
+
+    async def resolve(index: int, track: SpotifyTrackInfo):
+        async with semaphore:
+            # The first track is what the requester waits to hear; the rest fill the queue
+            song = await process_spotify_track(track, ctx.author, ctx.guild.id, NOW_PLAYING if index == 0 else BULK)
+        completed.put_nowait((index, song))
+
+    async def load_pages():
+        async for page in pages:
+            for track in page:
+                results.append(None)
+                done.append(False)
+                progress.total += 1
+                tasks.append(asyncio.create_task(resolve(len(results) - 1, track)))
+
+    progress_message = None
+    if not single:
+        progress_message = await ctx.send(embed=discord.Embed(
+            description=f"Resolving Spotify tracks...\n{progress.summary()}",
+            color=discord.Color.blue()
+        ))
+    last_edit = asyncio.get_event_loop().time()
+
+    loader = asyncio.create_task(load_pages())
+    getter = None
+    try:
+        while not loader.done() or progress.pending:
+            # One getter outlives the loader's wake-ups so no finished lookup is dropped
+            if getter is None:
+                getter = asyncio.create_task(completed.get())
+            if not loader.done():
+                await asyncio.wait({getter, loader}, return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    # All pages are loaded; go round again to check what is still pending
+                    continue
+
+            index, song = await getter
+            getter = None
+            results[index] = song
+            done[index] = True
+            if song:
+                progress.resolved += 1
+            else:
+                progress.failed += 1
+
+            # Only queue the contiguous finished prefix so the original order is kept
+            ready = []
+            while next_index < len(done) and done[next_index]:
+                if results[next_index]:
+                    ready.append(results[next_index])
+                results[next_index] = None
+                next_index += 1
+
+            if ready:
+                was_playing = voice_client.is_playing() or voice_client.is_paused()
+                guild_state.song_queue.extend(ready)
+                schedule_prefetch(guild_state)
+                if single:
+                    await ctx.send(embed=discord.Embed(
+                        description=f"{'Added to queue' if was_playing else 'Playing'}: {ready[0].title}",
+                        color=discord.Color.green()
+                    ))
+                # Once disconnected the songs stay queued for the next !play instead of failing one by one
+                # A paused song stays paused; the new tracks wait behind it like ingest_playlist's do
+                if (voice_client.is_connected() and not voice_client.is_playing() and not voice_client.is_paused()
+                        and not guild_state.is_processing):
+                    await play_next(ctx, voice_client)
+
+            now = asyncio.get_event_loop().time()
+            if progress_message and progress.pending and now - last_edit >= 2:
+                last_edit = now
+                await progress_message.edit(embed=discord.Embed(
+                    description=f"Resolving Spotify tracks...\n{progress.summary()}",
+                    color=discord.Color.blue()
+                ))
+        # Surface errors from building the track list
+        loader.result()
+    finally:
+        loader.cancel()
+        if getter:
+            getter.cancel()
+        for task in tasks:
+            task.cancel()
+
+    if progress_message:
+        if progress.resolved:
+            await progress_message.edit(embed=discord.Embed(
+                description=f"Added {progress.resolved} songs to the queue\n{progress.summary()}",
+                color=discord.Color.green()
+            ))
+        else:
+            await progress_message.delete()
+    return progress
+
+# Time from the end of one track to the first audio packet of the next one
+track_gap_seconds = Histogram('track_gap_seconds', 'Time from the end of a track to the first audio packet of the next')
+time_to_first_audio_seconds = Histogram('time_to_first_audio_seconds', 'Time from !play with nothing playing to the first audio packet')
+play_retries = Counter('play_retries_total', 'Failed attempts to start a song in play_next')
+play_skips = Counter('play_skips_total', 'Songs skipped after exhausting their retries')
+unavailable_skips = Counter('unavailable_skips_total', 'Queued songs skipped without extraction because the video is known to be unavailable')
+
+def stream_url_expiry(url: str) -> float:
+    """Expiry timestamp of a stream URL, taken from googlevideo's expire parameter when present"""
+    try:
+        expire = parse_qs(urlparse(url).query).get('expire')
+        if expire:
+            return float(expire[0])
+    except ValueError:
+        pass
+    return time.time() + STREAM_URL_DEFAULT_TTL
+
+def stream_kind() -> str:
+    return 'single_opus' if PLAYBACK_MODE == 'opus' else 'single'
+
+async def ensure_stream(song: Song, loop: asyncio.AbstractEventLoop, guild_id: int = 0, priority: int = PREFETCH):
+    """Make sure the song has a fresh stream URL, sharing any extraction already in flight for it"""
+    if song.has_fresh_stream():
+        return
+    if song.resolve_task is None or song.resolve_task.done():
+        song.resolve_task = loop.create_task(resolve_stream(song, guild_id, priority))
+    else:
+        # A prefetch still waiting for a worker becomes urgent once the song is up next
+        extraction_cache.promote(song.url, stream_kind(), priority)
+    await asyncio.shield(song.resolve_task)
+
+async def resolve_stream(song: Song, guild_id: int = 0, priority: int = PREFETCH):
+    data = await extraction_cache.extract(song.url, stream_kind(), guild_id=guild_id, priority=priority)
+    
+    if data is None:
+        raise Exception("Video is unavailable")
+        
+    if 'url' not in data:
+        raise Exception("Could not extract video URL")
+    
+    # The info dict itself isn't kept; the extraction cache has it while it is still useful
+    song.stream_url = data['url']
+    song.stream_codec = data.get('acodec')
+    song.stream_expires_at = stream_url_expiry(data['url'])
+
+class TrackSource:
+    """Where the audio comes from, playback position and the first-packet hook shared by all sources"""
+
+    def _init_track(self, location: str, codec: Optional[str], *, local: bool = False, start: float = 0.0,
+                    volume: float = PLAYBACK_VOLUME):
+        self.location = location
+        self.codec = codec
+        self.playback_volume = volume
+        self.local = local
+        self.start_position = start
+        self.packets = 0
+        self.on_first_packet = None
+
+    @property
+    def position(self) -> float:
+        return self.start_position + self.packets * FRAME_SECONDS
+
+    def read(self) -> bytes:
+        data = super().read()
+        if data:
+            self.packets += 1
+        if self.on_first_packet:
+            callback, self.on_first_packet = self.on_first_packet, None
+            callback()
+        return data
+
+def opus_options(codec: Optional[str], volume: float) -> Tuple[bool, str]:
+    """Whether Opus output can be stream-copied, and the ffmpeg output options"""
+    copy = codec == 'opus' and volume == 1.0
+    return copy, '-vn' if copy else f'-vn -filter:a volume={volume}'
+
+def seek_options(before_options: Optional[str], start: float) -> Optional[str]:
+    # Input-side seek, so ffmpeg skips ahead without decoding
+    if not start:
+        return before_options
+    return f"{before_options or ''} -ss {start:.2f}".strip()
+
+loudness_plays = Counter('loudness_plays_total', 'Plays in guilds that normalize, by whether the track was measured yet '
+                         'or can be at all', labels=('result',))
+
+def track_volume(video_id: Optional[str], guild_id: Optional[int], location: str, duration: Optional[int],
+                 local: bool = False) -> float:
+    """Playback volume for a track: normalized from its cached measurement where the guild
+    wants that, otherwise PLAYBACK_VOLUME. Unmeasured tracks are measured in the background."""
+    if not loudness_cache or not loudness_cache.normalizes(guild_id):
+        return PLAYBACK_VOLUME
+    if not loudness_cache.measurable(video_id, duration):
+        # Live, too long to measure, or not from YouTube
+        loudness_plays.labels('unmeasurable').inc()
+        return PLAYBACK_VOLUME
+    loudness = loudness_cache.get(video_id)
+    if loudness is None:
+        loudness_plays.labels('unmeasured').inc()
+        # A track being written to the audio cache is measured from the file once it's there
+        if not (audio_cache and audio_cache.storing(video_id)):
+            loudness_cache.schedule_measure(video_id, location, duration, local=local)
+        return PLAYBACK_VOLUME
+    loudness_plays.labels('normalized').inc()
+    gain = gain_for(loudness, LOUDNESS_TARGET, LOUDNESS_MAX_TRUE_PEAK, LOUDNESS_MAX_GAIN, LOUDNESS_MIN_GAIN)
+    return round(PLAYBACK_VOLUME * gain, 4)
+
+def measure_stored(video_id: str, path: str, duration: int):
+    """Audio cache hook: measure a newly stored track from its file instead of downloading it again"""
+    if loudness_cache and loudness_cache.wants(video_id):
+        loudness_cache.schedule_measure(video_id, path, duration, local=True)
+
+class YTDLOpusSource(TrackSource, discord.FFmpegOpusAudio):
+    """Sends Opus straight from ffmpeg, so no per-frame work happens in Python.
+
+    Opus input played at unity volume is stream-copied; anything else is encoded by
+    ffmpeg with the volume applied as a filter.
+    """
+
+    def __init__(self, location: str, *, codec: Optional[str], volume: float = PLAYBACK_VOLUME, before_options: Optional[str] = None,
+                 local: bool = False, start: float = 0.0):
+        copy, options = opus_options(codec, volume)
+        super().__init__(location, codec='opus' if copy else None, before_options=seek_options(before_options, start), options=options)
+        self._init_track(location, codec, local=local, start=start, volume=volume)
+        self.stream_copy = copy
+
+class WorkerTrackSource(TrackSource, WorkerAudioSource):
+    """Opus packets produced by an audio worker process; always Opus, like YTDLOpusSource"""
+
+    # WorkerAudioSource tracks the position itself, since a worker restart resumes mid-track
+    position = WorkerAudioSource.position
+
+    def __init__(self, location: str, *, codec: Optional[str], guild_id: int, volume: float = PLAYBACK_VOLUME,
+                 before_options: Optional[str] = None, local: bool = False, start: float = 0.0):
+        copy, options = opus_options(codec, volume)
+        super().__init__(audio_workers, guild_id, location, start=start, before_options=before_options, options=options, copy=copy)
+        self._init_track(location, codec, local=local, start=start, volume=volume)
+        self.stream_copy = copy
+        audio_workers.place(self)
+
+class YTDLSource(TrackSource, discord.PCMVolumeTransformer):
+    def __init__(self, source, *, codec: Optional[str], location: str, local: bool = False, start: float = 0.0, volume=PLAYBACK_VOLUME):
         super().__init__(source, volume)
-        self.data = data
-        self.title = data.get('title')
-        self.url = data.get('webpage_url', '')
-        self.thumbnail = data.get('thumbnail', '')
-        self.duration = Song.parse_duration(int(data.get('duration', 0)))
+        self._init_track(location, codec, local=local, start=start, volume=volume)
+
+    @classmethod
+    def from_location(cls, location: str, codec: Optional[str], *, local: bool = False, start: float = 0.0,
+                      guild_id: Optional[int] = None, volume: float = PLAYBACK_VOLUME) -> TrackSource:
+        before_options = None if local else ffmpeg_options['before_options']
+        if audio_workers and guild_id is not None:
+            return WorkerTrackSource(location, codec=codec, guild_id=guild_id, volume=volume, before_options=before_options,
+                                     local=local, start=start)
+        if PLAYBACK_MODE == 'opus':
+            try:
+                return YTDLOpusSource(location, codec=codec, volume=volume, before_options=before_options, local=local, start=start)
+            except discord.ClientException as e:
+                print(f"Opus playback unavailable, falling back to PCM: {str(e)}")
+        return cls(
+            discord.FFmpegPCMAudio(location, before_options=seek_options(before_options, start), options='-vn'),
+            codec=codec, location=location, local=local, start=start, volume=volume
+        )
 
     @classmethod
-    async def create_source(cls, song: Song, *, loop: Optional[asyncio.BaseEventLoop] = None):
+    async def create_source(cls, song: Song, *, guild_id: Optional[int] = None, start: float = 0.0,
+                            loop: Optional[asyncio.BaseEventLoop] = None) -> TrackSource:
         loop = loop or asyncio.get_event_loop()
         
-        ytdl_single_options = ytdl_format_options.copy()
-        ytdl_single_options.update({
-            'extract_flat': False,
-            'ignoreerrors': True,
-            'no_warnings': True,
-            'quiet': True,
-            'age_limit': None  # Ignore age restrictions
-        })
-        
-        ytdl_single = yt_dlp.YoutubeDL(ytdl_single_options)
-        
         try:
-            data = await loop.run_in_executor(None, lambda: ytdl_single.extract_info(song.url, download=False))
+            video_id = video_id_from_url(song.url)
+            if audio_cache:
+                path = await audio_cache.get(video_id)
+                if path:
+                    # Cache hit: play the local file, no extraction or network needed
+                    volume = track_volume(video_id, guild_id, path, song.duration, local=True)
+                    return cls.from_location(path, 'opus', local=True, start=start, guild_id=guild_id, volume=volume)
             
-            if data is None:
-                raise Exception("Video is unavailable")
-                
-            if 'url' not in data:
-                raise Exception("Could not extract video URL")
-                
-            filename = data['url']
-            return cls(discord.FFmpegPCMAudio(filename, **ffmpeg_options), data=data)
+            await ensure_stream(song, loop, guild_id or 0, NOW_PLAYING)
+            # Stored first, so a loudness measurement can wait for the file instead of streaming the track again
+            if audio_cache:
+                audio_cache.schedule_store(video_id, song.stream_url, song.stream_codec, song.duration)
+            volume = track_volume(video_id, guild_id, song.stream_url, song.duration)
+            return cls.from_location(song.stream_url, song.stream_codec, start=start, guild_id=guild_id, volume=volume)
             
         except Exception as e:
             print(f"Error creating source for {song.title}: {str(e)}")
             raise
 
-async def extract_playlist_info(query: str, requester: discord.Member, ctx) -> List[Song]:
+async def extract_playlist_info(query: str, requester: discord.Member, start: int = 1, count: Optional[int] = None,
+                                guild_id: int = 0, priority: int = NOW_PLAYING) -> Tuple[List[Song], Optional[int]]:
+    """Extract a search result, single video or one page of a playlist as unresolved songs.
+
+    Playlist entries come straight from the flat listing; their stream info is resolved
+    once they get close to playing. Returns the songs and the index of the next playlist
+    page, or None once the listing is exhausted.
+    """
     try:
         is_url = query.startswith(('http://', 'https://', 'www.'))
         
-        # If it's not a URL, modify the query to use YouTube search
+        # If it's not a URL, look in the library before searching YouTube
         if not is_url:
+            track = library_match(query)
+            if track:
+                return [song_from_library(track, requester)], None
             query = f"ytsearch1:{query}"
         
-        # Extract basic info from playlist or search result
-        info = await asyncio.get_event_loop().run_in_executor(None, lambda: ytdl.extract_info(query, download=False))
+        count = count or PLAYLIST_PAGE_SIZE
+        info = await extraction_cache.extract(query, 'flat', guild_id=guild_id, priority=priority,
+                                              playliststart=start, playlistend=start + count - 1)
         
         songs = []
-        if 'entries' in info:
-            # For each entry in playlist or search results
+        next_start = None
+        if info and 'entries' in info:
             entries = info['entries']
+            if is_url and len(entries) >= count:
+                next_start = start + count
             
-            # If it's a playlist with partial information, get full details
-            if is_url and any(entry.get('_type') == 'url' for entry in entries if entry):
-                # Create new ytdl instance with full extraction
-                full_info_options = ytdl_format_options.copy()
-                full_info_options['extract_flat'] = False
-                
-                ytdl_full = yt_dlp.YoutubeDL(full_info_options)
-                info = await asyncio.get_event_loop().run_in_executor(None, lambda: ytdl_full.extract_info(query, download=False))
-                entries = info['entries'] if 'entries' in info else []
-            
-            # Process all entries
             for entry in entries:
                 if entry and (entry.get('url') or entry.get('webpage_url')):
-                    try:
-                        # Create Song object with all available information
-                        song = Song(
-                            url=entry.get('url', entry.get('webpage_url', '')),
-                            title=entry.get('title', 'Unknown'),
-                            thumbnail=entry.get('thumbnail', ''),
-                            duration=entry.get('duration', 0),
-                            requester=requester
-                        )
-                        songs.append(song)
-                    except Exception as e:
-                        print(f"Error processing playlist entry: {str(e)}")
-                        continue
-                        
-            if len(songs) > 0:
-                if len(songs) > 500:  # Add a reasonable upper limit
-                    songs = songs[:500]
-                    await ctx.send(embed=discord.Embed(
-                        description="⚠️ Playlist too large! Only the first 500 songs will be queued.",
-                        color=discord.Color.yellow()
-                    ))
-                
-                # Add progress message for large playlists
-                if len(songs) > 50:
-                    await ctx.send(embed=discord.Embed(
-                        description=f"Processing large playlist... Added {len(songs)} songs to queue.",
-                        color=discord.Color.blue()
+                    songs.append(Song(
+                        url=entry.get('url', entry.get('webpage_url', '')),
+                        title=entry.get('title', 'Unknown'),
+                        thumbnail=entry.get('thumbnail', ''),
+                        duration=entry.get('duration') or 0,
+                        requester_id=requester.id,
+                        requester_name=requester.display_name
                     ))
-                    
         else:
             # Single video
             if info and (info.get('url') or info.get('webpage_url')):
@@ -256,33 +841,367 @@ async def extract_playlist_info(query: str, requester: discord.Member, ctx) -> L
                     url=info.get('webpage_url', info.get('url', query)),
                     title=info.get('title', 'Unknown'),
                     thumbnail=info.get('thumbnail', ''),
-                    duration=info.get('duration', 0),
-                    requester=requester
+                    duration=info.get('duration') or 0,
+                    requester_id=requester.id,
+                    requester_name=requester.display_name
                 )
                 songs.append(song)
             
-        return songs
+        return songs, next_start
     except Exception as e:
         print(f"Error extracting info: {str(e)}")
         raise
 
+def library_match(query: str) -> Optional[LibraryTrack]:
+    if not track_library:
+        return None
+    track = track_library.match(query, LIBRARY_MATCH_SCORE, LIBRARY_MATCH_MARGIN)
+    if track and extraction_cache.is_unavailable(track.video_id):
+        return None
+    return track
+
+def song_from_library(track: LibraryTrack, requester: discord.Member) -> Song:
+    return Song(
+        url=f"https://www.youtube.com/watch?v={track.video_id}",
+        title=track.title,
+        thumbnail=f"https://i.ytimg.com/vi/{track.video_id}/hqdefault.jpg",
+        duration=track.duration,
+        requester_id=requester.id,
+        requester_name=requester.display_name
+    )
+
+def song_artist(song: Song) -> str:
+    # Spotify songs are titled "Title - Artist"; YouTube music videos usually "Artist - Title"
+    if ' - ' not in song.title:
+        return ''
+    return song.title.rpartition(' - ')[2] if song.source_type == 'spotify' else song.title.partition(' - ')[0]
+
+async def ingest_playlist(ctx, query: str, start: int, voice_client):
+    """Keep queueing playlist pages in the background, growing the page size as we go.
+
+    Every page is a separate extraction, possibly on a different worker, and yt-dlp walks
+    the listing from the first entry up to the page it was asked for, so loading a playlist
+    takes about songs / (2 * PLAYLIST_MAX_PAGE_SIZE) times the requests of one full listing.
+    PLAYLIST_MAX_SONGS keeps that bounded.
+    """
+    guild_state = get_guild_state(ctx.guild.id)
+    count = PLAYLIST_PAGE_SIZE
+    added = 0
+    try:
+        while start and start <= PLAYLIST_MAX_SONGS:
+            count = min(count * 2, PLAYLIST_MAX_PAGE_SIZE, PLAYLIST_MAX_SONGS - start + 1)
+            songs, start = await extract_playlist_info(query, ctx.author, start, count, ctx.guild.id, BULK)
+            if songs:
+                guild_state.song_queue.extend(songs)
+                schedule_prefetch(guild_state)
+                added += len(songs)
+                if not voice_client.is_playing() and not voice_client.is_paused() and not guild_state.is_processing:
+                    await play_next(ctx, voice_client)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"Error loading playlist page: {str(e)}")
+        await ctx.send(embed=discord.Embed(
+            description=f"Stopped loading the playlist after {added} more songs: {str(e)}",
+            color=discord.Color.yellow()
+        ))
+        return
+
+    if start:
+        await ctx.send(embed=discord.Embed(
+            description=f"Stopped loading the playlist at {PLAYLIST_MAX_SONGS} songs, added {added} more songs to the queue",
+            color=discord.Color.yellow()
+        ))
+    elif added:
+        await ctx.send(embed=discord.Embed(
+            description=f"Finished loading playlist, added {added} more songs to the queue",
+            color=discord.Color.green()
+        ))
+
+def cancel_ingestion(guild_state: GuildState):
+    for task in guild_state.ingest_tasks:
+        task.cancel()
+    guild_state.ingest_tasks.clear()
+    # Queued extractions for songs that are gone; the one for the next song may still be needed
+    extraction_scheduler.cancel_guild(guild_state.guild_id, (PREFETCH, BULK))
+
+
+def shard_id_for(guild_id: int) -> int:
+    # Discord's guild -> shard mapping
+    return (guild_id >> 22) % (bot.shard_count or 1)
 
 def get_guild_state(guild_id: int) -> GuildState:
     if guild_id not in guild_states:
-        guild_states[guild_id] = GuildState()
-    return guild_states[guild_id]
+        guild_state = GuildState(guild_id, shard_id_for(guild_id))
+        attach_journal(guild_id, guild_state)
+        guild_states[guild_id] = guild_state
+    guild_state = guild_states[guild_id]
+    # Everything that looks a guild up is activity: commands, buttons, track changes
+    guild_state.last_active = time.monotonic()
+    return guild_state
 
-def create_music_control_view():
-    view = discord.ui.View()
-    view.add_item(discord.ui.Button(style=discord.ButtonStyle.primary, label="⏭️ Skip", custom_id="skip"))
-    view.add_item(discord.ui.Button(style=discord.ButtonStyle.secondary, label="⏯️ Pause/Resume", custom_id="pause_resume"))
-    view.add_item(discord.ui.Button(style=discord.ButtonStyle.danger, label="⏹️ Stop", custom_id="stop"))
-    view.add_item(discord.ui.Button(style=discord.ButtonStyle.success, label="🔀 Shuffle Queue", custom_id="shuffle"))
-    view.add_item(discord.ui.Button(style=discord.ButtonStyle.blurple, label="❌ Clear Queue", custom_id="clear_queue"))
-    return view
-
-async def update_player_message(ctx):
+# Queue persistence
+
+class RestoredContext:
+    """The parts of a command context playback needs, for guilds resumed after a restart"""
+
+    def __init__(self, guild: discord.Guild, channel):
+        self.guild = guild
+        self.channel = channel
+
+    async def send(self, *args, **kwargs):
+        return await self.channel.send(*args, **kwargs)
+
+def song_record(song: Song) -> dict:
+    return {
+        'url': song.url, 'title': song.title, 'thumbnail': song.thumbnail, 'duration': song.duration,
+        'source_type': song.source_type, 'requester_id': song.requester_id, 'requester_name': song.requester_name,
+    }
+
+def song_from_record(record: dict) -> Song:
+    return Song(
+        record['url'], record['title'], record['thumbnail'], record['duration'],
+        record['requester_id'], record['requester_name'], record['source_type']
+    )
+
+def attach_journal(guild_id: int, guild_state: GuildState):
+    if not queue_journal:
+        return
+
+    def on_change(op, args, result):
+        if op == 'append':
+            args = (song_record(args[0]),)
+        elif op == 'extend':
+            args = ([song_record(song) for song in args[0]],)
+        elif op == 'insert':
+            args = (args[0], song_record(args[1]))
+        elif op == 'shuffle':
+            args = (result,)
+        queue_journal.record(guild_id, op, *args)
+
+    guild_state.song_queue.on_change = on_change
+
+def journal(guild_id: int, op: str, *args):
+    if queue_journal:
+        queue_journal.record(guild_id, op, *args)
+
+async def save_positions():
+    # Positions change every frame, so they are sampled instead of journaled
+    while True:
+        await asyncio.sleep(QUEUE_POSITION_INTERVAL)
+        for guild_id, guild_state in list(guild_states.items()):
+            guild = bot.get_guild(guild_id)
+            source = guild.voice_client.source if guild and guild.voice_client else None
+            if guild_state.current_song and isinstance(source, TrackSource):
+                position = round(source.position, 1)
+                if abs(position - guild_state.saved_position) >= 1:
+                    guild_state.saved_position = position
+                    journal(guild_id, 'position', position)
+
+async def restore_guilds():
+    """Rebuild the saved queues and resume playback where each guild left off.
+
+    Songs come back unresolved, so nothing is extracted until prefetch reaches them.
+    Commands are held until the queues are rebuilt, since this replaces them wholesale.
+    """
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    connect_slots = asyncio.Semaphore(RESTORE_CONCURRENCY)
+    songs = 0
+    resumes = []
+    try:
+        states = await loop.run_in_executor(None, queue_journal.load)
+        for guild_id, state in states.items():
+            guild = bot.get_guild(guild_id)
+            if guild is None:
+                # Not on this process's shards, or the bot left the guild
+                continue
+            guild_state = get_guild_state(guild_id)
+            # Filled directly; these songs are already in the journal
+            guild_state.song_queue = SongQueue(song_from_record(record) for record in state['queue'])
+            attach_journal(guild_id, guild_state)
+            if state['current']:
+                song = song_from_record(state['current'])
+                song.resume_position = state['position'] if not song.duration or state['position'] < song.duration else 0.0
+                # Journaled as back at the head of the queue and no longer current, so a restart
+                # before it plays again restores it once rather than adding another copy
+                guild_state.song_queue.insert(0, song)
+                journal(guild_id, 'current', None)
+            songs += len(guild_state.song_queue)
+            if state['voice_channel'] and guild_state.song_queue:
+                resumes.append(resume_guild(guild, state, connect_slots))
+    finally:
+        # Even if loading failed, commands must not wait forever
+        queues_restored.set()
+    print(f"Restored {len(states)} saved queues ({songs} songs) in {time.perf_counter() - started:.2f}s")
+    queue_journal.compact()
+
+    results = await asyncio.gather(*resumes, return_exceptions=True)
+    failed = sum(1 for result in results if result is not True)
+    print(f"Resumed playback in {len(results) - failed} guilds ({failed} failed) after {time.perf_counter() - started:.2f}s")
+
+async def resume_guild(guild: discord.Guild, state: dict, connect_slots: asyncio.Semaphore) -> bool:
+    channel = guild.get_channel(state['voice_channel'])
+    text_channel = guild.get_channel(state['text_channel'])
+    if not isinstance(channel, (discord.VoiceChannel, discord.StageChannel)) or text_channel is None:
+        return False
+    async with connect_slots:
+        try:
+            voice_client = guild.voice_client or await channel.connect(timeout=30)
+        except Exception as e:
+            print(f"Could not rejoin {channel.name} in {guild.name}: {str(e)}")
+            return False
+    ctx = RestoredContext(guild, text_channel)
+    await play_next(ctx, voice_client)
+    if state['paused']:
+        pause_song(ctx)
+    return True
+
+def schedule_prefetch(guild_state: GuildState):
+    """Point the prefetcher at the head of the queue, dropping streams for songs that left the window"""
+    window = guild_state.song_queue[:PREFETCH_DEPTH]
+    for song in guild_state.prefetched:
+        if song not in window and song is not guild_state.loading_song and song is not guild_state.current_song:
+            song.drop_stream()
+    guild_state.prefetched = window
+
+    if guild_state.prefetch_task and not guild_state.prefetch_task.done():
+        guild_state.prefetch_task.cancel()
+    guild_state.prefetch_task = bot.loop.create_task(prefetch_streams(window, guild_state.guild_id)) if window else None
+
+async def prefetch_streams(songs: List[Song], guild_id: int = 0):
+    for song in songs:
+        video_id = video_id_from_url(song.url)
+        if (audio_cache and video_id in audio_cache) or extraction_cache.is_unavailable(video_id):
+            continue
+        try:
+            await ensure_stream(song, bot.loop, guild_id, PREFETCH)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error prefetching {song.title}: {str(e)}")
+
+# Player actions shared by commands and the control buttons. ``ctx`` can be a
+# commands.Context or a discord.Interaction; only .guild and .channel are used.
+
+def skip_song(ctx) -> discord.Embed:
+    voice_client = ctx.guild.voice_client
+    if voice_client and voice_client.is_playing():
+        voice_client.stop()
+        return discord.Embed(description="Skipped the current song", color=discord.Color.blue())
+    return discord.Embed(description="Nothing is playing right now.", color=discord.Color.red())
+
+def pause_song(ctx) -> discord.Embed:
+    voice_client = ctx.guild.voice_client
+    if voice_client and voice_client.is_playing():
+        voice_client.pause()
+        if isinstance(voice_client.source, WorkerAudioSource):
+            voice_client.source.pause()
+        journal(ctx.guild.id, 'paused', True)
+        return discord.Embed(description="Paused the current song", color=discord.Color.blue())
+    return discord.Embed(description="Nothing is playing right now.", color=discord.Color.red())
+
+def resume_song(ctx) -> discord.Embed:
+    voice_client = ctx.guild.voice_client
+    if voice_client and voice_client.is_paused():
+        if isinstance(voice_client.source, WorkerAudioSource):
+            voice_client.source.resume()
+        voice_client.resume()
+        journal(ctx.guild.id, 'paused', False)
+        return discord.Embed(description="Resumed the current song", color=discord.Color.green())
+    return discord.Embed(description="The music is not paused.", color=discord.Color.red())
+
+def stop_playback(ctx) -> discord.Embed:
+    voice_client = ctx.guild.voice_client
     guild_state = get_guild_state(ctx.guild.id)
+    
+    if voice_client and (voice_client.is_playing() or guild_state.ingest_tasks):
+        cancel_ingestion(guild_state)
+        guild_state.song_queue.clear()
+        schedule_prefetch(guild_state)
+        voice_client.stop()
+        return discord.Embed(description="Stopped the music and cleared the queue", color=discord.Color.blue())
+    return discord.Embed(description="Nothing is playing right now.", color=discord.Color.red())
+
+def shuffle_queue(ctx) -> discord.Embed:
+    guild_state = get_guild_state(ctx.guild.id)
+    if guild_state.song_queue:
+        guild_state.song_queue.shuffle()
+        schedule_prefetch(guild_state)
+        update_player_message(ctx)
+        return discord.Embed(description="Queue has been shuffled!", color=discord.Color.green())
+    return discord.Embed(description="The queue is empty!", color=discord.Color.red())
+
+def clear_song_queue(ctx) -> discord.Embed:
+    guild_state = get_guild_state(ctx.guild.id)
+    if guild_state.song_queue:
+        cancel_ingestion(guild_state)
+        guild_state.song_queue.clear()
+        schedule_prefetch(guild_state)
+        update_player_message(ctx)
+        return discord.Embed(description="Queue has been cleared!", color=discord.Color.green())
+    return discord.Embed(description="The queue is empty!", color=discord.Color.red())
+
+def toggle_pause(ctx) -> Optional[discord.Embed]:
+    voice_client = ctx.guild.voice_client
+    if voice_client and voice_client.is_playing():
+        return pause_song(ctx)
+    elif voice_client and voice_client.is_paused():
+        return resume_song(ctx)
+    return None
+
+# Per-button latency from receiving the click to acknowledging it, and to finishing the action
+button_ack_seconds = Histogram('button_ack_seconds', 'Time to acknowledge a player button click', labels=('button',))
+button_latency_seconds = Histogram('button_latency_seconds', 'Time to handle a player button click', labels=('button',))
+
+class MusicControlView(discord.ui.View):
+    """Player buttons; registered once as a persistent view so they keep working across restarts"""
+
+    def __init__(self):
+        super().__init__(timeout=None)
+
+    async def dispatch(self, interaction: discord.Interaction, action):
+        custom_id = interaction.data['custom_id']
+        started = time.perf_counter()
+        # Acknowledge first so slow actions never miss Discord's 3 second deadline
+        await interaction.response.defer()
+        acked = time.perf_counter()
+        try:
+            await queues_restored.wait()
+            embed = action(interaction)
+            if embed:
+                await interaction.followup.send(embed=embed)
+        finally:
+            finished = time.perf_counter()
+            button_ack_seconds.labels(custom_id).observe(acked - started)
+            button_latency_seconds.labels(custom_id).observe(finished - started)
+
+    @discord.ui.button(style=discord.ButtonStyle.primary, label="⏭️ Skip", custom_id="skip")
+    async def skip_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.dispatch(interaction, skip_song)
+
+    @discord.ui.button(style=discord.ButtonStyle.secondary, label="⏯️ Pause/Resume", custom_id="pause_resume")
+    async def pause_resume_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.dispatch(interaction, toggle_pause)
+
+    @discord.ui.button(style=discord.ButtonStyle.danger, label="⏹️ Stop", custom_id="stop")
+    async def stop_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.dispatch(interaction, stop_playback)
+
+    @discord.ui.button(style=discord.ButtonStyle.success, label="🔀 Shuffle Queue", custom_id="shuffle")
+    async def shuffle_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.dispatch(interaction, shuffle_queue)
+
+    @discord.ui.button(style=discord.ButtonStyle.blurple, label="❌ Clear Queue", custom_id="clear_queue")
+    async def clear_queue_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.dispatch(interaction, clear_song_queue)
+
+music_control_view: Optional[MusicControlView] = None
+
+def create_music_control_view():
+    return music_control_view
+
+def build_player_embed(guild_state: GuildState) -> discord.Embed:
     embed = discord.Embed(title="🎵 Music Player", color=discord.Color.blue())
     
     if guild_state.current_song:
@@ -295,27 +1214,83 @@ async def update_player_message(ctx):
         
         duration = Song.parse_duration(guild_state.current_song.duration)
         embed.add_field(name="Duration", value=duration, inline=True)
-        embed.add_field(name="Requested By", value=guild_state.current_song.requester.mention, inline=True)
+        embed.add_field(name="Requested By", value=guild_state.current_song.requester_mention, inline=True)
         embed.set_thumbnail(url=guild_state.current_song.thumbnail)
     else:
         embed.add_field(name="Now Playing", value="Nothing is playing right now.", inline=False)
     
     if guild_state.song_queue:
         queue_str = "\n".join([
-            f"{i+1}. {'💚' if song.source_type == 'spotify' else '🎵'} {song.title} ({Song.parse_duration(song.duration)}) | {song.requester.display_name}"
+            f"{i+1}. {'💚' if song.source_type == 'spotify' else '🎵'} {song.title} ({Song.parse_duration(song.duration)}) | {song.requester_name}"
             for i, song in enumerate(guild_state.song_queue[:5])
         ])
         remaining = len(guild_state.song_queue) - 5 if len(guild_state.song_queue) > 5 else 0
         queue_str += f"\n\n*and {remaining} more*" if remaining > 0 else ""
+        queue_str += f"\nTotal: {Song.parse_duration(guild_state.song_queue.total_duration)}"
         embed.add_field(name="Queue", value=queue_str, inline=False)
     else:
         embed.add_field(name="Queue", value="The queue is empty.", inline=False)
 
-    await ctx.send(embed=embed, view=create_music_control_view())
+    return embed
+
+
+def update_player_message(ctx):
+    """Schedule a refresh of the guild's player message; bursts of updates are coalesced"""
+    guild_state = get_guild_state(ctx.guild.id)
+    player_stats['requested'] += 1
+    guild_state.player_channel = ctx.channel
+    guild_state.player_dirty = True
+    if guild_state.player_task is None or guild_state.player_task.done():
+        guild_state.player_task = bot.loop.create_task(flush_player_message(guild_state))
+
+async def flush_player_message(guild_state: GuildState):
+    while guild_state.player_dirty:
+        await asyncio.sleep(guild_state.player_debounce)
+        guild_state.player_dirty = False
+        embed = build_player_embed(guild_state)
+        channel = guild_state.player_channel
+        message = guild_state.player_message
+        started = time.perf_counter()
+        try:
+            if message and message.channel.id == channel.id:
+                try:
+                    await message.edit(embed=embed, view=create_music_control_view())
+                    player_stats['edited'] += 1
+                except discord.NotFound:
+                    message = None
+            else:
+                if message:
+                    # The player follows the channel the bot was last used in
+                    try:
+                        await message.delete()
+                    except discord.HTTPException:
+                        pass
+                message = None
+            if message is None:
+                guild_state.player_message = await channel.send(embed=embed, view=create_music_control_view())
+                player_stats['sent'] += 1
+        except discord.HTTPException as e:
+            print(f"Error updating player message: {str(e)}")
+            if e.status == 429:
+                player_stats['rate_limited'] += 1
+                guild_state.player_debounce = min(guild_state.player_debounce * 2, PLAYER_UPDATE_MAX_DEBOUNCE)
+                guild_state.player_dirty = True
+            continue
+
+        # discord.py sleeps on exhausted buckets based on the rate-limit headers, so a
+        # slow call means we are close to the limit: back off, otherwise recover
+        if time.perf_counter() - started > PLAYER_SLOW_CALL:
+            guild_state.player_debounce = min(guild_state.player_debounce * 2, PLAYER_UPDATE_MAX_DEBOUNCE)
+        else:
+            guild_state.player_debounce = max(PLAYER_UPDATE_DEBOUNCE, guild_state.player_debounce * 0.75)
 
 
 async def handle_playback_error(ctx, voice_client, error):
     """Handle errors that occur during playback"""
+    guild_state = guild_states.get(ctx.guild.id)
+    if not voice_client.is_connected() or (guild_state and guild_state.disconnecting):
+        # The track ended because we left; the queue waits for the next !play
+        return
     if error:
         print(f"Playback error: {str(error)}")
         await ctx.send(embed=discord.Embed(
@@ -326,13 +1301,29 @@ async def handle_playback_error(ctx, voice_client, error):
     await play_next(ctx, voice_client)
 
 
+def record_first_packet(ended_at: Optional[float], requested_at: Optional[float]):
+    # Runs on the audio thread when a new track sends its first packet; !stats and /metrics report the percentiles
+    if ended_at is not None:
+        track_gap_seconds.observe(time.perf_counter() - ended_at)
+    if requested_at is not None:
+        time_to_first_audio_seconds.observe(time.perf_counter() - requested_at)
+
+def on_track_end(ctx, voice_client, error):
+    # Runs on the audio thread
+    get_guild_state(ctx.guild.id).track_ended_at = time.perf_counter()
+    asyncio.run_coroutine_threadsafe(handle_playback_error(ctx, voice_client, error), bot.loop)
+
+
 async def play_next(ctx, voice_client):
     guild_state = get_guild_state(ctx.guild.id)
     
     if not guild_state.song_queue:
+        if guild_state.current_song:
+            journal(ctx.guild.id, 'current', None)
         guild_state.current_song = None
         guild_state.is_playing = False
-        await update_player_message(ctx)
+        guild_state.track_ended_at = None
+        update_player_message(ctx)
         return
     
     if guild_state.is_processing:
@@ -344,28 +1335,69 @@ async def play_next(ctx, voice_client):
     current_retry = 0
     
     while current_retry < max_retries and guild_state.song_queue:
+        source = None
         try:
             # Get the next song from queue
-            next_song = guild_state.song_queue[0]
-            guild_state.song_queue.pop(0)
+            next_song = guild_state.song_queue.popleft()
+            video_id = video_id_from_url(next_song.url)
+            if extraction_cache.is_unavailable(video_id) and not (audio_cache and video_id in audio_cache):
+                # Known dead (removed, private, region-blocked): skip it without spending a retry
+                unavailable_skips.inc()
+                await ctx.send(embed=discord.Embed(
+                    description=f"Skipping unavailable song: {next_song.title}",
+                    color=discord.Color.yellow()
+                ))
+                if not guild_state.song_queue:
+                    # Let the empty-queue path above reset the player
+                    guild_state.is_processing = False
+                    await play_next(ctx, voice_client)
+                    return
+                continue
+            guild_state.loading_song = next_song
             
-            # Create the source for the next song
-            source = await YTDLSource.create_source(next_song, loop=bot.loop)
+            # Create the source for the next song (usually already prefetched)
+            start, next_song.resume_position = next_song.resume_position, 0.0
+            source = await YTDLSource.create_source(next_song, guild_id=ctx.guild.id, start=start, loop=bot.loop)
             next_song.source = source
             
+            ended_at, guild_state.track_ended_at = guild_state.track_ended_at, None
+            requested_at, guild_state.play_requested_at = guild_state.play_requested_at, None
+            if ended_at is not None or requested_at is not None:
+                source.on_first_packet = lambda: record_first_packet(ended_at, requested_at)
+            
             # Set as current song and play
             guild_state.current_song = next_song
-            voice_client.play(source, after=lambda e: asyncio.run_coroutine_threadsafe(
-                handle_playback_error(ctx, voice_client, e), bot.loop))
+            guild_state.loading_song = None
+            voice_client.play(source, after=lambda e: on_track_end(ctx, voice_client, e))
+            schedule_prefetch(guild_state)
+
+            journal(ctx.guild.id, 'current', song_record(next_song), start)
+            if track_library and not start:
+                track_library.record(video_id, next_song.title, song_artist(next_song), next_song.duration)
+            guild_state.saved_position = start
+            channels = (voice_client.channel.id, ctx.channel.id)
+            if guild_state.saved_channels != channels:
+                guild_state.saved_channels = channels
+                journal(ctx.guild.id, 'channel', *channels)
             
-            await update_player_message(ctx)
+            update_player_message(ctx)
             break
             
+        except asyncio.CancelledError:
+            # The playlist loader or Spotify resolver that called us was stopped
+            guild_state.is_processing = False
+            guild_state.loading_song = None
+            raise
         except Exception as e:
             print(f"Error playing {next_song.title if next_song else 'unknown song'}: {str(e)}")
+            if source is not None and source is not voice_client.source:
+                # Never reached the player, so nothing else will stop its ffmpeg
+                source.cleanup()
             current_retry += 1
+            play_retries.inc()
             
             if current_retry >= max_retries and guild_state.song_queue:
+                play_skips.inc()
                 # If we've exhausted retries, try the next song in queue
                 await ctx.send(embed=discord.Embed(
                     description=f"Skipping unavailable song: {next_song.title}",
@@ -374,6 +1406,7 @@ async def play_next(ctx, voice_client):
                 continue
     
     guild_state.is_processing = False
+    guild_state.loading_song = None
     
     if current_retry >= max_retries and not guild_state.song_queue:
         await ctx.send(embed=discord.Embed(
@@ -382,27 +1415,304 @@ async def play_next(ctx, voice_client):
         ))
         guild_state.current_song = None
         guild_state.is_playing = False
-        await update_player_message(ctx)
+        update_player_message(ctx)
+
+# Idle reclamation
+
+idle_disconnects = Counter('idle_disconnects_total', 'Voice connections closed by the idle manager', labels=('reason',))
+guild_states_evicted = Counter('guild_states_evicted_total', 'Player states dropped after the guild went unused')
+orphaned_ffmpeg_killed = Counter('orphaned_ffmpeg_killed_total', 'ffmpeg processes killed because no source owned them')
+idle_tasks_cancelled = Counter('idle_tasks_cancelled_total', 'Prefetch, playlist, Spotify and player tasks cancelled for idle guilds')
+ffmpeg_reaper = OrphanReaper('ffmpeg')
+
+def release_guild_work(guild_state: GuildState):
+    """Cancel everything running in the background for a guild, Spotify resolution and playlist
+    ingestion included, and let go of its prefetched streams"""
+    cancelled = len(guild_state.ingest_tasks)
+    cancel_ingestion(guild_state)
+    extraction_scheduler.cancel_guild(guild_state.guild_id)
+    for task in (guild_state.prefetch_task, guild_state.player_task):
+        if task and not task.done():
+            task.cancel()
+            cancelled += 1
+    guild_state.prefetch_task = None
+    for song in guild_state.prefetched:
+        if song is not guild_state.current_song and song is not guild_state.loading_song:
+            song.drop_stream()
+    guild_state.prefetched = []
+    idle_tasks_cancelled.inc(cancelled)
+
+async def leave_voice(guild: discord.Guild, guild_state: GuildState):
+    """Disconnect and stop background work, keeping the queue for the next !play"""
+    release_guild_work(guild_state)
+    # Don't rejoin this channel on restart
+    guild_state.saved_channels = None
+    journal(guild.id, 'channel', None, None)
+    guild_state.disconnecting = True
+    try:
+        await guild.voice_client.disconnect()
+    finally:
+        guild_state.disconnecting = False
+        guild_state.is_playing = False
+        guild_state.alone_since = None
+
+def evict_guild_state(guild_id: int):
+    guild_state = guild_states.pop(guild_id)
+    release_guild_work(guild_state)
+    guild_state.song_queue.on_change = None
+    journal(guild_id, 'forget')
+    guild_states_evicted.inc()
+
+def claimed_ffmpeg_pids() -> set:
+    """ffmpeg processes that belong to a live source, an audio cache store or a loudness measurement"""
+    pids = set(audio_cache.pids) if audio_cache else set()
+    if loudness_cache:
+        pids |= loudness_cache.pids
+    sources = [voice_client.source for voice_client in bot.voice_clients]
+    for guild_state in guild_states.values():
+        sources += [song.source for song in (guild_state.current_song, guild_state.loading_song) if song]
+    for source in sources:
+        # PCM sources wrap the ffmpeg source in a volume transformer
+        process = getattr(source, '_process', None) or getattr(getattr(source, 'original', None), '_process', None)
+        # A finished source leaves discord.py's MISSING sentinel here, which has no pid
+        pid = getattr(process, 'pid', None)
+        if pid is not None:
+            pids.add(pid)
+    return pids
+
+async def leave_idle(guild: discord.Guild, guild_state: GuildState, reason: str):
+    try:
+        await leave_voice(guild, guild_state)
+        idle_disconnects.labels(reason).inc()
+        print(f"Left voice in {guild.name} ({reason.replace('_', ' ')})")
+    except Exception as e:
+        print(f"Error leaving voice in {guild.name}: {str(e)}")
+
+async def reclaim_idle_pass(loop):
+    """Leave idle or empty voice channels, drop state of unused guilds and kill orphaned ffmpeg"""
+    now = time.monotonic()
+    leaving = []
+    for guild_id, guild_state in list(guild_states.items()):
+        guild = bot.get_guild(guild_id)
+        voice_client = guild.voice_client if guild else None
+        if voice_client is None or not voice_client.is_connected():
+            busy = guild_state.is_processing or guild_state.ingest_tasks or extraction_scheduler.guild_queued(guild_id)
+            if GUILD_STATE_TTL and now - guild_state.last_active > GUILD_STATE_TTL and not busy:
+                evict_guild_state(guild_id)
+            continue
+
+        if voice_client.is_playing():
+            guild_state.last_active = now
+        if any(not member.bot for member in voice_client.channel.members):
+            guild_state.alone_since = None
+        elif guild_state.alone_since is None:
+            guild_state.alone_since = now
+
+        if EMPTY_CHANNEL_SECONDS and guild_state.alone_since is not None and now - guild_state.alone_since > EMPTY_CHANNEL_SECONDS:
+            leaving.append(leave_idle(guild, guild_state, 'empty_channel'))
+        elif IDLE_DISCONNECT_SECONDS and now - guild_state.last_active > IDLE_DISCONNECT_SECONDS:
+            leaving.append(leave_idle(guild, guild_state, 'idle'))
+    await asyncio.gather(*leaving)
+
+    killed = await loop.run_in_executor(None, ffmpeg_reaper.sweep, claimed_ffmpeg_pids())
+    if killed:
+        orphaned_ffmpeg_killed.inc(len(killed))
+        print(f"Killed {len(killed)} orphaned ffmpeg processes: {killed}")
+
+async def reclaim_idle():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(IDLE_CHECK_INTERVAL)
+        # One bad guild or source must not stop the sweeps for good
+        try:
+            await reclaim_idle_pass(loop)
+        except Exception as e:
+            print(f"Error reclaiming idle resources: {str(e)}")
+
+@bot.event
+async def setup_hook():
+    global music_control_view, audio_workers
+    open_storage()
+    # Views need a running loop, so the shared persistent view is created here
+    music_control_view = MusicControlView()
+    bot.add_view(music_control_view)
+    # Workers are started here rather than at import, since spawned processes re-import this module
+    if AUDIO_WORKERS > 0:
+        audio_workers = AudioWorkerPool(AUDIO_WORKERS)
+        print(f"Started {AUDIO_WORKERS} audio worker processes")
+    # The shard launcher, systemd and docker all stop the bot with SIGTERM
+    try:
+        bot.loop.add_signal_handler(signal.SIGTERM, lambda: bot.loop.create_task(bot.close()))
+    except NotImplementedError:
+        # No loop signal handlers on Windows
+        pass
+    bot.loop.create_task(sample_event_loop())
+    bot.loop.create_task(reclaim_idle())
+    bot.loop.create_task(track_cache.run(TRACK_CACHE_FLUSH_INTERVAL))
+    if track_library:
+        bot.loop.create_task(track_library.run(LIBRARY_FLUSH_INTERVAL))
+    if METRICS_PORT:
+        await start_metrics_server()
+
+@bot.before_invoke
+async def wait_for_restore(ctx):
+    await queues_restored.wait()
+
+restored = False
 
 @bot.event
 async def on_ready():
-    print(f"Logged in as {bot.user.name}")
+    global restored
+    print(f"Logged in as {bot.user.name} (shards {sorted(bot.shards)} of {bot.shard_count})")
+    # on_ready fires again after reconnects; the start-up work runs once per process
+    if not restored:
+        restored = True
+        startup_seconds.labels('ready').set(time.perf_counter() - PROCESS_STARTED)
+        print(f"Ready {time.perf_counter() - PROCESS_STARTED:.1f}s after start (imports took {IMPORT_SECONDS:.2f}s)")
+        bot.loop.create_task(warm_up())
+        if queue_journal:
+            bot.loop.create_task(save_positions())
+            bot.loop.create_task(restore_guilds())
+
+async def warm_up():
+    """Create the clients left out of start-up, before the first command needs them"""
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    await extraction_engine.warm_up()
+    await loop.run_in_executor(None, get_spotify)
+    startup_seconds.labels('warm_up').set(time.perf_counter() - started)
+
+# Per-shard connection health, updated from the gateway events below
+shard_health: Dict[int, dict] = {}
+
+def record_shard_event(shard_id: int, status: str):
+    health = shard_health.setdefault(shard_id, {'status': 'connecting', 'since': time.time(), 'disconnects': 0, 'resumes': 0})
+    if status == 'disconnected':
+        health['disconnects'] += 1
+    elif status == 'resumed':
+        health['resumes'] += 1
+    health['status'] = status
+    health['since'] = time.time()
+
+@bot.event
+async def on_shard_connect(shard_id):
+    record_shard_event(shard_id, 'connected')
+
+@bot.event
+async def on_shard_ready(shard_id):
+    record_shard_event(shard_id, 'ready')
+    print(f"Shard {shard_id} ready")
+
+@bot.event
+async def on_shard_disconnect(shard_id):
+    record_shard_event(shard_id, 'disconnected')
+    print(f"Shard {shard_id} disconnected")
+
+@bot.event
+async def on_shard_resumed(shard_id):
+    record_shard_event(shard_id, 'resumed')
+
+# Metrics
+
+startup_seconds = Gauge('startup_seconds', 'Time taken by each start-up phase', labels=('phase',))
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+event_loop_lag_seconds = Histogram('event_loop_lag_seconds', 'How late the event loop wakes up a sleeping task', LAG_BUCKETS)
+executor_wait_seconds = Histogram('executor_wait_seconds', 'Time a job waits for a thread in the default executor', LAG_BUCKETS)
+
+def count_ffmpeg_processes() -> dict:
+    counts = {'playback': 0, 'audio_worker': 0, 'audio_cache': audio_cache.stats()['storing'] if audio_cache else 0}
+    for voice_client in bot.voice_clients:
+        source = voice_client.source
+        if isinstance(source, WorkerAudioSource):
+            counts['audio_worker'] += 1
+        elif isinstance(source, TrackSource):
+            counts['playback'] += 1
+    return counts
+
+Gauge('guild_states', 'Guilds with player state in this process', function=lambda: len(guild_states))
+Gauge('voice_connections', 'Connected voice clients', function=lambda: len(bot.voice_clients))
+Gauge('queued_songs', 'Songs waiting in all queues', function=lambda: sum(len(state.song_queue) for state in guild_states.values()))
+Gauge('queue_depth_max', 'Length of the longest queue', function=lambda: max((len(state.song_queue) for state in guild_states.values()), default=0))
+Gauge('ffmpeg_processes', 'Running ffmpeg processes by purpose', labels=('purpose',), function=count_ffmpeg_processes)
+Gauge('extract_in_flight', 'Extractions running or waiting for a worker', function=lambda: extraction_engine.in_flight)
+Gauge('extract_workers', 'Size of the extraction pool', function=lambda: extraction_engine.workers)
+Counter('extract_timeouts_total', 'Extractions that hit the timeout', function=lambda: extraction_engine.timeouts)
+Counter('extract_pool_restarts_total', 'Times the extraction pool was replaced', function=lambda: extraction_engine.restarts)
+Counter('extract_cache_lookups_total', 'Extraction requests by how they were answered', labels=('result',),
+        function=lambda: {key: value for key, value in extraction_cache.stats().items() if key in ('hits', 'misses', 'coalesced', 'negative_hits', 'expired')})
+Gauge('extract_cache_entries', 'Extraction results and unavailable videos remembered', labels=('cache',),
+      function=lambda: {'results': extraction_cache.stats()['entries'], 'unavailable': extraction_cache.stats()['unavailable']})
+Gauge('extract_queue_length', 'Extractions waiting in the scheduler by priority', labels=('priority',),
+      function=extraction_scheduler.queued)
+Gauge('extract_scheduler_running', 'Extractions holding a scheduler slot', function=lambda: extraction_scheduler.running)
+Counter('player_updates_total', 'Player message updates by outcome', labels=('result',), function=lambda: dict(player_stats))
+Counter('track_cache_lookups_total', 'Spotify resolution cache lookups', labels=('result',),
+        function=lambda: {'hit': track_cache.hits, 'miss': track_cache.misses})
+Gauge('track_cache_entries', 'Spotify resolutions cached', function=lambda: track_cache.stats()['entries'])
+Counter('audio_cache_lookups_total', 'Audio cache lookups', labels=('result',),
+        function=lambda: {'hit': audio_cache.hits, 'miss': audio_cache.misses} if audio_cache else {})
+Counter('library_lookups_total', '!play searches answered from the track library or not', labels=('result',),
+        function=lambda: {'hit': track_library.hits, 'miss': track_library.misses} if track_library else {})
+Gauge('library_tracks', 'Tracks in the library index', function=lambda: track_library.stats()['tracks'] if track_library else 0)
+Counter('library_compactions_total', 'Library index rebuilds dropping evicted tracks', function=lambda: track_library.compactions if track_library else 0)
+Counter('loudness_measurements_total', 'Background loudness measurements by outcome', labels=('result',),
+        function=lambda: {'measured': loudness_cache.measured, 'failed': loudness_cache.failures} if loudness_cache else {})
+Gauge('loudness_cache_entries', 'Tracks with a loudness measurement', function=lambda: loudness_cache.stats()['entries'] if loudness_cache else 0)
+Gauge('audio_cache_bytes', 'Size of the audio cache', function=lambda: audio_cache.total_bytes if audio_cache else 0)
+Counter('audio_worker_crashes_total', 'Audio worker processes that died', function=lambda: audio_workers.crashes if audio_workers else 0)
+
+async def sample_event_loop():
+    """Measure event-loop lag and default-executor queueing, one cheap probe per interval"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(METRICS_SAMPLE_INTERVAL)
+        event_loop_lag_seconds.observe(max(0.0, loop.time() - started - METRICS_SAMPLE_INTERVAL))
+        submitted = time.perf_counter()
+        began = await loop.run_in_executor(None, time.perf_counter)
+        executor_wait_seconds.observe(began - submitted)
+
+async def start_metrics_server():
+    async def handle_metrics(request):
+        return web.Response(text=REGISTRY.render(), content_type='text/plain', charset='utf-8')
+
+    port = METRICS_PORT + int(os.getenv('SHARD_PROCESS_INDEX', '0'))
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, port).start()
+    print(f"Serving metrics on http://{METRICS_HOST}:{port}/metrics")
+
+@bot.command(name='shards', help='Shows the health of the shards in this process')
+async def shards(ctx):
+    guild_counts: Dict[int, int] = {}
+    for guild in bot.guilds:
+        guild_counts[guild.shard_id] = guild_counts.get(guild.shard_id, 0) + 1
+    state_counts: Dict[int, int] = {}
+    for guild_state in guild_states.values():
+        state_counts[guild_state.shard_id] = state_counts.get(guild_state.shard_id, 0) + 1
+
+    lines = []
+    for shard_id, shard in sorted(bot.shards.items()):
+        health = shard_health.get(shard_id, {'status': 'unknown', 'since': time.time(), 'disconnects': 0, 'resumes': 0})
+        status = 'closed' if shard.is_closed() else health['status']
+        latency = f"{shard.latency * 1000:.0f} ms" if shard.latency == shard.latency else "n/a"  # NaN before the first heartbeat
+        lines.append(
+            f"{'➡️ ' if shard_id == ctx.guild.shard_id else ''}**Shard {shard_id}**: {status} for {int(time.time() - health['since'])}s | "
+            f"{latency} | {guild_counts.get(shard_id, 0)} guilds, {state_counts.get(shard_id, 0)} active | "
+            f"{health['disconnects']} disconnects, {health['resumes']} resumes"
+        )
+    await ctx.send(embed=discord.Embed(
+        title=f"Shards ({len(bot.shards)} of {bot.shard_count} in this process)",
+        description="\n".join(lines),
+        color=discord.Color.blue()
+    ))
 
 @bot.command(name='shuffle')
 async def shuffle(ctx):
-    guild_state = get_guild_state(ctx.guild.id)
-    if guild_state.song_queue:
-        random.shuffle(guild_state.song_queue)
-        await ctx.send(embed=discord.Embed(
-            description="Queue has been shuffled!",
-            color=discord.Color.green()
-        ))
-        await update_player_message(ctx)
-    else:
-        await ctx.send(embed=discord.Embed(
-            description="The queue is empty!",
-            color=discord.Color.red()
-        ))
+    await ctx.send(embed=shuffle_queue(ctx))
 
 @bot.command(name='play', help='To play song or playlist (URL or search query)')
 async def play(ctx, *, query):
@@ -419,22 +1729,40 @@ async def play(ctx, *, query):
     if voice_client is None:
         await ctx.author.voice.channel.connect()
         voice_client = ctx.guild.voice_client
+    if not voice_client.is_playing() and not guild_state.is_processing:
+        guild_state.play_requested_at = time.perf_counter()
 
     async with ctx.typing():
         try:
             # Handle Spotify or YouTube content
             songs = []
+            next_start = None
             spotify_pattern = r'open.spotify.com\/(track|album|playlist)\/[a-zA-Z0-9]+'
-            is_spotify = bool(re.search(spotify_pattern, query))
+            spotify_match = re.search(spotify_pattern, query)
             
-            if is_spotify:
-                spotify_tracks = await get_spotify_tracks(query)
-                for track in spotify_tracks:
-                    song = await process_spotify_track(track, ctx.author)
-                    if song:
-                        songs.append(song)
+            if spotify_match and not (SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET):
+                await ctx.send(embed=discord.Embed(
+                    description="Spotify links aren't supported on this bot (no Spotify credentials configured).",
+                    color=discord.Color.red()
+                ))
+                return
+            elif spotify_match:
+                resolver = bot.loop.create_task(resolve_spotify_tracks(
+                    ctx, iter_spotify_tracks(query), voice_client, single=spotify_match.group(1) == 'track'
+                ))
+                # Tracked like playlist ingestion, so !stop, !clear_queue and !leave cancel it
+                guild_state.ingest_tasks.add(resolver)
+                resolver.add_done_callback(guild_state.ingest_tasks.discard)
+                try:
+                    progress = await resolver
+                except asyncio.CancelledError:
+                    if not resolver.cancelled():
+                        raise
+                    return
+                if progress.resolved:
+                    return
             else:
-                songs = await extract_playlist_info(query, ctx.author, ctx)
+                songs, next_start = await extract_playlist_info(query, ctx.author, guild_id=ctx.guild.id)
             
             if not songs:
                 await ctx.send(embed=discord.Embed(
@@ -445,9 +1773,20 @@ async def play(ctx, *, query):
             
             # Add valid songs to queue
             guild_state.song_queue.extend(songs)
+            schedule_prefetch(guild_state)
+            
+            if next_start:
+                task = bot.loop.create_task(ingest_playlist(ctx, query, next_start, voice_client))
+                guild_state.ingest_tasks.add(task)
+                task.add_done_callback(guild_state.ingest_tasks.discard)
             
             # Notify user
-            if len(songs) > 1:
+            if next_start:
+                await ctx.send(embed=discord.Embed(
+                    description=f"Added {len(songs)} songs to the queue, loading the rest of the playlist...",
+                    color=discord.Color.green()
+                ))
+            elif len(songs) > 1:
                 await ctx.send(embed=discord.Embed(
                     description=f"Added {len(songs)} songs to the queue",
                     color=discord.Color.green()
@@ -468,56 +1807,79 @@ async def play(ctx, *, query):
                 color=discord.Color.red()
             ))
 
-@bot.command(name='skip')
-async def skip(ctx):
-    voice_client = ctx.guild.voice_client
-    if voice_client and voice_client.is_playing():
-        voice_client.stop()
-        await ctx.send(embed=discord.Embed(description="Skipped the current song", color=discord.Color.blue()))
-    else:
+@bot.command(name='search', help='Searches the tracks played here, then YouTube')
+async def search(ctx, *, query):
+    # (title, url, duration, times played or None for YouTube results)
+    results = []
+    if track_library:
+        results = [
+            (track.title, f"https://www.youtube.com/watch?v={track.video_id}", track.duration, track.plays)
+            for track in track_library.search(query, SEARCH_RESULTS)
+        ]
+    if len(results) < SEARCH_RESULTS:
+        seen = {video_id_from_url(url) for _, url, _, _ in results}
+        try:
+            async with ctx.typing():
+                info = await extraction_cache.extract(f"ytsearch{SEARCH_RESULTS}:{query}", 'flat',
+                                                      guild_id=ctx.guild.id, priority=NOW_PLAYING)
+        except Exception as e:
+            print(f"Error searching YouTube: {str(e)}")
+            info = None
+        for entry in (info or {}).get('entries', []):
+            url = entry.get('url', entry.get('webpage_url', ''))
+            if url and video_id_from_url(url) not in seen and len(results) < SEARCH_RESULTS:
+                results.append((entry.get('title', 'Unknown'), url, entry.get('duration') or 0, None))
+
+    if not results:
+        await ctx.send(embed=discord.Embed(description="No results found", color=discord.Color.red()))
+        return
+    lines = []
+    for position, (title, url, duration, plays) in enumerate(results, 1):
+        played = f" | played {plays} time{'s' if plays != 1 else ''}" if plays else ""
+        lines.append(f"{position}. [{title}]({url}) ({Song.parse_duration(duration)}){played}")
+    await ctx.send(embed=discord.Embed(
+        title=f"Results for {query[:200]}",
+        description="\n".join(lines),
+        color=discord.Color.blue()
+    ))
+
+@bot.command(name='normalize', help='Turns loudness normalization on or off for this server (on/off)')
+async def normalize(ctx, setting: Optional[str] = None):
+    if not loudness_cache:
         await ctx.send(embed=discord.Embed(
-            description="Nothing is playing right now.",
+            description="Loudness normalization isn't enabled on this bot.",
             color=discord.Color.red()
         ))
+        return
+    if setting is not None:
+        if setting.lower() not in ('on', 'off'):
+            await ctx.send(embed=discord.Embed(description="Use `!normalize on` or `!normalize off`.", color=discord.Color.red()))
+            return
+        loudness_cache.set_normalize(ctx.guild.id, setting.lower() == 'on')
+    enabled = loudness_cache.normalizes(ctx.guild.id)
+    await ctx.send(embed=discord.Embed(
+        description=(
+            f"Loudness normalization is {'on' if enabled else 'off'} for this server"
+            + (" (from the next song; new tracks are measured on their first play)" if enabled and setting else "")
+        ),
+        color=discord.Color.blue()
+    ))
+
+@bot.command(name='skip')
+async def skip(ctx):
+    await ctx.send(embed=skip_song(ctx))
 
 @bot.command(name='pause')
 async def pause(ctx):
-    voice_client = ctx.guild.voice_client
-    if voice_client and voice_client.is_playing():
-        voice_client.pause()
-        await ctx.send(embed=discord.Embed(description="Paused the current song", color=discord.Color.blue()))
-    else:
-        await ctx.send(embed=discord.Embed(
-            description="Nothing is playing right now.",
-            color=discord.Color.red()
-        ))
+    await ctx.send(embed=pause_song(ctx))
 
 @bot.command(name='resume')
 async def resume(ctx):
-    voice_client = ctx.guild.voice_client
-    if voice_client and voice_client.is_paused():
-        voice_client.resume()
-        await ctx.send(embed=discord.Embed(description="Resumed the current song", color=discord.Color.green()))
-    else:
-        await ctx.send(embed=discord.Embed(
-            description="The music is not paused.",
-            color=discord.Color.red()
-        ))
+    await ctx.send(embed=resume_song(ctx))
 
 @bot.command(name='stop')
 async def stop(ctx):
-    voice_client = ctx.guild.voice_client
-    guild_state = get_guild_state(ctx.guild.id)
-    
-    if voice_client and voice_client.is_playing():
-        guild_state.song_queue.clear()
-        voice_client.stop()
-        await ctx.send(embed=discord.Embed(description="Stopped the music and cleared the queue", color=discord.Color.blue()))
-    else:
-        await ctx.send(embed=discord.Embed(
-            description="Nothing is playing right now.",
-            color=discord.Color.red()
-        ))
+    await ctx.send(embed=stop_playback(ctx))
 
 @bot.command(name='join', help='Tells the bot to join the voice channel')
 async def join(ctx):
@@ -526,64 +1888,255 @@ async def join(ctx):
         return
     channel = ctx.message.author.voice.channel
     await channel.connect()
+    get_guild_state(ctx.guild.id)
     await ctx.send(embed=discord.Embed(description=f"Joined {channel.name}", color=discord.Color.green()))
 
 @bot.command(name='leave', help='To make the bot leave the voice channel')
 async def leave(ctx):
     voice_client = ctx.message.guild.voice_client
-    if voice_client.is_connected():
-        await voice_client.disconnect()
+    if voice_client and voice_client.is_connected():
+        await leave_voice(ctx.guild, get_guild_state(ctx.guild.id))
         await ctx.send(embed=discord.Embed(description="Disconnected from voice channel", color=discord.Color.blue()))
     else:
         await ctx.send(embed=discord.Embed(description="The bot is not connected to a voice channel.", color=discord.Color.red()))
 
-@bot.command(name='queue')
-async def queue(ctx):
-    await update_player_message(ctx)
+@bot.command(name='queue', help='Shows a page of the queue')
+async def queue(ctx, page: int = 1):
+    guild_state = get_guild_state(ctx.guild.id)
+    song_queue = guild_state.song_queue
+    if not song_queue:
+        update_player_message(ctx)
+        return
 
-@bot.command(name='clear_queue')
-async def clear_queue(ctx):
+    pages = (len(song_queue) + QUEUE_PAGE_SIZE - 1) // QUEUE_PAGE_SIZE
+    page = min(max(page, 1), pages)
+    start = (page - 1) * QUEUE_PAGE_SIZE
+    queue_str = "\n".join([
+        f"{start+i+1}. {'💚' if song.source_type == 'spotify' else '🎵'} {song.title} ({Song.parse_duration(song.duration)}) | {song.requester_name}"
+        for i, song in enumerate(song_queue.page(start, QUEUE_PAGE_SIZE))
+    ])
+    embed = discord.Embed(title="🎵 Queue", description=queue_str, color=discord.Color.blue())
+    embed.set_footer(text=f"Page {page}/{pages} | {len(song_queue)} songs | Total: {Song.parse_duration(song_queue.total_duration)}")
+    await ctx.send(embed=embed)
+
+@bot.command(name='remove', help='Removes the song at a queue position')
+async def remove(ctx, position: int):
     guild_state = get_guild_state(ctx.guild.id)
-    if guild_state.song_queue:
-        guild_state.song_queue.clear()
+    if not 1 <= position <= len(guild_state.song_queue):
         await ctx.send(embed=discord.Embed(
-            description="Queue has been cleared!",
-            color=discord.Color.green()
+            description=f"There is no song at position {position}!",
+            color=discord.Color.red()
         ))
-        await update_player_message(ctx)
+        return
+
+    song = guild_state.song_queue.remove(position - 1)
+    schedule_prefetch(guild_state)
+    await ctx.send(embed=discord.Embed(description=f"Removed: {song.title}", color=discord.Color.green()))
+    update_player_message(ctx)
+
+@bot.command(name='move', help='Moves a song to another queue position')
+async def move(ctx, source: int, destination: int):
+    guild_state = get_guild_state(ctx.guild.id)
+    length = len(guild_state.song_queue)
+    if not (1 <= source <= length and 1 <= destination <= length):
+        await ctx.send(embed=discord.Embed(
+            description=f"Positions must be between 1 and {length}!",
+            color=discord.Color.red()
+        ))
+        return
+
+    song = guild_state.song_queue.move(source - 1, destination - 1)
+    schedule_prefetch(guild_state)
+    await ctx.send(embed=discord.Embed(
+        description=f"Moved {song.title} to position {destination}",
+        color=discord.Color.green()
+    ))
+    update_player_message(ctx)
+
+@bot.command(name='skipto', help='Skips ahead to a queue position')
+async def skipto(ctx, position: int):
+    guild_state = get_guild_state(ctx.guild.id)
+    voice_client = ctx.guild.voice_client
+    if not 1 <= position <= len(guild_state.song_queue):
+        await ctx.send(embed=discord.Embed(
+            description=f"There is no song at position {position}!",
+            color=discord.Color.red()
+        ))
+        return
+    if not voice_client:
+        await ctx.send(embed=discord.Embed(
+            description="The bot is not connected to a voice channel.",
+            color=discord.Color.red()
+        ))
+        return
+
+    guild_state.song_queue.skip_to(position - 1)
+    schedule_prefetch(guild_state)
+    await ctx.send(embed=discord.Embed(
+        description=f"Skipping to: {guild_state.song_queue[0].title}",
+        color=discord.Color.blue()
+    ))
+    if voice_client.is_playing() or voice_client.is_paused():
+        # The after callback starts the new head of the queue
+        voice_client.stop()
     else:
+        await play_next(ctx, voice_client)
+
+@bot.command(name='seek', help='Jumps to a position (in seconds) in the current song')
+async def seek(ctx, seconds: int):
+    guild_state = get_guild_state(ctx.guild.id)
+    voice_client = ctx.guild.voice_client
+    song = guild_state.current_song
+    if not voice_client or not song or not isinstance(voice_client.source, TrackSource):
+        await ctx.send(embed=discord.Embed(description="Nothing is playing right now.", color=discord.Color.red()))
+        return
+    if seconds < 0 or (song.duration and seconds >= song.duration):
         await ctx.send(embed=discord.Embed(
-            description="The queue is empty!",
+            description=f"Position must be between 0 and {song.duration - 1} seconds.",
             color=discord.Color.red()
         ))
-@bot.event
-async def on_interaction(interaction):
-    if interaction.type == discord.InteractionType.component:
-        if isinstance(interaction.data, dict) and 'custom_id' in interaction.data:
-            custom_id = interaction.data['custom_id']
-            ctx = await bot.get_context(interaction.message)
-            
-            if custom_id == "skip":
-                await skip(ctx)
-            elif custom_id == "pause_resume":
-                voice_client = interaction.guild.voice_client
-                if voice_client and voice_client.is_playing():
-                    await pause(ctx)
-                elif voice_client and voice_client.is_paused():
-                    await resume(ctx)
-            elif custom_id == "stop":
-                await stop(ctx)
-            elif custom_id == "shuffle":
-                await shuffle(ctx)
-            elif custom_id == "clear_queue":
-                await clear_queue(ctx)
-            
-            await interaction.response.defer()
-        else:
-            await interaction.response.send_message(
-                "An error occurred processing this button.",
-                ephemeral=True
-            )
+        return
+
+    source = voice_client.source
+    if isinstance(source, WorkerAudioSource):
+        source.seek(seconds)
+    else:
+        # ffmpeg can't seek a running process, so swap in a new one starting at the position
+        new_source = YTDLSource.from_location(source.location, source.codec, local=source.local, start=seconds,
+                                              volume=source.playback_volume)
+        voice_client.source = new_source
+        song.source = new_source
+        source.cleanup()
+    await ctx.send(embed=discord.Embed(
+        description=f"Jumped to {Song.parse_duration(seconds)} in {song.title}",
+        color=discord.Color.blue()
+    ))
+
+@bot.command(name='workers', help='Shows the audio worker processes')
+async def workers(ctx):
+    if not audio_workers:
+        await ctx.send(embed=discord.Embed(description="Audio runs in the bot process (AUDIO_WORKERS=0).", color=discord.Color.blue()))
+        return
+    lines = []
+    for worker in await audio_workers.status():
+        here = ctx.guild.id in worker['sessions']
+        lines.append(
+            f"{'➡️ ' if here else ''}**Worker {worker['index']}** (pid {worker['pid']}): "
+            f"{'up' if worker['alive'] else 'down'} | {worker['guilds']} guilds | {worker['restarts']} restarts"
+        )
+    await ctx.send(embed=discord.Embed(
+        title=f"Audio Workers ({audio_workers.crashes} crashes)",
+        description="\n".join(lines),
+        color=discord.Color.blue()
+    ))
+
+@bot.command(name='cache', help='Shows cache statistics')
+async def cache(ctx):
+    embed = discord.Embed(title="Cache Statistics", color=discord.Color.blue())
+    stats = track_cache.stats()
+    embed.add_field(
+        name="Spotify Lookups",
+        value=f"{stats['entries']} entries | {stats['hit_ratio']:.0%} hit ratio ({stats['hits']} hits, {stats['misses']} misses)",
+        inline=False
+    )
+    stats = extraction_cache.stats()
+    embed.add_field(
+        name="Extractions",
+        value=(
+            f"{stats['entries']} results, {stats['unavailable']} unavailable videos | {stats['hit_ratio']:.0%} answered without yt-dlp\n"
+            f"{stats['hits']} hits, {stats['coalesced']} merged in flight, {stats['negative_hits']} known unavailable, {stats['misses']} extracted"
+        ),
+        inline=False
+    )
+    if track_library:
+        stats = track_library.stats()
+        embed.add_field(
+            name="Library",
+            value=(
+                f"{stats['tracks']} tracks | {stats['hit_ratio']:.0%} of searches answered locally "
+                f"({stats['hits']} hits, {stats['misses']} misses)"
+            ),
+            inline=False
+        )
+    if loudness_cache:
+        stats = loudness_cache.stats()
+        plays = {labels[0]: child.value for labels, child in loudness_plays.children()}
+        embed.add_field(
+            name="Loudness",
+            value=(
+                f"{stats['entries']} tracks measured | normalizing in {stats['guilds']} guilds\n"
+                f"{plays.get('normalized', 0)} plays normalized, {plays.get('unmeasured', 0)} not measured yet, "
+                f"{plays.get('unmeasurable', 0)} unmeasurable | "
+                f"{stats['measuring']} measuring, {stats['failures']} failed"
+            ),
+            inline=False
+        )
+    if audio_cache:
+        stats = audio_cache.stats()
+        embed.add_field(
+            name="Audio",
+            value=(
+                f"{stats['entries']} tracks | {stats['bytes'] / 2**20:.0f} MiB of {AUDIO_CACHE_MAX_BYTES / 2**20:.0f} MiB\n"
+                f"{stats['hit_ratio']:.0%} hit ratio ({stats['hits']} hits, {stats['misses']} misses) | "
+                f"{stats['bytes_saved'] / 2**20:.0f} MiB saved"
+            ),
+            inline=False
+        )
+    else:
+        embed.add_field(name="Audio", value="Disabled", inline=False)
+    await ctx.send(embed=embed)
+
+@bot.command(name='stats', help='Shows latency and load statistics (bot owner only)')
+@commands.is_owner()
+async def stats(ctx):
+    def summary(histogram: Histogram) -> str:
+        if not histogram.count:
+            return "no data"
+        return f"p50 {histogram.percentile(0.5)}s | p99 {histogram.percentile(0.99)}s | {histogram.count} samples"
+
+    embed = discord.Embed(title="Statistics", color=discord.Color.blue())
+    embed.add_field(
+        name="Extraction",
+        value="\n".join(f"{labels[0]}: {summary(child)}" for labels, child in extract_seconds.children()) or "no data",
+        inline=False
+    )
+    queued = extraction_scheduler.queued()
+    embed.add_field(
+        name="Extraction Queue",
+        value="\n".join(
+            f"{name}: {queued[name]} waiting | {summary(child)}" for (name,), child in queue_wait_seconds.children()
+        ) or "no data",
+        inline=False
+    )
+    embed.add_field(name="Time to First Audio", value=summary(time_to_first_audio_seconds), inline=False)
+    embed.add_field(name="Track Gaps", value=summary(track_gap_seconds), inline=False)
+    embed.add_field(name="Event Loop Lag", value=summary(event_loop_lag_seconds), inline=False)
+    embed.add_field(name="Executor Wait", value=summary(executor_wait_seconds), inline=False)
+    ffmpeg = count_ffmpeg_processes()
+    embed.add_field(
+        name="Load",
+        value=(
+            f"{len(bot.voice_clients)} voice connections | "
+            f"{sum(len(state.song_queue) for state in guild_states.values())} queued songs\n"
+            f"{sum(ffmpeg.values())} ffmpeg processes | "
+            f"{extraction_engine.in_flight} extractions in flight on {extraction_engine.workers} workers\n"
+            f"{play_retries.value} play retries, {play_skips.value} songs skipped\n"
+            f"{sum(child.value for _, child in idle_disconnects.children())} idle disconnects | "
+            f"{guild_states_evicted.value} guild states evicted | {orphaned_ffmpeg_killed.value} orphaned ffmpeg killed"
+        ),
+        inline=False
+    )
+    await ctx.send(embed=embed)
+
+@bot.command(name='clear_queue')
+async def clear_queue(ctx):
+    await ctx.send(embed=clear_song_queue(ctx))
 
 bot_token = os.getenv('BOT_TOKEN')
-bot.run(bot_token)
\ No newline at end of file
+
+IMPORT_SECONDS = time.perf_counter() - PROCESS_STARTED
+startup_seconds.labels('import').set(IMPORT_SECONDS)
+
+# Extraction workers are spawned processes that re-import this module, so only run the bot from the entry point
+if __name__ == '__main__':
+    bot.run(bot_token)
\ No newline at end of file
@@ -0,0 +1,426 @@
+import asyncio
+import multiprocessing
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from metrics import Counter, Histogram
+from scheduler import PREFETCH, ExtractionScheduler, Job
+
+ytdl_format_options = {
+    'cookies': 'cookies.txt',
+    'format': 'bestaudio/best',
+    'restrictfilenames': True,
+    'noplaylist': False,
+    'nocheckcertificate': True,
+    'ignoreerrors': True,
+    'logtostderr': False,
+    'quiet': True,
+    'no_warnings': True,
+    'default_search': 'ytsearch',
+    'source_address': '0.0.0.0',
+    'extract_flat': 'in_playlist',  # Changed from True to 'in_playlist'
+    'skip_download': True,
+    'playlistend': None,  # Remove any playlist limit
+}
+
+# Option sets each worker keeps a long-lived YoutubeDL instance for
+OPTION_SETS = {
+    # Searches and playlist listings
+    'flat': ytdl_format_options,
+    # A single video, resolved down to its stream URL
+    'single': {**ytdl_format_options, 'extract_flat': False, 'age_limit': None},
+    # Same, but preferring Opus formats so playback can stream-copy them
+    'single_opus': {
+        **ytdl_format_options, 'extract_flat': False, 'age_limit': None,
+        'format': 'bestaudio[acodec=opus]/bestaudio/best'
+    },
+}
+
+# Only these keys survive the trip back from a worker
+INFO_KEYS = (
+    'id', 'title', 'url', 'webpage_url', 'thumbnail', 'duration', 'is_live',
+    'acodec', 'ext', 'abr', 'asr', 'format_id', '_type', 'ie_key',
+)
+
+# yt-dlp errors meaning the video itself is gone or blocked, not that the request failed
+_UNAVAILABLE = re.compile(
+    r'video unavailable|private video|video is private|has been removed|no longer available|terminated|'
+    r'not available in your country|uploader has not made this video available|members-only|confirm your age',
+    re.IGNORECASE
+)
+
+_YOUTUBE_ID = re.compile(r'(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/)([A-Za-z0-9_-]{11})')
+
+_local = threading.local()
+
+# Threads used instead of worker processes when workers=0
+THREAD_WORKERS = 4
+
+# ProcessPoolExecutor only takes max_tasks_per_child from Python 3.11 on
+_RECYCLES_WORKERS = sys.version_info >= (3, 11)
+
+extract_seconds = Histogram(
+    'extract_seconds', 'yt-dlp extraction latency, including time queued for a worker', labels=('kind',)
+)
+extract_errors = Counter('extract_errors_total', 'Extractions that failed or timed out', labels=('kind',))
+
+
+class VideoUnavailable(Exception):
+    """yt-dlp gave up on a video that is private, removed or blocked, so retrying won't help"""
+
+
+class _ErrorLog:
+    """yt-dlp logger keeping the current job's errors, which ignoreerrors otherwise only prints"""
+
+    def __init__(self):
+        self.errors = []
+
+    def debug(self, message: str):
+        pass
+
+    def info(self, message: str):
+        pass
+
+    def warning(self, message: str):
+        pass
+
+    def error(self, message: str):
+        self.errors.append(message)
+        print(message)
+
+
+def video_id_from_url(url: Optional[str]) -> Optional[str]:
+    """YouTube video ID of a watch/short/embed URL, or None for anything else"""
+    match = _YOUTUBE_ID.search(url or '')
+    return match.group(1) if match else None
+
+
+def _get_ytdl(kind: str):
+    instances = getattr(_local, 'instances', None)
+    if instances is None:
+        instances = _local.instances = {}
+    if kind not in instances:
+        import yt_dlp
+        instances[kind] = yt_dlp.YoutubeDL({**OPTION_SETS[kind], 'logger': _ErrorLog()})
+    return instances[kind]
+
+
+def compact_info(info: Optional[dict]) -> Optional[dict]:
+    """Strip an extract_info() result down to the small set of fields the bot uses"""
+    if info is None:
+        return None
+    record = {key: info[key] for key in INFO_KEYS if info.get(key) is not None}
+    if 'thumbnail' not in record and info.get('thumbnails'):
+        record['thumbnail'] = info['thumbnails'][-1].get('url', '')
+    if 'entries' in info:
+        record['entries'] = [compact_info(entry) for entry in info['entries'] or []]
+    return record
+
+
+def _warm_up():
+    _get_ytdl('flat')
+
+
+def _extract(kind: str, query: str, overrides: dict) -> Optional[dict]:
+    # Runs inside a worker; each worker handles one job at a time, so the shared
+    # instance's params can be adjusted for the duration of the call
+    ytdl = _get_ytdl(kind)
+    log = ytdl.params['logger']
+    log.errors.clear()
+    saved = {key: ytdl.params[key] for key in overrides if key in ytdl.params}
+    ytdl.params.update(overrides)
+    try:
+        info = ytdl.extract_info(query, download=False)
+    finally:
+        # Keys the instance didn't have must go again; yt-dlp treats a None playliststart as "None:"
+        for key in overrides:
+            if key in saved:
+                ytdl.params[key] = saved[key]
+            else:
+                ytdl.params.pop(key, None)
+    if info is None:
+        unavailable = next((error for error in log.errors if _UNAVAILABLE.search(error)), None)
+        if unavailable:
+            raise VideoUnavailable(unavailable)
+    return compact_info(info)
+
+
+class ExtractionEngine:
+    """Runs yt-dlp extractions on a fixed set of long-lived worker processes.
+
+    Each worker is a single-process pool of its own, and a job goes to the worker with
+    the fewest jobs on it. Workers are replaced after ``max_jobs_per_worker`` jobs. A
+    worker that breaks or runs a job past ``timeout`` is replaced by a fresh one, and
+    the other workers carry on with their jobs undisturbed.
+
+    With ``workers=0`` extractions run on a thread pool in this process instead,
+    which is handy for development and tests.
+    """
+
+    def __init__(self, workers: int = 2, timeout: float = 30.0, max_jobs_per_worker: int = 100):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.in_flight = 0
+        self.timeouts = 0
+        self.restarts = 0
+        self._pools: List[Optional[Executor]] = []
+        self._busy: List[int] = []  # Jobs running or queued on each pool
+        self._jobs: List[int] = []  # Sent to each pool since it started
+
+    def start(self):
+        if self._pools:
+            return
+        count = max(self.workers, 1)
+        self._pools = [self._new_pool() for _ in range(count)]
+        self._busy = [0] * count
+        self._jobs = [0] * count
+
+    def _new_pool(self) -> Executor:
+        if self.workers <= 0:
+            return ThreadPoolExecutor(max_workers=THREAD_WORKERS, thread_name_prefix='extract')
+        kwargs = {}
+        if self.max_jobs_per_worker and _RECYCLES_WORKERS:
+            kwargs['max_tasks_per_child'] = self.max_jobs_per_worker
+        return ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'), **kwargs)
+
+    @property
+    def capacity(self) -> int:
+        """Extractions that can run at the same time"""
+        return self.workers if self.workers > 0 else THREAD_WORKERS
+
+    async def warm_up(self):
+        """Start the workers and have each import yt-dlp, so the first real job doesn't pay for it"""
+        self.start()
+        loop = asyncio.get_running_loop()
+        jobs = [loop.run_in_executor(pool, _warm_up) for pool in self._pools]
+        await asyncio.gather(*jobs, return_exceptions=True)
+
+    def shutdown(self):
+        for pool in self._pools:
+            pool.shutdown(wait=False, cancel_futures=True)
+        self._pools, self._busy, self._jobs = [], [], []
+
+    def _replace(self, slot: int, executor: Executor, reason: str, kill: bool = False):
+        """Swap a fresh pool in for worker ``slot``'s ``executor``, unless a concurrent caller already has.
+
+        The old pool finishes what it is running, or with ``kill`` has its process killed;
+        jobs queued behind it then fail with BrokenProcessPool and are retried on the new pool.
+        """
+        if slot >= len(self._pools) or executor is not self._pools[slot]:
+            return
+        print(f"Extraction worker {slot} {reason}, restarting it")
+        self.restarts += 1
+        self._pools[slot] = self._new_pool()
+        self._jobs[slot] = 0
+        executor.shutdown(wait=False)
+        if kill:
+            # No public way to do this before Python 3.14; a hung thread can't be killed at all
+            for process in list((getattr(executor, '_processes', None) or {}).values()):
+                process.kill()
+
+    def _submit(self, slot: int, executor: Executor, kind: str, query: str, overrides: dict) -> Awaitable:
+        self._jobs[slot] += 1
+        future = asyncio.get_running_loop().run_in_executor(executor, _extract, kind, query, overrides)
+        if (self.workers > 0 and self.max_jobs_per_worker and not _RECYCLES_WORKERS
+                and self._jobs[slot] >= self.max_jobs_per_worker):
+            self._replace(slot, executor, 'served its jobs')
+        return asyncio.wait_for(future, self.timeout)
+
+    async def extract(self, query: str, kind: str = 'flat', **overrides) -> Optional[dict]:
+        """Extract ``query`` with the given option set; returns a compacted info dict"""
+        if kind not in OPTION_SETS:
+            raise ValueError(f"Unknown extraction kind: {kind}")
+        self.start()
+        # Searches share the flat option set but behave very differently from playlist listings
+        label = 'search' if kind == 'flat' and query.startswith('ytsearch') else kind
+        started = time.perf_counter()
+
+        self.in_flight += 1
+        slot = min(range(len(self._pools)), key=self._busy.__getitem__)
+        self._busy[slot] += 1
+        executor = self._pools[slot]
+        try:
+            try:
+                return await self._submit(slot, executor, kind, query, overrides)
+            except BrokenProcessPool:
+                # The worker died (OOM, segfault in a native lib...) or was killed under this
+                # job; every job on it lands here, but only the first replaces it. Retry once
+                self._replace(slot, executor, 'broke')
+                executor = self._pools[slot]
+                return await self._submit(slot, executor, kind, query, overrides)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            extract_errors.labels(label).inc()
+            # The worker is still busy with the job and would stay so; replace just that one
+            self._replace(slot, executor, 'timed out', kill=True)
+            raise Exception(f"Extraction timed out after {self.timeout:.0f}s")
+        except Exception:
+            extract_errors.labels(label).inc()
+            raise
+        finally:
+            if slot < len(self._busy):
+                self._busy[slot] -= 1
+            self.in_flight -= 1
+            extract_seconds.labels(label).observe(time.perf_counter() - started)
+
+
+class ExtractionCache:
+    """Shared front end to an ExtractionEngine.
+
+    Identical requests in flight at the same time share one extraction, recent results
+    are kept in a bounded LRU, and videos yt-dlp reported private, removed or blocked
+    are remembered for a while so they aren't extracted again; other failures are
+    usually rate limits or network errors, and aren't remembered. Listings and searches live for ``ttl``
+    seconds; results carrying a stream URL live as long as ``stream_ttl(info)`` says
+    the URL stays usable. Misses go through ``scheduler`` when one is given, and are
+    dropped from it once every caller waiting on them has given up.
+    """
+
+    STREAM_KINDS = ('single', 'single_opus')
+
+    def __init__(self, engine: ExtractionEngine, max_entries: int = 2048, ttl: float = 600.0,
+                 negative_ttl: float = 900.0, stream_ttl: Optional[Callable[[dict], float]] = None,
+                 scheduler: Optional[ExtractionScheduler] = None):
+        self.engine = engine
+        self.scheduler = scheduler
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stream_ttl = stream_ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.negative_hits = 0
+        self.expired = 0
+        self.evictions = 0
+        self._entries: OrderedDict = OrderedDict()  # key -> (expires_at, info)
+        self._unavailable: Dict[str, float] = {}  # video ID -> until
+        self._in_flight: Dict[tuple, asyncio.Future] = {}
+        self._jobs: Dict[tuple, Job] = {}  # Scheduler jobs of in-flight extractions
+        self._waiters: Dict[tuple, int] = {}  # Callers awaiting each in-flight extraction
+
+    def is_unavailable(self, video_id: Optional[str]) -> bool:
+        until = self._unavailable.get(video_id) if video_id else None
+        if until is None:
+            return False
+        if until < time.monotonic():
+            del self._unavailable[video_id]
+            return False
+        return True
+
+    def mark_unavailable(self, video_id: Optional[str]):
+        if video_id:
+            self._unavailable[video_id] = time.monotonic() + self.negative_ttl
+            if len(self._unavailable) > self.max_entries:
+                # Drop the entry closest to expiring
+                del self._unavailable[min(self._unavailable, key=self._unavailable.get)]
+
+    async def extract(self, query: str, kind: str = 'flat', *, guild_id: int = 0, priority: int = PREFETCH,
+                      **overrides) -> Optional[dict]:
+        """Same contract as ExtractionEngine.extract; results may be shared, so don't mutate them.
+
+        ``guild_id`` and ``priority`` place a new extraction with the scheduler, if there is one.
+        """
+        video_id = video_id_from_url(query) if kind in self.STREAM_KINDS else None
+        if self.is_unavailable(video_id):
+            self.negative_hits += 1
+            return None
+
+        key = (kind, query, tuple(sorted(overrides.items())))
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._entries[key]
+            self.expired += 1
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            job = self._jobs.get(key)
+            if job is not None:
+                self.scheduler.share(job, guild_id, priority)
+        else:
+            self.misses += 1
+            if self.scheduler is not None:
+                job = self._jobs[key] = self.scheduler.submit(
+                    guild_id, priority, lambda: self.engine.extract(query, kind, **overrides)
+                )
+                pending = job.future
+            else:
+                pending = self.engine.extract(query, kind, **overrides)
+            future = asyncio.ensure_future(self._fetch(key, video_id, kind, pending))
+            self._in_flight[key] = future
+            self._waiters[key] = 0
+            future.add_done_callback(lambda done: self._finished(key, done))
+
+        self._waiters[key] += 1
+        try:
+            # One caller giving up must not cancel the extraction for the others
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if self._in_flight.get(key) is future and self._waiters[key] == 1 and key in self._jobs:
+                # Nobody else wants it; drop it if it hasn't reached a worker yet
+                self.scheduler.cancel(self._jobs[key])
+            raise
+        finally:
+            if self._in_flight.get(key) is future:
+                self._waiters[key] -= 1
+
+    def promote(self, query: str, kind: str, priority: int, **overrides):
+        """Raise the priority of an extraction still waiting for a worker"""
+        job = self._jobs.get((kind, query, tuple(sorted(overrides.items()))))
+        if job is not None:
+            self.scheduler.promote(job, priority)
+
+    def _finished(self, key: tuple, future: asyncio.Future):
+        self._in_flight.pop(key, None)
+        self._jobs.pop(key, None)
+        self._waiters.pop(key, None)
+        if not future.cancelled():
+            # Mark the exception retrieved; the callers that are still waiting get it themselves
+            future.exception()
+
+    async def _fetch(self, key: tuple, video_id: Optional[str], kind: str, pending: Awaitable) -> Optional[dict]:
+        try:
+            info = await pending
+        except VideoUnavailable:
+            self.mark_unavailable(video_id)
+            return None
+        if info is None:
+            # yt-dlp (with ignoreerrors) failed for some other reason; the next request tries again
+            return None
+
+        if kind in self.STREAM_KINDS and self.stream_ttl:
+            ttl = self.stream_ttl(info)
+        else:
+            ttl = self.ttl
+        if ttl > 0:
+            self._entries[key] = (time.monotonic() + ttl, info)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return info
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced + self.negative_hits
+        return {
+            'entries': len(self._entries),
+            'unavailable': len(self._unavailable),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'negative_hits': self.negative_hits,
+            'expired': self.expired,
+            'evictions': self.evictions,
+            'hit_ratio': (lookups - self.misses) / lookups if lookups else 0.0,
+        }
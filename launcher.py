@@ -0,0 +1,134 @@
+"""Runs the bot as several processes, each owning a contiguous range of shards.
+
+Usage: python launcher.py [--processes N] [--shards M]
+
+Without --shards the recommended shard count is fetched from Discord. Crashed
+processes are restarted on their own; the other shard ranges keep running.
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Dict, List
+
+from dotenv import load_dotenv
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot.py')
+# Discord allows one identify per 5 seconds per max_concurrency bucket
+IDENTIFY_INTERVAL = 5.0
+RESTART_BACKOFF = (5, 10, 30, 60)
+
+
+def fetch_gateway_info(token: str) -> dict:
+    request = urllib.request.Request(
+        'https://discord.com/api/v10/gateway/bot',
+        headers={'Authorization': f'Bot {token}', 'User-Agent': 'DiscordBot (launcher, 1.0)'}
+    )
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.load(response)
+
+
+def shard_ranges(shard_count: int, processes: int) -> List[range]:
+    processes = max(1, min(processes, shard_count))
+    per_process, extra = divmod(shard_count, processes)
+    ranges = []
+    start = 0
+    for index in range(processes):
+        size = per_process + (1 if index < extra else 0)
+        ranges.append(range(start, start + size))
+        start += size
+    return ranges
+
+
+class ShardProcess:
+    def __init__(self, index: int, shards: range, shard_count: int):
+        self.index = index
+        self.shards = shards
+        self.shard_count = shard_count
+        self.process = None
+        self.restarts = 0
+        self.started_at = 0.0
+
+    def start(self):
+        env = dict(
+            os.environ,
+            SHARD_COUNT=str(self.shard_count),
+            SHARD_IDS=f"{self.shards.start}-{self.shards.stop - 1}",
+            SHARD_PROCESS_INDEX=str(self.index),
+        )
+        self.process = subprocess.Popen([sys.executable, BOT_SCRIPT], env=env)
+        self.started_at = time.monotonic()
+        print(f"Started process {self.index} (pid {self.process.pid}) for shards {self.shards.start}-{self.shards.stop - 1}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=int(os.getenv('SHARD_PROCESSES', '2')))
+    parser.add_argument('--shards', type=int, default=int(os.getenv('SHARD_COUNT', '0')))
+    args = parser.parse_args()
+
+    load_dotenv()
+    token = os.getenv('BOT_TOKEN')
+    gateway = fetch_gateway_info(token)
+    shard_count = args.shards or gateway['shards']
+    max_concurrency = gateway.get('session_start_limit', {}).get('max_concurrency', 1)
+
+    workers: Dict[int, ShardProcess] = {
+        index: ShardProcess(index, shards, shard_count)
+        for index, shards in enumerate(shard_ranges(shard_count, args.processes))
+    }
+    print(f"Running {shard_count} shards across {len(workers)} processes")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    # Stagger start-up so the processes don't trip the identify rate limit
+    for worker in workers.values():
+        if stopping:
+            break
+        worker.start()
+        time.sleep(IDENTIFY_INTERVAL * len(worker.shards) / max_concurrency)
+
+    restart_at: Dict[int, float] = {}
+    while not stopping:
+        time.sleep(1)
+        now = time.monotonic()
+        for index, worker in workers.items():
+            if worker.process.poll() is None:
+                continue
+            if index not in restart_at:
+                # Reset the backoff for processes that stayed up for a while
+                if now - worker.started_at > 300:
+                    worker.restarts = 0
+                delay = RESTART_BACKOFF[min(worker.restarts, len(RESTART_BACKOFF) - 1)]
+                print(f"Process {index} exited with {worker.process.returncode}, restarting in {delay}s")
+                restart_at[index] = now + delay
+            elif now >= restart_at[index]:
+                del restart_at[index]
+                worker.restarts += 1
+                worker.start()
+
+    print("Stopping shard processes")
+    for worker in workers.values():
+        if worker.process and worker.process.poll() is None:
+            worker.process.terminate()
+    for worker in workers.values():
+        if worker.process:
+            try:
+                worker.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                worker.process.kill()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+import asyncio
+import math
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from collections import Counter
+from array import array
+from itertools import islice
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+# Bracketed parts of video titles that say nothing about the song itself
+_NOISE = re.compile(
+    r'[(\[][^)\]]*\b(?:official|video|audio|lyrics?|hd|hq|4k|visuali[sz]er|mv)\b[^)\]]*[)\]]'
+)
+_NON_WORD = re.compile(r'[\W_]+')
+
+
+def normalize(text: str) -> str:
+    """Lowercase, accents and punctuation stripped, noise like "(Official Video)" dropped"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(_NON_WORD.sub(' ', _NOISE.sub(' ', text)).split())
+
+
+def search_key(title: str, artist: str) -> str:
+    """What a track is indexed under: its title, with the artist in front unless already there"""
+    title, artist = normalize(title), normalize(artist)
+    return title if not artist or artist in title else f"{artist} {title}"
+
+
+def trigrams(key: str) -> Set[str]:
+    padded = f" {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)} if key else set()
+
+
+class LibraryTrack(NamedTuple):
+    video_id: str
+    title: str
+    artist: str
+    duration: int
+    plays: int
+    score: float
+
+
+class TrackIndex:
+    """In-memory trigram index over the library.
+
+    Tracks live in parallel lists indexed by slot; each trigram maps to an array of the
+    slots whose title contains it, and each search key to the one slot indexed under it
+    (-1 once several are). Nothing is removed from the postings, a dropped track just
+    loses its video ID and is skipped until the library rebuilds the index.
+    """
+
+    def __init__(self):
+        self.slots: Dict[str, int] = {}
+        self.video_ids: List[Optional[str]] = []
+        self.titles: List[str] = []
+        self.artists: List[str] = []
+        self.keys: List[str] = []
+        self.durations = array('l')
+        self.plays = array('l')
+        self.sizes = array('H')
+        self.postings: Dict[str, array] = {}
+        self.exact: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    @property
+    def dead(self) -> int:
+        """Slots of dropped tracks, still holding their title and postings"""
+        return len(self.video_ids) - len(self.slots)
+
+    def key(self, video_id: str) -> Optional[str]:
+        slot = self.slots.get(video_id)
+        return self.keys[slot][1:-1] if slot is not None else None
+
+    def add(self, video_id: str, title: str, artist: str, duration: int, plays: int, key: str):
+        """Insert a track, or add ``plays`` to one already indexed"""
+        slot = self.slots.get(video_id)
+        if slot is not None:
+            self.plays[slot] += plays
+            return
+        grams = trigrams(key)
+        slot = len(self.video_ids)
+        self.slots[video_id] = slot
+        self.video_ids.append(video_id)
+        self.titles.append(title)
+        self.artists.append(artist)
+        padded = f" {key} "
+        self.keys.append(padded)
+        self.exact[padded] = slot if padded not in self.exact else -1
+        self.durations.append(duration)
+        self.plays.append(plays)
+        self.sizes.append(min(len(grams), 0xFFFF))
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if posting is None:
+                posting = self.postings[gram] = array('I')
+            posting.append(slot)
+
+    def discard(self, video_id: str):
+        slot = self.slots.pop(video_id, None)
+        if slot is not None:
+            self.video_ids[slot] = None
+            if self.exact.get(self.keys[slot]) == slot:
+                del self.exact[self.keys[slot]]
+
+    def lookup(self, key: str) -> Optional[LibraryTrack]:
+        """The one track indexed under exactly ``key``, if just one is"""
+        slot = self.exact.get(f" {key} ", -1) if key else -1
+        if slot < 0:
+            return None
+        return LibraryTrack(self.video_ids[slot], self.titles[slot], self.artists[slot], self.durations[slot],
+                            self.plays[slot], 1.0)
+
+    def search(self, key: str, limit: int, min_score: float, max_postings: int) -> Tuple[List[LibraryTrack], float]:
+        """Tracks scoring at least ``min_score`` against the normalized query ``key``, best
+        first, and the most any track left out could have scored.
+
+        The score is the Dice coefficient of the two trigram sets. Postings are read
+        rarest trigram first until ``max_postings`` slots have been counted, and only the
+        tracks that shared the most of those trigrams, and enough of them to reach
+        ``min_score``, are scored.
+        """
+        grams = trigrams(key)
+        if not grams:
+            return [], 0.0
+        postings = self.postings
+        counts = Counter()
+        read = unread = 0
+        for gram in sorted(grams, key=lambda gram: len(postings.get(gram, ()))):
+            posting = postings.get(gram)
+            if not posting:
+                continue
+            if unread or read + len(posting) > max_postings:
+                if read:
+                    unread += 1
+                    continue
+                # Nothing but common trigrams; slots grow with recency, so count the newest
+                posting = posting[-max_postings:]
+                unread += 1
+            read += len(posting)
+            counts.update(posting)
+
+        scored = []
+        count = len(grams)
+        width = max(limit * 4, 16)
+        # Sharing c trigrams scores at most 2c / (count + c), so tracks counted for fewer than
+        # ``need`` can't reach min_score even with every unread trigram
+        need = max(1, math.ceil(min_score * count / (2 - min_score) - 1e-9) - unread)
+        # Find the count the best ``width`` tracks share in C, then pick them out in one pass
+        shares = sorted(counts.values(), reverse=True)
+        if len(shares) > width and shares[width] >= need:
+            cutoff = shares[width]
+            top = [slot for slot, shared in counts.items() if shared > cutoff]
+            top += islice((slot for slot, shared in counts.items() if shared == cutoff), width - len(top))
+        else:
+            top = [slot for slot, shared in counts.items() if shared >= need]
+        # A track not scored shares at most the trigrams it was counted for plus the unread ones
+        left = (shares[len(top)] if len(shares) > len(top) else 0) + unread
+        ceiling = 2 * left / (count + left)
+        for slot in top:
+            video_id = self.video_ids[slot]
+            if video_id is None:
+                continue
+            key = self.keys[slot]
+            score = 2 * sum(gram in key for gram in grams) / (count + self.sizes[slot])
+            if score >= min_score:
+                scored.append((score, self.plays[slot], slot))
+        scored.sort(reverse=True)
+        return [
+            LibraryTrack(self.video_ids[slot], self.titles[slot], self.artists[slot], self.durations[slot], plays, score)
+            for score, plays, slot in scored[:limit]
+        ], ceiling
+
+
+class TrackLibrary:
+    """Every track played here, with a fuzzy title index to answer searches without YouTube.
+
+    Plays are recorded into the in-memory index straight away and written to SQLite in
+    batches from a background task, so the event loop never waits on the disk. The
+    index is read back from the database in a thread when the task starts.
+    """
+
+    def __init__(self, path: str, max_tracks: int = 100_000, max_postings: int = 4096, compact_ratio: float = 0.25):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.max_tracks = max_tracks
+        self.max_postings = max_postings
+        # Rebuild the index once this share of its slots belongs to evicted tracks
+        self.compact_ratio = compact_ratio
+        self.loaded = False
+        self.closed = False
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.compactions = 0
+
+        self._index = TrackIndex()
+        # video_id -> [title, artist, search_key, duration, plays, last_played] not yet written
+        self._pending: Dict[str, list] = {}
+        # Only ever used from one executor thread at a time: loading and flushes hold the lock
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = asyncio.Lock()
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS tracks (
+                video_id TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                artist TEXT NOT NULL,
+                search_key TEXT NOT NULL,
+                duration INTEGER NOT NULL,
+                plays INTEGER NOT NULL,
+                last_played REAL NOT NULL
+            )
+        ''')
+        self._db.execute('CREATE INDEX IF NOT EXISTS tracks_last_played ON tracks (last_played)')
+        self._db.commit()
+
+    def record(self, video_id: Optional[str], title: str, artist: str, duration: int):
+        """Count a play. Cheap enough for the event loop; the write happens on the next flush"""
+        if not video_id or not title:
+            return
+        key = self._index.key(video_id) or search_key(title, artist)
+        self._index.add(video_id, title, artist, duration, 1, key)
+        pending = self._pending.get(video_id)
+        if pending is None:
+            self._pending[video_id] = [title, artist, key, duration, 1, time.time()]
+        else:
+            pending[4] += 1
+            pending[5] = time.time()
+
+    def search(self, query: str, limit: int = 5, min_score: float = 0.4) -> List[LibraryTrack]:
+        return self._index.search(normalize(query), limit, min_score, self.max_postings)[0]
+
+    def match(self, query: str, min_score: float = 0.75, margin: float = 0.1) -> Optional[LibraryTrack]:
+        """The track ``query`` almost certainly means, or None when it's unclear.
+
+        The best hit has to score at least ``min_score`` and beat the runner-up by
+        ``margin``, so a query that fits several versions of a song is left to YouTube.
+        Tracks the search skipped count as runners-up at the best score they could have had.
+        A query that is exactly one track's search key, like a title played before copied
+        back in, is that track without searching.
+        """
+        key = normalize(query)
+        track = self._index.lookup(key)
+        if track:
+            self.hits += 1
+            return track
+        tracks, ceiling = self._index.search(key, 2, min_score - margin, self.max_postings)
+        runner_up = max(tracks[1].score if len(tracks) > 1 else 0.0, ceiling)
+        if tracks and tracks[0].score >= min_score and tracks[0].score - runner_up >= margin:
+            self.hits += 1
+            return tracks[0]
+        self.misses += 1
+        return None
+
+    async def run(self, interval: float):
+        """Load the index, then write recorded plays every ``interval`` seconds until closed"""
+        async with self._lock:
+            if self.closed:
+                return
+            await self._reload()
+        self.loaded = True
+        print(f"Track library loaded: {len(self._index)} tracks")
+        while not self.closed:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    async def flush(self):
+        # A flush waits for the one before it, and one queued behind the last flush before
+        # close() finds the database closed and leaves it alone
+        async with self._lock:
+            if self.closed or not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            evicted = await asyncio.get_running_loop().run_in_executor(None, self._write, batch)
+            for video_id in evicted:
+                self._index.discard(video_id)
+            index = self._index
+            if index.dead and index.dead >= self.compact_ratio * len(index.video_ids):
+                await self._reload()
+                self.compactions += 1
+
+    async def _reload(self):
+        """Swap in an index read afresh from the database, which only holds live tracks"""
+        index = await asyncio.get_running_loop().run_in_executor(None, self._read)
+        # Plays recorded while reading are only in the old index and the pending batch
+        for video_id, (title, artist, key, duration, plays, _) in self._pending.items():
+            index.add(video_id, title, artist, duration, plays, key)
+        self._index = index
+
+    def _read(self) -> TrackIndex:
+        index = TrackIndex()
+        # Oldest first, so slot order follows recency
+        rows = self._db.execute(
+            'SELECT * FROM (SELECT video_id, title, artist, search_key, duration, plays, last_played FROM tracks '
+            'ORDER BY last_played DESC LIMIT ?) ORDER BY last_played ASC',
+            (self.max_tracks,)
+        )
+        for video_id, title, artist, key, duration, plays, _ in rows:
+            index.add(video_id, title, artist, duration, plays, key)
+        return index
+
+    def _write(self, batch: Dict[str, list]) -> List[str]:
+        with self._db:
+            self._db.executemany(
+                'INSERT INTO tracks (video_id, title, artist, search_key, duration, plays, last_played) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (video_id) DO UPDATE SET title = excluded.title, artist = excluded.artist, '
+                'search_key = excluded.search_key, duration = excluded.duration, plays = plays + excluded.plays, last_played = excluded.last_played',
+                [(video_id, *values) for video_id, values in batch.items()]
+            )
+            self.writes += len(batch)
+            count = self._db.execute('SELECT COUNT(*) FROM tracks').fetchone()[0]
+            if count <= self.max_tracks:
+                return []
+            # Drop a little extra so we don't evict on every flush once full
+            excess = count - self.max_tracks + max(1, self.max_tracks // 100)
+            evicted = [row[0] for row in self._db.execute(
+                'SELECT video_id FROM tracks ORDER BY last_played ASC LIMIT ?', (excess,)
+            )]
+            self._db.executemany('DELETE FROM tracks WHERE video_id = ?', [(video_id,) for video_id in evicted])
+        self.evictions += len(evicted)
+        return evicted
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'tracks': len(self._index),
+            'pending': len(self._pending),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'writes': self.writes,
+            'evictions': self.evictions,
+            'compactions': self.compactions,
+        }
+
+    def close(self):
+        """Close the database; call after the last flush, which waits for any running one"""
+        self.closed = True
+        self._db.close()
@@ -0,0 +1,179 @@
+import asyncio
+import math
+import os
+import re
+import sqlite3
+import time
+from typing import List, NamedTuple, Optional, Set
+
+from reaper import run_claimed
+
+# The summary ffmpeg's ebur128 filter prints when the input ends
+_INTEGRATED = re.compile(r'I:\s+(-?[\d.]+|-inf) LUFS')
+_RANGE = re.compile(r'LRA:\s+(-?[\d.]+) LU')
+_PEAK = re.compile(r'Peak:\s+(-?[\d.]+|-inf) dBFS')
+
+
+class Loudness(NamedTuple):
+    integrated: float  # LUFS
+    true_peak: float  # dBTP
+    loudness_range: float  # LU
+
+
+def parse_ebur128(output: str) -> Optional[Loudness]:
+    """The measurement from ffmpeg's stderr, or None when there is no summary in it"""
+    summary = output[output.rfind('Summary:'):] if 'Summary:' in output else ''
+    integrated, loudness_range, peak = (pattern.search(summary) for pattern in (_INTEGRATED, _RANGE, _PEAK))
+    if not integrated or not peak:
+        return None
+    return Loudness(float(integrated.group(1)), float(peak.group(1)), float(loudness_range.group(1)) if loudness_range else 0.0)
+
+
+def gain_for(loudness: Loudness, target: float = -14.0, max_true_peak: float = -1.0, max_gain: float = 12.0,
+             min_gain: float = 1.0) -> float:
+    """Linear gain bringing a track to ``target`` LUFS without pushing its peak over ``max_true_peak``.
+
+    Corrections under ``min_gain`` dB are dropped, so a track close to the target plays at
+    exactly the configured volume and can still be stream-copied.
+    """
+    if not math.isfinite(loudness.integrated):
+        # Silence
+        return 1.0
+    gain = target - loudness.integrated
+    if math.isfinite(loudness.true_peak):
+        gain = min(gain, max_true_peak - loudness.true_peak)
+    gain = max(-max_gain, min(max_gain, gain))
+    if abs(gain) < min_gain:
+        return 1.0
+    # Half-dB steps are inaudible
+    return 10 ** (round(gain * 2) / 2 / 20)
+
+
+def measure_command(location: str, local: bool = False) -> List[str]:
+    """ffmpeg arguments that decode ``location`` once and print its ebur128 summary"""
+    reconnect = [] if local else ['-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5']
+    return [
+        'ffmpeg', '-nostdin', '-hide_banner', '-nostats', '-threads', '1', *reconnect,
+        '-i', location, '-vn', '-af', 'ebur128=peak=true:framelog=verbose', '-f', 'null', '-',
+    ]
+
+
+class LoudnessCache:
+    """Loudness measurements keyed by video ID, and which guilds normalize with them.
+
+    A track is measured once, by a background ffmpeg running the ebur128 filter over
+    the same stream or cached file that is playing, or over the file the audio cache
+    just stored. After that, normalizing it only changes the volume the playback ffmpeg
+    already applies.
+    """
+
+    def __init__(self, path: str, max_track_seconds: int = 1800, max_concurrent: int = 1):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.max_track_seconds = max_track_seconds
+        self.measured = 0
+        self.failures = 0
+        self.pids = set()  # ffmpeg processes measuring right now
+        self._measuring: Set[str] = set()
+        self._tasks = set()
+        self._slots = asyncio.Semaphore(max_concurrent)
+
+        self._db = sqlite3.connect(path)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS loudness (
+                video_id TEXT PRIMARY KEY,
+                integrated REAL NOT NULL,
+                true_peak REAL NOT NULL,
+                loudness_range REAL NOT NULL,
+                measured_at REAL NOT NULL
+            )
+        ''')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS guilds (
+                guild_id INTEGER PRIMARY KEY,
+                normalize INTEGER NOT NULL
+            )
+        ''')
+        self._db.commit()
+        self._count = self._db.execute('SELECT COUNT(*) FROM loudness').fetchone()[0]
+        # Few guilds opt in, so the whole setting lives in memory
+        self._guilds = {row[0] for row in self._db.execute('SELECT guild_id FROM guilds WHERE normalize = 1')}
+
+    def normalizes(self, guild_id: Optional[int]) -> bool:
+        return guild_id in self._guilds
+
+    def set_normalize(self, guild_id: int, enabled: bool):
+        self._db.execute('INSERT OR REPLACE INTO guilds (guild_id, normalize) VALUES (?, ?)', (guild_id, int(enabled)))
+        self._db.commit()
+        if enabled:
+            self._guilds.add(guild_id)
+        else:
+            self._guilds.discard(guild_id)
+
+    def get(self, video_id: Optional[str]) -> Optional[Loudness]:
+        if not video_id:
+            return None
+        row = self._db.execute(
+            'SELECT integrated, true_peak, loudness_range FROM loudness WHERE video_id = ?', (video_id,)
+        ).fetchone()
+        return Loudness(*row) if row else None
+
+    def wants(self, video_id: Optional[str]) -> bool:
+        """Whether a track nobody has measured yet could be normalized by some guild"""
+        return bool(self._guilds) and video_id not in self._measuring and self.get(video_id) is None
+
+    def measurable(self, video_id: Optional[str], duration: Optional[int]) -> bool:
+        # Live streams have no duration and never end
+        return bool(video_id) and bool(duration) and duration <= self.max_track_seconds
+
+    def schedule_measure(self, video_id: Optional[str], location: str, duration: Optional[int], local: bool = False):
+        """Measure a track in the background, unless it's measured already or can't be"""
+        if not self.measurable(video_id, duration) or video_id in self._measuring:
+            return
+        self._measuring.add(video_id)
+        task = asyncio.get_running_loop().create_task(self._measure(video_id, location, local))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _measure(self, video_id: str, location: str, local: bool):
+        try:
+            returncode, output = await run_claimed(measure_command(location, local), self.pids, self._slots)
+            loudness = parse_ebur128(output) if returncode == 0 else None
+            if loudness is None:
+                raise Exception(output.strip()[-300:] or f"ffmpeg exited with {returncode}")
+
+            existed = self._db.execute('SELECT 1 FROM loudness WHERE video_id = ?', (video_id,)).fetchone()
+            self._db.execute(
+                'INSERT OR REPLACE INTO loudness (video_id, integrated, true_peak, loudness_range, measured_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (video_id, *loudness, time.time())
+            )
+            self._db.commit()
+            if not existed:
+                self._count += 1
+            self.measured += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error measuring loudness of {video_id}: {str(e)}")
+            self.failures += 1
+        finally:
+            self._measuring.discard(video_id)
+
+    def stats(self) -> dict:
+        return {
+            'entries': self._count,
+            'guilds': len(self._guilds),
+            'measured': self.measured,
+            'failures': self.failures,
+            'measuring': len(self._measuring),
+        }
+
+    def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        self._db.close()
@@ -0,0 +1,198 @@
+import bisect
+import math
+import threading
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Registry:
+    """Metrics exposed together, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, '_Metric'] = {}
+
+    def register(self, metric: '_Metric'):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> Optional['_Metric']:
+        return self._metrics.get(name)
+
+    def __iter__(self):
+        return iter(list(self._metrics.values()))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            try:
+                lines.extend(metric.samples())
+            except Exception as e:
+                # A broken callback shouldn't take the whole endpoint down
+                lines.append(f"# error collecting {metric.name}: {str(e)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = (), registry: Optional[Registry] = REGISTRY):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self._children: Dict[Tuple[str, ...], '_Metric'] = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values) -> '_Metric':
+        """The child metric for one combination of label values"""
+        if len(values) != len(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}")
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self) -> '_Metric':
+        raise NotImplementedError
+
+    def children(self):
+        """(label values, child) pairs seen so far"""
+        return sorted(self._children.items())
+
+    def _series(self):
+        return self.children() if self.label_names else [((), self)]
+
+
+class _Value(_Metric):
+    """A single number per label set, either stored or read from a callback.
+
+    The callback returns a number, or for labeled metrics a dict of label values
+    (a tuple, or a plain value for one label) to numbers.
+    """
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = (), registry: Optional[Registry] = REGISTRY,
+                 function: Optional[Callable] = None):
+        super().__init__(name, description, labels, registry)
+        self.function = function
+        self.value = 0
+
+    def _new_child(self):
+        return type(self)(self.name, self.description, registry=None)
+
+    def samples(self):
+        if self.function is None:
+            series = [(values, child.value) for values, child in self._series()]
+        elif self.label_names:
+            series = sorted(
+                (values if isinstance(values, tuple) else (values,), value)
+                for values, value in self.function().items()
+            )
+        else:
+            series = [((), self.function())]
+        for values, value in series:
+            yield f"{self.name}{_format_labels(self.label_names, values)} {_format_value(value)}"
+
+
+class Counter(_Value):
+    type = 'counter'
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+class Gauge(_Value):
+    type = 'gauge'
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram, safe to observe from audio and executor threads"""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, description: str, buckets: Sequence[float] = DEFAULT_BUCKETS,
+                 labels: Sequence[str] = (), registry: Optional[Registry] = REGISTRY):
+        super().__init__(name, description, labels, registry)
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def _new_child(self):
+        return Histogram(self.name, self.description, self.buckets, registry=None)
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th percentile (0 < q <= 1)"""
+        with self._lock:
+            if not self.count:
+                return 0.0
+            target = q * self.count
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if seen >= target:
+                    return self.buckets[index] if index < len(self.buckets) else float('inf')
+        return float('inf')
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def samples(self):
+        for values, child in self._series():
+            with child._lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(child.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.label_names, values, le)} {cumulative}"
+            labels = _format_labels(self.label_names, values)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
@@ -0,0 +1,184 @@
+import json
+import os
+import random
+import re
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+
+def apply_record(states: Dict[int, dict], record: dict):
+    """Apply one journal record to plain-data guild states"""
+    guild_id = record['g']
+    op = record['op']
+    if op == 'forget':
+        states.pop(guild_id, None)
+        return
+    state = states.setdefault(guild_id, {
+        'queue': deque(), 'current': None, 'position': 0.0, 'paused': False,
+        'voice_channel': None, 'text_channel': None,
+    })
+    queue = state['queue']
+    args = record.get('args', [])
+
+    if op in ('append', 'insert'):
+        if op == 'append':
+            queue.append(args[0])
+        else:
+            queue.insert(min(max(args[0], 0), len(queue)), args[1])
+    elif op == 'extend':
+        queue.extend(args[0])
+    elif op == 'popleft':
+        queue.popleft()
+    elif op == 'remove':
+        del queue[args[0]]
+    elif op == 'move':
+        song = queue[args[0]]
+        del queue[args[0]]
+        queue.insert(min(max(args[1], 0), len(queue)), song)
+    elif op == 'skip_to':
+        for _ in range(min(max(args[0], 0), len(queue))):
+            queue.popleft()
+    elif op == 'clear':
+        queue.clear()
+    elif op == 'shuffle':
+        # Same permutation SongQueue.shuffle produced from this seed
+        songs = list(queue)
+        random.Random(args[0]).shuffle(songs)
+        state['queue'] = deque(songs)
+    elif op == 'current':
+        state['current'] = args[0]
+        state['position'] = args[1] if len(args) > 1 else 0.0
+        state['paused'] = False
+    elif op == 'position':
+        state['position'] = args[0]
+    elif op == 'paused':
+        state['paused'] = args[0]
+    elif op == 'channel':
+        state['voice_channel'], state['text_channel'] = args
+
+
+class QueueJournal:
+    """Append-only log of queue changes, periodically folded into a snapshot.
+
+    Records go to numbered segment files (``<name>.<n>.jsonl``). Compaction starts a
+    new segment and merges the snapshot with the older segments on a background
+    thread; the snapshot remembers the last segment it includes, so a crash at any
+    point replays each record exactly once.
+    """
+
+    def __init__(self, directory: str, name: str = 'queues', compact_every: int = 50000):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.name = name
+        self.compact_every = compact_every
+        self.snapshot_path = os.path.join(directory, f"{name}.snapshot.json")
+        self.records = 0
+        self.compactions = 0
+        self._compacting: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        segments = self._segments()
+        # Compaction deletes the segments it folded in, so the snapshot may be all that says how far we got
+        self._segment = max(segments[-1] if segments else 0, self._snapshot_segment()) + 1
+        self._file = None
+        self._since_compaction = 0
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{self.name}.{number}.jsonl")
+
+    def _segments(self) -> List[int]:
+        pattern = re.compile(rf'^{re.escape(self.name)}\.(\d+)\.jsonl$')
+        return sorted(int(m.group(1)) for m in map(pattern.match, os.listdir(self.directory)) if m)
+
+    def _snapshot_segment(self) -> int:
+        """Last segment folded into the snapshot, read without parsing the whole file"""
+        try:
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                head = f.read(64)
+        except FileNotFoundError:
+            return 0
+        match = re.match(r'\{"segment":(\d+)', head)
+        return int(match.group(1)) if match else self._read_snapshot()[0]
+
+    def _read_snapshot(self) -> tuple:
+        try:
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return 0, {}
+        states = {}
+        for guild_id, state in snapshot['guilds'].items():
+            state['queue'] = deque(state['queue'])
+            states[int(guild_id)] = state
+        return snapshot['segment'], states
+
+    def _replay(self, states: Dict[int, dict], segments: List[int]):
+        for number in segments:
+            with open(self._segment_path(number), encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn write from a crash; nothing after it made it to disk either
+                        break
+                    try:
+                        apply_record(states, record)
+                    except (IndexError, KeyError):
+                        pass
+
+    def load(self) -> Dict[int, dict]:
+        """Saved state of every guild: queue, current song and position, channels"""
+        last, states = self._read_snapshot()
+        self._replay(states, [n for n in self._segments() if last < n < self._segment])
+        return states
+
+    def record(self, guild_id: int, op: str, *args):
+        if self._file is None:
+            self._file = open(self._segment_path(self._segment), 'a', encoding='utf-8')
+        # Written straight through to the OS, so a crash of this process loses nothing
+        self._file.write(json.dumps({'g': guild_id, 'op': op, 'args': args}, separators=(',', ':')) + '\n')
+        self._file.flush()
+        self.records += 1
+        self._since_compaction += 1
+        if self._since_compaction >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        """Start a new segment and fold the finished ones into the snapshot in the background"""
+        if self._compacting and self._compacting.is_alive():
+            return
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        upto = self._segment
+        self._segment += 1
+        self._since_compaction = 0
+        self._compacting = threading.Thread(target=self._compact, args=(upto,), daemon=True, name='queue-journal-compact')
+        self._compacting.start()
+
+    def _compact(self, upto: int):
+        with self._lock:
+            last, states = self._read_snapshot()
+            segments = [n for n in self._segments() if last < n <= upto]
+            self._replay(states, segments)
+            snapshot = {
+                'segment': upto,
+                'guilds': {str(guild_id): dict(state, queue=list(state['queue'])) for guild_id, state in states.items()},
+            }
+            tmp_path = f"{self.snapshot_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            for number in self._segments():
+                if number <= upto:
+                    os.remove(self._segment_path(number))
+            self.compactions += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._compacting:
+            self._compacting.join()
@@ -0,0 +1,85 @@
+import asyncio
+import os
+import signal
+from typing import Iterable, List, Optional, Set, Tuple
+
+
+def child_processes(name: str, parent: Optional[int] = None) -> List[int]:
+    """PIDs of live child processes of ``parent`` (default: this process) named ``name``.
+
+    Reads /proc, so it finds nothing on systems without it.
+    """
+    parent = os.getpid() if parent is None else parent
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return []
+    pids = []
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'rb') as f:
+                stat = f.read().decode(errors='replace')
+        except OSError:
+            continue
+        # The name is in parentheses and may itself contain spaces or parentheses
+        end = stat.rindex(')')
+        fields = stat[end + 2:].split()
+        if stat[stat.index('(') + 1:end] == name and fields[0] != 'Z' and int(fields[1]) == parent:
+            pids.append(int(entry))
+    return pids
+
+
+async def run_claimed(command: List[str], pids: Set[int], slots: asyncio.Semaphore) -> Tuple[int, str]:
+    """Run ``command`` once one of ``slots`` is free; returns its exit code and stderr.
+
+    Its PID sits in ``pids`` while it runs, so the reaper leaves it alone, and it is
+    killed rather than left running on its own if the caller is cancelled.
+    """
+    async with slots:
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        pids.add(process.pid)
+        try:
+            _, stderr = await process.communicate()
+        finally:
+            pids.discard(process.pid)
+            if process.returncode is None:
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+    return process.returncode, stderr.decode(errors='replace')
+
+
+class OrphanReaper:
+    """Kills child processes nothing claims any more, like ffmpeg left behind by a source
+    that was never cleaned up.
+
+    A process has to be unclaimed on two sweeps in a row before it is killed, so one
+    spawned between collecting the claimed PIDs and reading /proc is left alone.
+    """
+
+    def __init__(self, name: str = 'ffmpeg'):
+        self.name = name
+        self.killed = 0
+        self._suspects = set()
+
+    def sweep(self, claimed: Iterable[int]) -> List[int]:
+        """Kill the orphans found; returns their PIDs. Blocks briefly, so run it in an executor."""
+        unclaimed = set(child_processes(self.name)) - set(claimed)
+        orphans = sorted(unclaimed & self._suspects)
+        self._suspects = unclaimed - set(orphans)
+        for pid in orphans:
+            try:
+                os.kill(pid, signal.SIGKILL)
+                # Reap it here, since whatever started it has lost track of it
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+            self.killed += 1
+        return orphans
@@ -0,0 +1,217 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from metrics import Counter, Histogram
+
+# Priority classes, most urgent first
+NOW_PLAYING = 0  # The song about to play, and commands someone is waiting on
+PREFETCH = 1  # Songs close to the head of a queue
+BULK = 2  # Playlist pages and Spotify tracks further down
+PRIORITY_NAMES = ('now_playing', 'prefetch', 'bulk')
+
+queue_wait_seconds = Histogram(
+    'extract_queue_wait_seconds', 'Time an extraction waited in the scheduler before starting', labels=('priority',)
+)
+jobs_cancelled = Counter('extract_jobs_cancelled_total', 'Queued extractions dropped before they started', labels=('priority',))
+
+
+class JobCancelled(Exception):
+    """Raised to everyone waiting on a job that was dropped before it started"""
+
+
+class Job:
+    """One unit of work waiting for, or holding, a scheduler slot"""
+
+    def __init__(self, guild_id: int, priority: int, factory: Callable[[], Awaitable]):
+        self.guild_id = guild_id
+        self.priority = priority
+        self.factory = factory
+        self.guilds = {guild_id}  # Every guild waiting on the result
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.perf_counter()
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> bool:
+        return self.task is None and not self.future.done()
+
+
+class ExtractionScheduler:
+    """Decides which extraction gets the next free worker.
+
+    Jobs are taken from the most urgent priority class first and round-robin between
+    guilds within a class, so one guild's huge playlist can't hold up anyone else's
+    next song. At most ``max_concurrent`` jobs run at once (the extraction pool's
+    size), ``reserved`` of those slots are never given to bulk work, and prefetch and
+    bulk jobs are capped at ``per_guild`` running per guild. Running jobs can't be
+    interrupted in the worker, so cancellation only drops jobs still queued.
+    """
+
+    def __init__(self, max_concurrent: int = 2, per_guild: int = 2, reserved: int = 1):
+        self.max_concurrent = max(max_concurrent, 1)
+        self.per_guild = max(per_guild, 1)
+        self.reserved = min(max(reserved, 0), self.max_concurrent - 1)
+        self.running = 0
+        self.completed = 0
+        self._queues: List[OrderedDict] = [OrderedDict() for _ in PRIORITY_NAMES]  # guild ID -> deque of jobs
+        self._running: Dict[int, int] = {}  # guild ID -> background jobs running
+        # guild ID -> queued jobs it joined through share(), which sit in another guild's queue
+        self._shared: Dict[int, Set[Job]] = {}
+
+    def submit(self, guild_id: int, priority: int, factory: Callable[[], Awaitable]) -> Job:
+        """Queue ``factory()`` to run when a slot is free; await ``job.future`` for the result"""
+        job = Job(guild_id, priority, factory)
+        self._enqueue(job)
+        self._dispatch()
+        return job
+
+    async def run(self, guild_id: int, priority: int, factory: Callable[[], Awaitable]):
+        job = self.submit(guild_id, priority, factory)
+        try:
+            return await asyncio.shield(job.future)
+        except asyncio.CancelledError:
+            self.cancel(job)
+            raise
+
+    def share(self, job: Job, guild_id: int, priority: int):
+        """Another guild wants the same result; it gets the job at least its priority"""
+        if job.pending and guild_id not in job.guilds:
+            self._shared.setdefault(guild_id, set()).add(job)
+        job.guilds.add(guild_id)
+        self.promote(job, priority)
+
+    def promote(self, job: Job, priority: int):
+        """Move a queued job up to a more urgent class"""
+        if not job.pending or priority >= job.priority:
+            return
+        self._unqueue(job)
+        job.priority = priority
+        self._enqueue(job)
+        self._dispatch()
+
+    def cancel(self, job: Job) -> bool:
+        """Drop a job that hasn't started; its waiters get JobCancelled"""
+        if not job.pending:
+            return False
+        self._unqueue(job)
+        self._forget(job)
+        # An exception rather than a cancellation, so waiters can tell it from their own
+        job.future.set_exception(JobCancelled(f"Dropped from the {PRIORITY_NAMES[job.priority]} queue"))
+        job.future.exception()
+        jobs_cancelled.labels(PRIORITY_NAMES[job.priority]).inc()
+        return True
+
+    def cancel_guild(self, guild_id: int, priorities: Iterable[int] = (NOW_PLAYING, PREFETCH, BULK)) -> int:
+        """Drop a guild's queued jobs; jobs other guilds also wait on stay queued for them"""
+        priorities = set(priorities)
+        jobs = [job for priority in priorities for job in self._queues[priority].get(guild_id, ())]
+        jobs += [job for job in self._shared.get(guild_id, ()) if job.priority in priorities]
+        cancelled = 0
+        for job in jobs:
+            job.guilds.discard(guild_id)
+            self._unshare(guild_id, job)
+            if not job.guilds:
+                if self.cancel(job):
+                    cancelled += 1
+            elif job.guild_id == guild_id:
+                # Queued under the guild that's leaving; hand it to one still waiting
+                self._unqueue(job)
+                job.guild_id = next(iter(job.guilds))
+                self._unshare(job.guild_id, job)
+                self._enqueue(job)
+        self._dispatch()
+        return cancelled
+
+    def queued(self) -> Dict[str, int]:
+        """Jobs waiting per priority class"""
+        return {name: sum(len(jobs) for jobs in queue.values()) for name, queue in zip(PRIORITY_NAMES, self._queues)}
+
+    def guild_queued(self, guild_id: int) -> int:
+        return sum(len(queue.get(guild_id, ())) for queue in self._queues)
+
+    def _enqueue(self, job: Job):
+        queue = self._queues[job.priority]
+        if job.guild_id not in queue:
+            queue[job.guild_id] = deque()
+        queue[job.guild_id].append(job)
+
+    def _unqueue(self, job: Job):
+        queue = self._queues[job.priority]
+        jobs = queue.get(job.guild_id)
+        if jobs is None:
+            return
+        try:
+            jobs.remove(job)
+        except ValueError:
+            return
+        if not jobs:
+            del queue[job.guild_id]
+
+    def _unshare(self, guild_id: int, job: Job):
+        jobs = self._shared.get(guild_id)
+        if jobs is not None:
+            jobs.discard(job)
+            if not jobs:
+                del self._shared[guild_id]
+
+    def _forget(self, job: Job):
+        """The job left the queues; the guilds that shared it no longer need to find it"""
+        for guild_id in job.guilds:
+            if guild_id != job.guild_id:
+                self._unshare(guild_id, job)
+
+    def _next_job(self) -> Optional[Job]:
+        for priority, queue in enumerate(self._queues):
+            if priority == BULK and self.running >= self.max_concurrent - self.reserved:
+                break
+            for guild_id in list(queue):
+                if priority != NOW_PLAYING and self._running.get(guild_id, 0) >= self.per_guild:
+                    continue
+                jobs = queue[guild_id]
+                job = jobs.popleft()
+                if jobs:
+                    # The guild goes to the back of the line for its next job
+                    queue.move_to_end(guild_id)
+                else:
+                    del queue[guild_id]
+                return job
+        return None
+
+    def _dispatch(self):
+        while self.running < self.max_concurrent:
+            job = self._next_job()
+            if job is None:
+                return
+            self._start(job)
+
+    def _start(self, job: Job):
+        self._forget(job)
+        queue_wait_seconds.labels(PRIORITY_NAMES[job.priority]).observe(time.perf_counter() - job.enqueued_at)
+        self.running += 1
+        if job.priority != NOW_PLAYING:
+            self._running[job.guild_id] = self._running.get(job.guild_id, 0) + 1
+        job.task = asyncio.ensure_future(job.factory())
+        job.task.add_done_callback(lambda task: self._finished(job, task))
+
+    def _finished(self, job: Job, task: asyncio.Task):
+        self.running -= 1
+        self.completed += 1
+        if job.priority != NOW_PLAYING:
+            count = self._running[job.guild_id] - 1
+            if count:
+                self._running[job.guild_id] = count
+            else:
+                del self._running[job.guild_id]
+        if job.future.done():
+            # Whoever was waiting gave up; still mark any error as seen
+            if not task.cancelled():
+                task.exception()
+        elif task.cancelled():
+            job.future.cancel()
+        elif task.exception() is not None:
+            job.future.set_exception(task.exception())
+        else:
+            job.future.set_result(task.result())
+        self._dispatch()
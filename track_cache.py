@@ -0,0 +1,198 @@
+import asyncio
+import os
+import sqlite3
+import time
+from typing import Dict, NamedTuple, Optional, Set, Tuple
+
+
+class CachedResolution(NamedTuple):
+    video_id: str
+    title: str
+    duration: int
+
+
+class TrackResolutionCache:
+    """Persistent Spotify track -> YouTube video mapping backed by SQLite.
+
+    Lookups read the database on the event loop, which never waits on a sync. New
+    resolutions, last-used times and expired entries are buffered and written in
+    batches from a background task, the way the track library writes plays.
+    """
+
+    def __init__(self, path: str, ttl: float = 30 * 24 * 3600, max_entries: int = 100_000):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.closed = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writes = 0
+
+        # spotify_id -> (isrc, video_id, title, duration, created_at) not yet written,
+        # then the batch being written, which lookups still see until it's committed
+        self._pending: Dict[str, tuple] = {}
+        self._writing: Dict[str, tuple] = {}
+        # spotify_id -> last time it was looked up, and entries found expired
+        self._used: Dict[str, float] = {}
+        self._expired: Set[str] = set()
+
+        # Writes go through their own connection, from one executor thread at a time
+        self._writer = sqlite3.connect(path, check_same_thread=False)
+        self._writer.execute('PRAGMA journal_mode=WAL')
+        self._writer.execute('PRAGMA synchronous=NORMAL')
+        self._writer.execute('''
+            CREATE TABLE IF NOT EXISTS resolutions (
+                spotify_id TEXT PRIMARY KEY,
+                isrc TEXT,
+                video_id TEXT NOT NULL,
+                title TEXT NOT NULL,
+                duration INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        ''')
+        self._writer.execute('CREATE INDEX IF NOT EXISTS resolutions_isrc ON resolutions (isrc)')
+        self._writer.execute('CREATE INDEX IF NOT EXISTS resolutions_last_used ON resolutions (last_used)')
+        self._writer.commit()
+        self._lock = asyncio.Lock()
+        self._db = sqlite3.connect(path)
+        self._count = self._db.execute('SELECT COUNT(*) FROM resolutions').fetchone()[0]
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _buffered(self, spotify_id: Optional[str], isrc: Optional[str]) -> Optional[Tuple[str, tuple]]:
+        for batch in (self._pending, self._writing):
+            if spotify_id in batch:
+                return spotify_id, batch[spotify_id]
+        if isrc:
+            for batch in (self._pending, self._writing):
+                for key, entry in batch.items():
+                    if entry[0] == isrc:
+                        return key, entry
+        return None
+
+    def get(self, spotify_id: Optional[str], isrc: Optional[str] = None) -> Optional[CachedResolution]:
+        now = time.time()
+        row = None
+        buffered = self._buffered(spotify_id, isrc)
+        if buffered:
+            key, (_, video_id, title, duration, created_at) = buffered
+            row = key, video_id, title, duration, created_at
+        if row is None and spotify_id and spotify_id not in self._expired:
+            row = self._db.execute(
+                'SELECT spotify_id, video_id, title, duration, created_at FROM resolutions WHERE spotify_id = ?',
+                (spotify_id,)
+            ).fetchone()
+        # The same recording is often released under several Spotify IDs
+        if row is None and isrc:
+            row = self._db.execute(
+                'SELECT spotify_id, video_id, title, duration, created_at FROM resolutions '
+                'WHERE isrc = ? ORDER BY created_at DESC LIMIT 1',
+                (isrc,)
+            ).fetchone()
+            if row is not None and row[0] in self._expired:
+                row = None
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        key, video_id, title, duration, created_at = row
+        if now - created_at > self.ttl:
+            if key not in self._expired:
+                self._expired.add(key)
+                self._count -= 1
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+        self._used[key] = now
+        self.hits += 1
+        return CachedResolution(video_id, title, duration)
+
+    def put(self, spotify_id: Optional[str], isrc: Optional[str], video_id: str, title: str, duration: int):
+        """Remember a resolution. Cheap enough for the event loop; the write happens on the next flush"""
+        if not spotify_id or not video_id:
+            return
+        known = (
+            spotify_id in self._pending or spotify_id in self._writing
+            or (spotify_id not in self._expired and self._db.execute(
+                'SELECT 1 FROM resolutions WHERE spotify_id = ?', (spotify_id,)
+            ).fetchone() is not None)
+        )
+        if not known:
+            self._count += 1
+        self._pending[spotify_id] = (isrc, video_id, title, int(duration or 0), time.time())
+
+    async def run(self, interval: float):
+        """Write buffered changes every ``interval`` seconds until closed"""
+        while not self.closed:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            if self.closed or not (self._pending or self._used or self._expired):
+                return
+            self._writing, self._pending = self._pending, {}
+            used, self._used = self._used, {}
+            # Expired entries stay skipped until they're gone from the database
+            expired = set(self._expired)
+            try:
+                evicted = await asyncio.get_running_loop().run_in_executor(
+                    None, self._write, self._writing, used, expired
+                )
+            finally:
+                self._writing = {}
+            self._expired -= expired
+            self._count -= evicted
+            self.evictions += evicted
+
+    def _write(self, batch: Dict[str, tuple], used: Dict[str, float], expired: Set[str]) -> int:
+        with self._writer:
+            # A resolution found expired and then looked up again is in the batch as a new one
+            self._writer.executemany(
+                'DELETE FROM resolutions WHERE spotify_id = ?', [(key,) for key in expired if key not in batch]
+            )
+            self._writer.executemany(
+                'INSERT OR REPLACE INTO resolutions (spotify_id, isrc, video_id, title, duration, created_at, last_used) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(key, *entry, used.get(key, entry[4])) for key, entry in batch.items()]
+            )
+            self._writer.executemany(
+                'UPDATE resolutions SET last_used = ? WHERE spotify_id = ?',
+                [(last_used, key) for key, last_used in used.items() if key not in batch]
+            )
+            self.writes += len(batch)
+            count = self._writer.execute('SELECT COUNT(*) FROM resolutions').fetchone()[0]
+            if count <= self.max_entries:
+                return 0
+            # Drop a little extra so we don't evict on every flush once full
+            excess = count - self.max_entries + max(1, self.max_entries // 100)
+            return self._writer.execute(
+                'DELETE FROM resolutions WHERE spotify_id IN '
+                '(SELECT spotify_id FROM resolutions ORDER BY last_used ASC LIMIT ?)',
+                (excess,)
+            ).rowcount
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': self._count,
+            'pending': len(self._pending),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        """Close the database; call after the last flush, which waits for any running one"""
+        self.closed = True
+        self._db.close()
+        self._writer.close()